@@ -1,17 +1,82 @@
 import os
+import time
 import random
+import asyncio
+import hashlib
+import tempfile
+import threading
+import collections
 import json # Added json import
 
+QUOTA_WINDOW_SECONDS = 60  # RPM/TPM windows
+
+
+class KeyLease:
+    """A scheduled request on one key; hand it back with release_slot."""
+    __slots__ = ("key", "event")
+
+    def __init__(self, key, event):
+        self.key = key
+        self.event = event  # [timestamp, tokens] entry in the key's usage window
+
+
+class _KeyUsage:
+    """Rolling request/token window and in-flight count for one key."""
+    __slots__ = ("events", "tokens", "in_flight")
+
+    def __init__(self):
+        self.events = collections.deque()  # [timestamp, tokens], oldest first
+        self.tokens = 0
+        self.in_flight = 0
+
+    def evict(self, now):
+        cutoff = now - QUOTA_WINDOW_SECONDS
+        while self.events and self.events[0][0] <= cutoff:
+            self.tokens -= self.events.popleft()[1]
+
+
 class APIKeyManager:
     """
     Manages rotation and fallback for multiple API keys.
     API keys are loaded from config.json under the "api_keys" section.
+
+    Each key carries a health state: a cooldown deadline set when it is rate
+    limited (from Retry-After, or exponential backoff with jitter) and a
+    count of consecutive throttles. get_key() skips cooling keys without
+    waiting; only acquire_key() waits, and only when every key is cooling.
+    Health state survives restarts in a small JSON file (keys are stored by
+    fingerprint, never in clear), written on a background thread whenever it
+    changes (flush_state() waits for it).
+
+    Keys may be listed as plain strings or as {"key", "rpm", "tpm",
+    "max_concurrency"} objects. acquire_slot() schedules each request on the
+    ready key with the most remaining RPM/TPM headroom in the rolling
+    one-minute window, respecting per-key concurrency caps, so the pool's
+    combined quota is used before any single key is pushed into a 429.
     """
-    def __init__(self, service_name="GEMINI", config_path="projects/agent_budget_guard/config.json"): # Modified init
+    def __init__(self, service_name="GEMINI", config_path="projects/agent_budget_guard/config.json", # Modified init
+                 state_path=None, base_backoff=1.0, max_backoff=60.0):
         self.service_name = service_name
         self.config_path = config_path
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        if state_path is None:
+            state_path = os.path.join(os.path.dirname(os.path.abspath(config_path)), "data",
+                                      f"api_keys_{service_name.lower()}.json")
+        self.state_path = state_path
+        self.quotas = {} # key -> {"rpm", "tpm", "max_concurrency"}; missing limits are unlimited
         self.api_keys = self._load_api_keys()
         self.current_key_index = 0
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._usage = {key: _KeyUsage() for key in self.api_keys}
+        self.key_state = {} # key -> {"cooldown_until": epoch seconds, "failures": consecutive 429s}
+        self._save_lock = threading.Lock()
+        self._save_cond = threading.Condition()
+        self._save_pending = False
+        self._saving = False
+        self._saver = None
+        self._load_state()
         if not self.api_keys:
             print(f"Warning: No API keys found for {service_name} in {config_path}. Operations might fail.")
 
@@ -21,19 +86,284 @@ class APIKeyManager:
             with open(self.config_path, 'r') as f:
                 config = json.load(f)
             if "api_keys" in config and self.service_name in config["api_keys"]:
-                keys = config["api_keys"][self.service_name]
+                for entry in config["api_keys"][self.service_name]:
+                    if isinstance(entry, dict):
+                        keys.append(entry["key"])
+                        self.quotas[entry["key"]] = {limit: entry.get(limit)
+                                                     for limit in ("rpm", "tpm", "max_concurrency")}
+                    else:
+                        keys.append(entry)
         except FileNotFoundError:
             print(f"Error: Config file not found at {self.config_path}")
         except json.JSONDecodeError:
             print(f"Error: Invalid JSON in config file at {self.config_path}")
-        
-        random.shuffle(keys) # Shuffle to distribute usage
+
+        # Config order is kept: persisted health state, not a shuffle, spreads load away from throttled keys
         return keys
 
+    @staticmethod
+    def fingerprint(key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key in self.api_keys:
+            state = saved.get(self.fingerprint(key))
+            if state and (state.get("cooldown_until", 0) > now or state.get("failures", 0)):
+                self.key_state[key] = {"cooldown_until": state.get("cooldown_until", 0),
+                                       "failures": state.get("failures", 0)}
+
+    def save_state(self):
+        """Writes the health state atomically (temp file in the same directory + rename)."""
+        if not self.state_path:
+            return
+        with self._save_lock:
+            with self._lock:
+                state = {self.fingerprint(key): dict(s) for key, s in self.key_state.items()}
+            try:
+                directory = os.path.dirname(os.path.abspath(self.state_path))
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix=".api_keys-", dir=directory)
+                try:
+                    with os.fdopen(fd, "w") as f:
+                        json.dump(state, f)
+                    os.replace(tmp_path, self.state_path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+            except OSError as e:
+                print(f"Warning: Could not save API key state to {self.state_path}: {e}")
+
+    def flush_state(self, timeout=None):
+        """Waits until state changes so far are on disk. Returns False on timeout."""
+        with self._save_cond:
+            return self._save_cond.wait_for(lambda: not self._save_pending and not self._saving, timeout)
+
+    def _save_soon(self):
+        """Queues a save_state on the background saver; changes made meanwhile share it."""
+        if not self.state_path:
+            return
+        with self._save_cond:
+            self._save_pending = True
+            if self._saver is None:
+                self._saver = threading.Thread(target=self._save_loop, name="api-key-state", daemon=True)
+                self._saver.start()
+            self._save_cond.notify_all()
+
+    def _save_loop(self):
+        while True:
+            with self._save_cond:
+                self._save_cond.wait_for(lambda: self._save_pending)
+                self._save_pending = False
+                self._saving = True
+            try:
+                self.save_state()
+            finally:
+                with self._save_cond:
+                    self._saving = False
+                    self._save_cond.notify_all()
+
+    def cooldown_remaining(self, key):
+        """Seconds until key may be used again (0 if it is ready)."""
+        state = self.key_state.get(key)
+        return max(0.0, state["cooldown_until"] - time.time()) if state else 0.0
+
+    def mark_rate_limited(self, key, retry_after=None):
+        """
+        Puts key on cooldown for retry_after seconds when the provider gave
+        one, otherwise for base_backoff * 2^(throttles-1), capped at
+        max_backoff, with full jitter. Returns the cooldown in seconds.
+        """
+        with self._lock:
+            state = self.key_state.setdefault(key, {"cooldown_until": 0, "failures": 0})
+            state["failures"] += 1
+            if retry_after is not None:
+                delay = max(0.0, float(retry_after))
+            else:
+                delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** (state["failures"] - 1)))
+            state["cooldown_until"] = time.time() + delay
+        self._save_soon()
+        return delay
+
+    def mark_success(self, key):
+        """Clears key's throttle history after a successful call."""
+        with self._lock:
+            changed = self.key_state.pop(key, None) is not None
+        if changed:
+            self._save_soon()
+
     def get_key(self):
+        """
+        The current key if it is ready, else the next ready key in rotation
+        order (which becomes current). None if there are no keys or all are
+        cooling; never waits.
+        """
+        if not self.api_keys:
+            return None
+        with self._lock:
+            for offset in range(len(self.api_keys)):
+                index = (self.current_key_index + offset) % len(self.api_keys)
+                if self.cooldown_remaining(self.api_keys[index]) == 0:
+                    self.current_key_index = index
+                    return self.api_keys[index]
+        return None
+
+    def next_ready_in(self):
+        """Seconds until some key is ready (0 if one is ready now, None if there are no keys)."""
         if not self.api_keys:
             return None
-        return self.api_keys[self.current_key_index]
+        return min(self.cooldown_remaining(key) for key in self.api_keys)
+
+    def acquire_key(self, deadline=None):
+        """
+        get_key, but when every key is cooling, sleeps until the first one is
+        ready. Returns None if there are no keys or deadline (time.monotonic())
+        would pass first.
+        """
+        while True:
+            key = self.get_key()
+            wait = self.next_ready_in()
+            if key is not None or wait is None:
+                return key
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return None
+            time.sleep(wait)
+
+    async def acquire_key_async(self, deadline=None):
+        """acquire_key for asyncio callers; waits with asyncio.sleep."""
+        while True:
+            key = self.get_key()
+            wait = self.next_ready_in()
+            if key is not None or wait is None:
+                return key
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return None
+            await asyncio.sleep(wait)
+
+    def headroom(self, key, now=None):
+        """
+        Share of key's quota left in the current window: the smaller of its
+        RPM and TPM shares (1.0 for a key with no limits).
+        """
+        now = time.time() if now is None else now
+        usage = self._usage[key]
+        usage.evict(now)
+        quota = self.quotas.get(key, {})
+        shares = [1.0]
+        if quota.get("rpm"):
+            shares.append(1 - len(usage.events) / quota["rpm"])
+        if quota.get("tpm"):
+            shares.append(1 - usage.tokens / quota["tpm"])
+        return min(shares)
+
+    def _try_acquire(self, tokens, exclude=(), reserve=True):
+        """
+        One scheduling attempt under the lock: (lease or None, seconds worth
+        waiting). With reserve=False nothing is recorded and the lease is only
+        a verdict.
+        """
+        now = time.time()
+        best, best_score = None, None
+        waits = []
+        for index, key in enumerate(self.api_keys):
+            if key in exclude:
+                continue
+            cooling = self.cooldown_remaining(key)
+            if cooling:
+                waits.append(cooling)
+                continue
+            usage = self._usage[key]
+            quota = self.quotas.get(key, {})
+            if quota.get("max_concurrency") and usage.in_flight >= quota["max_concurrency"]:
+                continue  # a release will notify
+            room = self.headroom(key, now)
+            rpm, tpm = quota.get("rpm"), quota.get("tpm")
+            if (rpm and len(usage.events) + 1 > rpm) or (tpm and usage.events and usage.tokens + tokens > tpm):
+                if usage.events:
+                    waits.append(usage.events[0][0] + QUOTA_WINDOW_SECONDS - now)
+                continue
+            # Most headroom first; ties go to the key with fewer requests in flight
+            score = (room, -usage.in_flight)
+            if best_score is None or score > best_score:
+                best, best_score = index, score
+        if best is None:
+            return None, (max(0.0, min(waits)) if waits else None)
+        key = self.api_keys[best]
+        if not reserve:
+            return KeyLease(key, None), 0.0
+        usage = self._usage[key]
+        event = [now, tokens]
+        usage.events.append(event)
+        usage.tokens += tokens
+        usage.in_flight += 1
+        self.current_key_index = best
+        return KeyLease(key, event), 0.0
+
+    def has_room(self, estimated_tokens=0, exclude=()):
+        """True if acquire_slot(..., exclude=exclude) would get a key right now."""
+        with self._lock:
+            return self._try_acquire(estimated_tokens, exclude, reserve=False)[0] is not None
+
+    def acquire_slot(self, estimated_tokens=0, deadline=None, exclude=()):
+        """
+        Schedules one request of about estimated_tokens on the ready key with
+        the most RPM/TPM headroom and counts it against that key at once, so
+        concurrent callers spread across the pool. Blocks while no key has
+        room (cooldowns, full windows or concurrency caps) until one does or
+        deadline (time.monotonic()) passes. Keys in exclude are never picked.
+        Returns a KeyLease, or None.
+        """
+        if not self.api_keys:
+            return None
+        with self._slot_freed:
+            while True:
+                lease, wait = self._try_acquire(estimated_tokens, exclude)
+                if lease is not None:
+                    return lease
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        return None
+                    wait = left if wait is None else min(wait, left)
+                self._slot_freed.wait(wait)
+
+    async def acquire_slot_async(self, estimated_tokens=0, deadline=None, poll_interval=0.01, exclude=()):
+        """acquire_slot for asyncio callers; polls instead of blocking the loop."""
+        if not self.api_keys:
+            return None
+        while True:
+            with self._lock:
+                lease, wait = self._try_acquire(estimated_tokens, exclude)
+            if lease is not None:
+                return lease
+            wait = poll_interval if wait is None else min(max(wait, poll_interval), 1.0)
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                wait = min(wait, left)
+            await asyncio.sleep(wait)
+
+    def release_slot(self, lease, actual_tokens=None):
+        """
+        Ends a scheduled request. actual_tokens (from the response's usage)
+        replaces the estimate in the key's TPM window.
+        """
+        with self._slot_freed:
+            usage = self._usage[lease.key]
+            usage.in_flight = max(0, usage.in_flight - 1)
+            if actual_tokens is not None:
+                if lease.event[0] > time.time() - QUOTA_WINDOW_SECONDS:  # still in the window
+                    usage.tokens += actual_tokens - lease.event[1]
+                    lease.event[1] = actual_tokens
+            self._slot_freed.notify_all()
 
     def rotate_key(self):
         if not self.api_keys:
@@ -66,7 +396,7 @@ if __name__ == "__main__":
     print(f"Rotated Key: {manager.get_key()}")
     manager.rotate_key()
     print(f"Rotated Key: {manager.get_key()}")
-    
+
     # Test with no keys for a service
     manager_no_keys = APIKeyManager(service_name="ANTHROPIC", config_path=config_test_path)
     print(f"Key (no keys for ANTHROPIC): {manager_no_keys.get_key()}")
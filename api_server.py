@@ -4,18 +4,54 @@ api_server.py — Lightweight HTTP API for Agent Budget Guard.
 
 Endpoints:
   GET  /health     — {"ok": true}
-  GET  /status     — budget status, circuit breaker state, spend velocity
-  GET  /dashboard  — contents of dashboard.md as plain text
+  GET  /status     — budget status, circuit breaker state, spend velocity; served from a
+                     cached snapshot with an ETag (If-None-Match → 304 Not Modified)
+  GET  /dashboard  — the dashboard markdown, rendered in memory from live guard state (ETag,
+                     gzip when accepted); run_server also keeps dashboard.md up to date,
+                     re-checking it every dashboard.min_refresh_seconds
+  GET  /latency    — per-stage preflight latency histograms (count, mean, p50/p90/p99, max in µs)
+  GET  /events     — server-sent events: spend deltas and window totals, blocks and
+                     breaker transitions, coalesced to at most events.max_rate per second
   POST /reset      — reset circuit breaker
+  POST /check      — admit one call against the shared breaker: {"estimated_cost"} or
+                     {"model", "input_tokens", "output_tokens"} runs reserve_budget and
+                     returns a "reservation_id"; {"model", "messages"} runs the full
+                     preflight (GuardOrchestrator.process_request), also reserving
+  POST /record     — record one call's actual usage: {"model", "input_tokens",
+                     "output_tokens"} and/or "cost", settling "reservation_id" if given;
+                     {"reservation_id", "release": true} frees a failed call's hold
+  POST /record/bulk — newline-delimited /record events, all validated before any is
+                     applied (one bad line rejects the body), then applied in one
+                     critical section
 
 Port: 8765 (env BUDGET_GUARD_PORT or --port arg)
 Logs: staff_logs/api_YYYYMMDD.log
+
+Both servers handle requests concurrently (a thread per connection) and the
+stdlib one speaks HTTP/1.1, so pollers keep their connection open across
+requests. Handlers touch the shared guard and breaker only under _lock, the
+guard's own lock, so they serialize with the guard's admission checks.
+
+With /check and /record, agent processes on a host share this server's
+breaker instead of each running a private BudgetGuard. A call is admitted
+with /check, which holds its estimate as a reservation, and settled with a
+/record carrying the returned reservation_id, which swaps the estimate for
+the actual cost (or a release, if the call failed); an unsettled
+reservation lapses after the breaker's reservation timeout. /record without
+a reservation_id adds usage that was never checked. "reserve": false makes
+/check record the estimate as spent (check_budget) for callers that never
+report back; such a call must not also be sent to /record. Agents making many
+calls can buffer usage events and ship them to /record/bulk about once a
+second.
 """
 
 import sys
 import os
 import json
+import math
+import time
 import argparse
+import threading
 import logging
 from datetime import datetime
 
@@ -25,7 +61,11 @@ sys.path.insert(0, PROJECT_DIR)
 
 from cost_calculator import BudgetGuard
 from circuit_breaker import CircuitBreaker
-from dashboard_updater import get_circuit_breaker_summary
+from latency_stats import LATENCY
+from orchestrator import GuardOrchestrator
+from status_snapshot import Snapshot, StatusSnapshot, etag_matches, accepts_gzip
+from dashboard_updater import generate_dashboard, DashboardWriter
+from event_stream import EventHub, stream_messages
 
 # ── Logging setup ─────────────────────────────────────────────────────────────
 def _setup_logger():
@@ -48,22 +88,25 @@ logger = _setup_logger()
 # ── Shared state (module-level singletons) ─────────────────────────────────────
 _guard = BudgetGuard(config_path=os.path.join(PROJECT_DIR, "config.json"))
 _breaker = _guard.breaker
+_lock = _guard.lock
+_orchestrator = None  # built on the first {"messages"} check: it loads the tokenizer
 _dashboard_path = os.path.join(PROJECT_DIR, "dashboard.md")
+_dashboard_writer = None  # DashboardWriter once run_server starts mirroring to dashboard.md
+_dashboard_refresher = None  # (stop event, thread) re-rendering the dashboard while mirrored
+_MAX_BODY_BYTES = 8 * 1024 * 1024
 
 # ── Business logic helpers ────────────────────────────────────────────────────
 
-def _get_status_data() -> dict:
-    summary = get_circuit_breaker_summary(_breaker)
-    # Compute total window spending directly from cost_events (avoids broken get_meter_data)
-    _breaker._clean_old_events(_breaker.cost_events, _breaker.cost_window_seconds)
-    total_window_spending = _breaker._get_current_sum(_breaker.cost_events)
+def _build_status(summary: dict, now: float) -> dict:
+    """Status body from a read-only breaker summary (never evicts or transitions)."""
+    breaker_summary = {key: value for key, value in summary.items() if key != "stable_until"}
     return {
-        "circuit_breaker": summary,
+        "circuit_breaker": breaker_summary,
         "budget": {
             "default_threshold": _guard.default_threshold,
-            "thresholds": _guard.thresholds,
-            "total_window_spending": total_window_spending,
-            "window_seconds": _breaker.cost_window_seconds,
+            "thresholds": dict(_guard.thresholds),
+            "total_window_spending": summary["window_cost"],
+            "window_seconds": summary["cost_window_seconds"],
         },
         "spend_velocity": {
             "window_cost_usd": summary["window_cost"],
@@ -71,25 +114,279 @@ def _get_status_data() -> dict:
             "cost_limit_usd": summary["cost_limit"],
             "token_velocity_limit": summary["token_velocity_limit"],
         },
-        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "timestamp": datetime.utcfromtimestamp(now).isoformat() + "Z",
     }
 
 
+_status_snapshot = StatusSnapshot(_guard, _build_status)
+
+
+def _get_status_data() -> dict:
+    now = time.time()
+    with _lock:
+        return _build_status(_guard.breaker.summary(now), now)
+
+
+def _get_latency_data() -> dict:
+    return {"enabled": LATENCY.enabled, "stages": LATENCY.stats()}
+
+
 def _reset_circuit_breaker() -> dict:
-    _breaker.record_success()
-    _breaker.cost_failures = 0
-    _breaker.token_failures = 0
-    _breaker.failures = 0
-    _breaker.state = "CLOSED"
+    with _lock:
+        _guard.breaker.reset()
+        state = _guard.breaker.check_state()
     logger.info("Circuit breaker reset via API")
-    return {"reset": True, "state": _breaker.check_state()}
+    return {"reset": True, "state": state}
+
+
+def _get_orchestrator() -> GuardOrchestrator:
+    global _orchestrator
+    with _lock:
+        if _orchestrator is None:
+            try:
+                _orchestrator = GuardOrchestrator(config_path=_guard.config_path, guard=_guard)
+            except Exception as e:
+                raise RuntimeError(f"preflight unavailable: {e}") from e
+        return _orchestrator
+
+
+def _json_body(body: bytes) -> dict:
+    data = json.loads(body or b"{}")
+    if not isinstance(data, dict):
+        raise ValueError("request body must be a JSON object")
+    return data
+
+
+def _field(data: dict, name: str, kind=float, default=None):
+    value = data.get(name, default)
+    if value is None:
+        raise ValueError(f"'{name}' is required")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+        raise ValueError(f"'{name}' must be a non-negative number")
+    return kind(value)
+
+
+def _text(data: dict, name: str, default=None):
+    value = data.get(name, default)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"'{name}' must be a string")
+    return value
+
+
+def _flag(data: dict, name: str, default=False) -> bool:
+    value = data.get(name, default)
+    if not isinstance(value, bool):
+        raise ValueError(f"'{name}' must be true or false")
+    return value
+
+
+def _reservation_id(data: dict):
+    value = data.get("reservation_id")
+    if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+        raise ValueError("'reservation_id' must be an integer")
+    return value
+
+
+def _messages(data: dict) -> list:
+    messages = data["messages"]
+    if not isinstance(messages, list) or not all(
+            isinstance(m, dict) and isinstance(m.get("role"), str) and isinstance(m.get("content"), str)
+            for m in messages):
+        raise ValueError("'messages' must be a list of objects with string 'role' and 'content'")
+    return messages
+
+
+def _priced_model(data: dict) -> str:
+    model = _text(data, "model")
+    if model not in _guard.model_pricing:
+        raise ValueError(f"unknown model {model!r}")
+    return model
+
+
+def _check_request(data: dict) -> dict:
+    context = _text(data, "context", "routine")
+    reserve = _flag(data, "reserve", True)
+    is_batch = _flag(data, "is_batch")
+    if "messages" in data:
+        messages = _messages(data)
+        return _get_orchestrator().process_request(
+            _priced_model(data), messages, context, auto_fallback=_flag(data, "auto_fallback"),
+            is_batch=is_batch, reserve=reserve)
+    if "estimated_cost" in data:
+        cost = _field(data, "estimated_cost")
+        tokens = _field(data, "estimated_tokens", int, 0)
+    else:
+        model = _priced_model(data)
+        input_tokens = _field(data, "input_tokens", int)
+        output_tokens = _field(data, "output_tokens", int, _guard.predict_output_tokens(model, context))
+        cost = _guard.estimate_cost(model, input_tokens, output_tokens, is_batch=is_batch)
+        tokens = input_tokens + output_tokens
+    if reserve:
+        ok, msg, reservation_id = _guard.reserve_budget(cost, context, estimated_tokens=tokens)
+    else:
+        ok, msg = _guard.check_budget(cost, context)
+    result = {"status": "ok" if ok else "blocked", "message": msg, "estimated_cost": cost}
+    if reserve:
+        result["reservation_id"] = reservation_id
+    return result
+
+
+def _usage_event(event: dict) -> tuple:
+    """Validates a /record event. Returns the _apply_usage arguments; nothing is recorded."""
+    if not isinstance(event, dict):
+        raise ValueError("usage event must be a JSON object")
+    reservation_id = _reservation_id(event)
+    if _flag(event, "release"):
+        if reservation_id is None:
+            raise ValueError("'release' needs a 'reservation_id'")
+        return reservation_id, None, 0, 0, None, None
+    input_tokens = _field(event, "input_tokens", int, 0)
+    output_tokens = _field(event, "output_tokens", int, 0)
+    context = _text(event, "context", "routine")
+    is_batch = _flag(event, "is_batch")
+    if "cost" in event:
+        cost = _field(event, "cost")
+        model = _text(event, "model")
+    else:
+        model = _priced_model(event)
+        cost = _guard.estimate_cost(model, input_tokens, output_tokens, is_batch=is_batch)
+    return reservation_id, cost, input_tokens, output_tokens, model, context
+
+
+def _apply_usage(reservation_id, cost, input_tokens, output_tokens, model, context) -> dict:
+    """Records a validated event; a cost of None releases the reservation."""
+    if cost is None:
+        return {"released": _guard.release_reservation(reservation_id)}
+    within_limits = _guard.commit_usage(reservation_id, cost, input_tokens, output_tokens,
+                                        model=model, context=context)
+    return {"recorded": True, "cost": cost, "within_limits": within_limits}
+
+
+def _record_usage(event: dict) -> dict:
+    return _apply_usage(*_usage_event(event))
+
+
+def _record_bulk(body: bytes) -> dict:
+    """Applies NDJSON usage events in order, or none of them if any line is invalid."""
+    events = []
+    for number, line in enumerate(body.decode("utf-8").splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            events.append(_usage_event(json.loads(line)))
+        except ValueError as e:
+            raise ValueError(f"line {number}: {e}") from e
+    recorded = released = 0
+    total_cost = 0.0
+    within_limits = True
+    with _lock:
+        for event in events:
+            result = _apply_usage(*event)
+            if "released" in result:
+                released += result["released"]
+            else:
+                recorded += 1
+                total_cost += result["cost"]
+                within_limits = within_limits and result["within_limits"]
+    return {"recorded": recorded, "released": released, "cost": total_cost, "within_limits": within_limits}
+
+
+_POST_ROUTES = {
+    "/reset": lambda body: _reset_circuit_breaker(),
+    "/check": lambda body: _check_request(_json_body(body)),
+    "/record": lambda body: _record_usage(_json_body(body)),
+    "/record/bulk": _record_bulk,
+}
+
+
+def _handle_post(path: str, body: bytes):
+    """Runs a POST route. Returns (response data, HTTP status)."""
+    route = _POST_ROUTES.get(path)
+    if route is None:
+        return {"error": "not found"}, 404
+    if len(body) > _MAX_BODY_BYTES:
+        return {"error": "request body too large"}, 413
+    try:
+        return route(body), 200
+    except ValueError as e:  # includes malformed JSON and UTF-8
+        return {"error": str(e)}, 400
+    except RuntimeError as e:
+        return {"error": str(e)}, 503
+
+
+def _render_dashboard(summary: dict, now: float) -> bytes:
+    return generate_dashboard(_guard, summary).encode("utf-8")
+
+
+def _mirror_dashboard(body: bytes) -> None:
+    if _dashboard_writer is not None:
+        _dashboard_writer.submit(body)
+
+
+# Markdown rendering is far costlier than /status, so it is refreshed at most
+# once per min_refresh_seconds however fast spend moves.
+_dashboard_snapshot = Snapshot(
+    _guard, _render_dashboard,
+    version=lambda: (_guard.breaker.version, _guard.cache_hits),
+    min_interval=_guard.config.get("dashboard", {}).get("min_refresh_seconds", 1.0),
+    compress=True,
+    on_render=_mirror_dashboard,
+)
+
+
+_event_options = _guard.config.get("events", {})
+_event_hub = EventHub(
+    _guard,
+    max_rate=_event_options.get("max_rate", 4.0),
+    queue_size=_event_options.get("queue_size", 64),
+    max_subscribers=_event_options.get("max_subscribers", 512),
+)
+_EVENTS_WRITE_TIMEOUT = 10.0  # a subscriber that cannot take a write for this long is cut off
 
 
 def _read_dashboard() -> str:
-    if not os.path.exists(_dashboard_path):
-        return "# Dashboard\n\n(No data yet — run dashboard_updater.py to generate.)\n"
-    with open(_dashboard_path, "r") as f:
-        return f.read()
+    return _dashboard_snapshot.get().body.decode("utf-8")
+
+
+def _start_dashboard_mirror(path: str = None) -> None:
+    """
+    Keeps path (default dashboard.md) in step with the dashboard: each newly
+    rendered one is written off the request threads, and a background thread
+    re-checks the snapshot every min_refresh_seconds, so the file follows
+    spend even when nobody GETs /dashboard.
+    """
+    global _dashboard_writer, _dashboard_refresher
+    if _dashboard_writer is None:
+        _dashboard_writer = DashboardWriter(path or _dashboard_path)
+        _mirror_dashboard(_dashboard_snapshot.get().body)
+        stop = threading.Event()
+        thread = threading.Thread(target=_refresh_dashboard, args=(stop, max(_dashboard_snapshot.min_interval, 0.1)),
+                                  name="dashboard-refresh", daemon=True)
+        thread.start()
+        _dashboard_refresher = (stop, thread)
+
+
+def _stop_dashboard_mirror(timeout: float = None) -> None:
+    """Stops the refreshes and waits for the last dashboard to reach the disk."""
+    global _dashboard_writer, _dashboard_refresher
+    if _dashboard_refresher is not None:
+        stop, thread = _dashboard_refresher
+        stop.set()
+        thread.join(timeout)
+        _dashboard_refresher = None
+    if _dashboard_writer is not None:
+        _dashboard_writer.flush(timeout)
+        _dashboard_writer = None
+
+
+def _refresh_dashboard(stop: threading.Event, interval: float) -> None:
+    # A current snapshot makes this a few comparisons; a stale one re-renders
+    # and on_render hands the new body to the writer.
+    while not stop.wait(interval):
+        try:
+            _dashboard_snapshot.get()
+        except Exception as e:
+            logger.warning("Dashboard refresh failed: %s", e)
 
 
 # ── Try Flask first, fall back to stdlib http.server ─────────────────────────
@@ -119,28 +416,66 @@ if USING_FLASK:
     def health():
         return jsonify({"ok": True})
 
+    def _rendered_response(rendered, mimetype):
+        body, etag = rendered.body, rendered.etag
+        headers = {"Cache-Control": "no-cache"}
+        if rendered.gzipped is not None:
+            headers["Vary"] = "Accept-Encoding"
+            if accepts_gzip(request.headers.get("Accept-Encoding")):
+                body, etag = rendered.gzipped, etag[:-1] + '-gzip"'
+                headers["Content-Encoding"] = "gzip"
+        headers["ETag"] = etag
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            headers.pop("Content-Encoding", None)
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype=mimetype, headers=headers)
+
     @app.route("/status")
     def status():
-        return jsonify(_get_status_data())
+        return _rendered_response(_status_snapshot.get(), "application/json")
+
+    @app.route("/events")
+    def events():
+        subscriber = _event_hub.subscribe()
+        if subscriber is None:
+            return jsonify({"error": "too many event subscribers"}), 503
+        return Response(stream_messages(_event_hub, subscriber), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.route("/latency")
+    def latency():
+        return jsonify(_get_latency_data())
 
     @app.route("/dashboard")
     def dashboard():
-        return Response(_read_dashboard(), mimetype="text/plain")
+        return _rendered_response(_dashboard_snapshot.get(), "text/plain")
 
     @app.route("/reset", methods=["POST"])
-    def reset():
-        return jsonify(_reset_circuit_breaker())
-
-    def run_server(port: int):
+    @app.route("/check", methods=["POST"])
+    @app.route("/record", methods=["POST"])
+    @app.route("/record/bulk", methods=["POST"])
+    def post_route():
+        data, status = _handle_post(request.path, request.get_data())
+        return jsonify(data), status
+
+    def run_server(port: int, threaded: bool = True, dashboard_file: bool = True):
         logger.info("Starting Flask API server on port %d", port)
-        app.run(host="0.0.0.0", port=port)
+        if dashboard_file:
+            _start_dashboard_mirror()
+        app.run(host="0.0.0.0", port=port, threaded=threaded)
 
 else:
     # ── stdlib http.server fallback ────────────────────────────────────────────
     import json as _json
-    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
 
     class _Handler(BaseHTTPRequestHandler):
+        # Keep-alive: every response carries a Content-Length. Headers and
+        # body go out in two writes, so Nagle would hold the body back for
+        # the client's delayed ACK (~40 ms) on a reused connection.
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
         def log_message(self, fmt, *args):
             logger.info("REQUEST  %s %s", self.command, self.path)
 
@@ -162,25 +497,96 @@ else:
             self.wfile.write(body)
             logger.info("RESPONSE %s %s → %d", self.command, self.path, status)
 
+        def _send_rendered(self, rendered, content_type: str):
+            """Sends a cached rendering: gzip if accepted, 304 if the client has it."""
+            body, etag = rendered.body, rendered.etag
+            gzipped = rendered.gzipped is not None and accepts_gzip(self.headers.get("Accept-Encoding"))
+            if gzipped:
+                body, etag = rendered.gzipped, etag[:-1] + '-gzip"'
+            status = 304 if etag_matches(self.headers.get("If-None-Match"), etag) else 200
+            self.send_response(status)
+            if status == 200:
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if gzipped:
+                    self.send_header("Content-Encoding", "gzip")
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            if rendered.gzipped is not None:
+                self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            if status == 200:
+                self.wfile.write(body)
+            logger.info("RESPONSE %s %s → %d", self.command, self.path, status)
+
+        def _send_events(self):
+            subscriber = _event_hub.subscribe()
+            if subscriber is None:
+                return self._send_json({"error": "too many event subscribers"}, 503)
+            # The stream ends only when the connection does
+            self.close_connection = True
+            self.connection.settimeout(_EVENTS_WRITE_TIMEOUT)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            logger.info("RESPONSE %s %s → %d (streaming)", self.command, self.path, 200)
+            messages = stream_messages(_event_hub, subscriber)
+            try:
+                for message in messages:
+                    self.wfile.write(message)
+            except OSError:
+                pass  # client went away or stopped reading
+            finally:
+                messages.close()
+
         def do_GET(self):
-            if self.path == "/health":
+            if self.path == "/events":
+                self._send_events()
+            elif self.path == "/health":
                 self._send_json({"ok": True})
             elif self.path == "/status":
-                self._send_json(_get_status_data())
+                self._send_rendered(_status_snapshot.get(), "application/json")
+            elif self.path == "/latency":
+                self._send_json(_get_latency_data())
             elif self.path == "/dashboard":
-                self._send_text(_read_dashboard())
+                self._send_rendered(_dashboard_snapshot.get(), "text/plain; charset=utf-8")
             else:
                 self._send_json({"error": "not found"}, 404)
 
         def do_POST(self):
-            if self.path == "/reset":
-                self._send_json(_reset_circuit_breaker())
-            else:
-                self._send_json({"error": "not found"}, 404)
-
-    def run_server(port: int):
-        logger.info("Starting stdlib http.server API on port %d (Flask not available)", port)
-        server = HTTPServer(("0.0.0.0", port), _Handler)
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > _MAX_BODY_BYTES:
+                self.close_connection = True  # leave the body unread
+                return self._send_json({"error": "request body too large"}, 413)
+            # Read the whole body so the next request on this connection starts clean
+            data, status = _handle_post(self.path, self.rfile.read(length))
+            self._send_json(data, status)
+
+    class _HTTP10Handler(_Handler):
+        protocol_version = "HTTP/1.0"
+
+    class _ThreadingServer(ThreadingHTTPServer):
+        daemon_threads = True
+        request_queue_size = 256  # listen backlog for bursts of pollers
+
+    def make_server(host: str, port: int, threaded: bool = True):
+        """
+        A stdlib server for the API. threaded=False gives the old
+        single-threaded HTTP/1.0 server (one request at a time, a new
+        connection per request), kept for comparison in benchmarks.
+        """
+        if threaded:
+            return _ThreadingServer((host, port), _Handler)
+        return HTTPServer((host, port), _HTTP10Handler)
+
+    def run_server(port: int, threaded: bool = True, dashboard_file: bool = True):
+        logger.info("Starting stdlib http.server API on port %d (Flask not available, %s)", port,
+                    "threaded" if threaded else "single-threaded")
+        if dashboard_file:
+            _start_dashboard_mirror()
+        server = make_server("0.0.0.0", port, threaded)
         server.serve_forever()
 
 
@@ -193,8 +599,16 @@ def main():
         default=int(os.environ.get("BUDGET_GUARD_PORT", 8765)),
         help="Port to listen on (default 8765; env BUDGET_GUARD_PORT)",
     )
+    parser.add_argument(
+        "--single-threaded", action="store_true",
+        help="Serve one request at a time (HTTP/1.0 with the stdlib server; for benchmarks)",
+    )
+    parser.add_argument(
+        "--no-dashboard-file", action="store_true",
+        help="Do not keep dashboard.md in step with the dashboard served at /dashboard",
+    )
     args = parser.parse_args()
-    run_server(args.port)
+    run_server(args.port, threaded=not args.single_threaded, dashboard_file=not args.no_dashboard_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,372 @@
+"""
+batch_queue.py — Local queue that turns latency-tolerant calls into provider batch jobs.
+
+Providers bill batch jobs at a discount (model_pricing "batch_discount": 50%
+for Gemini and DeepSeek) in exchange for results within hours instead of
+seconds. BatchQueue collects requests from contexts that can wait
+("experiment" by default), groups them by model and submits a group as one
+batch job when it reaches max_batch_size or its oldest request has waited
+max_age_seconds. A background worker polls submitted jobs and resolves each
+caller's concurrent.futures.Future with a make_api_call-style response.
+
+Budget: every request is admitted at submit() time by reserving its
+estimated cost at the discounted rate (held for job_timeout, since jobs run
+long), and the reservation is committed with the discounted actual cost once
+its result arrives.
+
+Jobs use the batch API of the client's provider, with each request built as
+LLMClient would send it:
+  openai     — the OpenAI Batch API, also served by OpenAI-compatible
+               providers: upload the requests as a JSONL file (POST /v1/files),
+               create the job (POST /v1/batches), poll it, then download its
+               output and error files
+  anthropic  — Message Batches: POST /v1/messages/batches, poll, then fetch
+               the JSONL results
+fake_provider.py serves both for offline testing.
+"""
+
+import json
+import time
+import uuid
+import threading
+import itertools
+import concurrent.futures
+from llm_client import build_provider_request, parse_provider_response, provider_headers
+
+BATCH_PROVIDERS = ("openai", "anthropic")
+ANTHROPIC_BATCHES_PATH = "/v1/messages/batches"
+OPENAI_FILES_PATH = "/v1/files"
+OPENAI_BATCHES_PATH = "/v1/batches"
+_OPENAI_FAILED = ("failed", "expired", "cancelling", "cancelled")
+
+
+def _multipart(fields, file_field, filename, content):
+    """(body, content type) of a multipart/form-data upload of one file plus text fields."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/jsonl\r\n\r\n'.encode() + content + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def _json_reply(raw, action):
+    """The JSON object of a 200 reply; raises ValueError for anything else."""
+    if raw.status != 200:
+        raise ValueError(f"HTTP {raw.status} {action}: {raw.body[:200]!r}")
+    data = raw.json()
+    if not isinstance(data, dict):
+        raise ValueError(f"unexpected reply {action}: {raw.body[:200]!r}")
+    return data
+
+
+class _Queued:
+    __slots__ = ("custom_id", "model", "messages", "context", "reservation_id", "future", "queued_at")
+
+    def __init__(self, custom_id, model, messages, context, reservation_id):
+        self.custom_id = custom_id
+        self.model = model
+        self.messages = messages
+        self.context = context
+        self.reservation_id = reservation_id
+        self.future = concurrent.futures.Future()
+        self.queued_at = time.monotonic()
+
+
+class _Job:
+    __slots__ = ("batch_id", "api_key", "items", "submitted_at", "next_poll")
+
+    def __init__(self, batch_id, api_key, items, poll_at):
+        self.batch_id = batch_id
+        self.api_key = api_key
+        self.items = {item.custom_id: item for item in items}
+        self.submitted_at = time.monotonic()
+        self.next_poll = poll_at
+
+
+class BatchQueue:
+    """
+    client: an LLMClient whose transport, keys, provider and max_tokens are
+    used; its provider must be one of BATCH_PROVIDERS.
+    guard: the BudgetGuard to account against (default client.guard).
+    contexts: contexts allowed to wait for a batch; submit() rejects others.
+    """
+    def __init__(self, client, guard=None, max_batch_size=50, max_age_seconds=30.0, poll_interval=5.0,
+                 job_timeout=24 * 3600, contexts=("experiment",)):
+        self.client = client
+        self.guard = guard or client.guard
+        if self.guard is None or client.transport is None:
+            raise ValueError("BatchQueue needs a guard and an LLMClient with a transport")
+        if client.provider not in BATCH_PROVIDERS:
+            raise ValueError(f"provider {client.provider!r} has no batch API BatchQueue can use "
+                             f"(supported: {', '.join(BATCH_PROVIDERS)})")
+        self.provider = client.provider
+        self.max_batch_size = max_batch_size
+        self.max_age_seconds = max_age_seconds
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.contexts = set(contexts)
+        self._cond = threading.Condition()
+        self._groups = {}  # model -> [_Queued]
+        self._jobs = []
+        self._ids = itertools.count(1)
+        self._closed = False
+        self._flush_all = False
+        self._submit_after = 0.0  # every key was cooling: hold submissions until then
+        self.jobs_submitted = 0
+        self.requests_batched = 0
+        self.saved_usd = 0.0
+        self._worker = threading.Thread(target=self._run, name="batch-queue", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt, model, context="experiment"):
+        """
+        Queues one call and returns a Future for its response. A request the
+        budget does not admit resolves at once with status "blocked".
+        """
+        if context not in self.contexts:
+            raise ValueError(f"context {context!r} is not batched (batched: {sorted(self.contexts)})")
+        messages = self.client._messages(prompt)
+        input_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        output_tokens = min(self.client.max_tokens, self.guard.predict_output_tokens(model, context))
+        estimated_cost = self.guard.estimate_cost(model, input_tokens, output_tokens, is_batch=True)
+        ok, msg, reservation_id = self.guard.reserve_budget(
+            estimated_cost, context, input_tokens + output_tokens, timeout=self.job_timeout)
+        item = _Queued(f"req_{next(self._ids)}", model, messages, context, reservation_id)
+        if not ok:
+            item.future.set_result({"status": "blocked", "message": msg})
+            return item.future
+        with self._cond:
+            if self._closed:
+                self.guard.release_reservation(reservation_id)
+                raise RuntimeError("BatchQueue is closed")
+            self._groups.setdefault(model, []).append(item)
+            self._cond.notify()
+        return item.future
+
+    def flush(self):
+        """Submits everything queued now, whatever its size or age."""
+        with self._cond:
+            self._flush_all = True
+            self._cond.notify()
+
+    def close(self, wait=True):
+        """Flushes the queue and stops the worker once submitted jobs have finished (wait=True)."""
+        with self._cond:
+            self._closed = True
+            self._flush_all = True
+            self._cond.notify()
+        if wait:
+            self._worker.join()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": sum(len(group) for group in self._groups.values()),
+                "jobs_in_flight": len(self._jobs),
+                "jobs_submitted": self.jobs_submitted,
+                "requests_batched": self.requests_batched,
+                "saved_usd": self.saved_usd,
+            }
+
+    # ── Worker ──────────────────────────────────────────────────────────
+
+    def _run(self):
+        while True:
+            with self._cond:
+                ready, wait = self._take_ready()
+                if not ready and not self._due_jobs():
+                    if self._closed and not self._groups and not self._jobs:
+                        return
+                    self._cond.wait(wait)
+                    continue
+            for model, items in ready:
+                self._submit_job(model, items)
+            for job in self._due_jobs():
+                self._poll(job)
+
+    def _take_ready(self):
+        """Groups due for submission, and how long until the next one is (under the lock)."""
+        now = time.monotonic()
+        ready = []
+        wait = None
+        if now < self._submit_after:
+            if self._groups:
+                wait = self._submit_after - now
+        else:
+            flush = self._flush_all or self._closed
+            for model in list(self._groups):
+                group = self._groups[model]
+                while len(group) >= self.max_batch_size:
+                    ready.append((model, group[:self.max_batch_size]))
+                    del group[:self.max_batch_size]
+                if group and (flush or now - group[0].queued_at >= self.max_age_seconds):
+                    ready.append((model, group))
+                    group = []
+                if group:
+                    self._groups[model] = group
+                    due = group[0].queued_at + self.max_age_seconds - now
+                    wait = due if wait is None else min(wait, due)
+                else:
+                    del self._groups[model]
+            self._flush_all = False
+        for job in self._jobs:
+            due = job.next_poll - now
+            wait = due if wait is None else min(wait, due)
+        return ready, (None if wait is None else max(0.0, wait))
+
+    def _due_jobs(self):
+        now = time.monotonic()
+        return [job for job in self._jobs if job.next_poll <= now]
+
+    def _submit_job(self, model, items):
+        keys = self.client.api_key_manager
+        api_key = keys.get_key()
+        if api_key is None:
+            cooldown = keys.next_ready_in()
+            if cooldown is None:
+                self._fail(items, "No API key available for batch submission")
+            else:
+                self._requeue(model, items, cooldown)
+            return
+        try:
+            batch_id = self._create_job(api_key, model, items)
+        except Exception as e:  # TransportError, a malformed reply, anything: fail the callers, not the worker
+            self._fail(items, f"Batch submission failed: {e}")
+            return
+        job = _Job(batch_id, api_key, items, time.monotonic() + self.poll_interval)
+        with self._cond:
+            self._jobs.append(job)
+            self.jobs_submitted += 1
+            self.requests_batched += len(items)
+
+    def _requeue(self, model, items, delay):
+        """Puts items back at the head of their group until a key is ready; jobs keep being polled meanwhile."""
+        with self._cond:
+            self._groups[model] = items + self._groups.get(model, [])
+            self._submit_after = max(self._submit_after, time.monotonic() + delay)
+
+    def _create_job(self, api_key, model, items):
+        """Submits items as one batch job of the provider's; returns the job id."""
+        transport = self.client.transport
+        requests = []
+        for item in items:
+            path, _, payload = build_provider_request(self.provider, model, item.messages, api_key,
+                                                      self.client.max_tokens)
+            requests.append((item.custom_id, path, payload))
+        headers = provider_headers(self.provider, api_key)
+        if self.provider == "anthropic":
+            body = {"requests": [{"custom_id": custom_id, "params": payload} for custom_id, _, payload in requests]}
+            raw = transport.post_json(ANTHROPIC_BATCHES_PATH, body, headers, pool_key=api_key)
+            return _json_reply(raw, "creating the batch")["id"]
+        lines = "".join(json.dumps({"custom_id": custom_id, "method": "POST", "url": path, "body": payload},
+                                   separators=(",", ":")) + "\n"
+                        for custom_id, path, payload in requests)
+        upload, content_type = _multipart({"purpose": "batch"}, "file", "batch.jsonl", lines.encode("utf-8"))
+        raw = transport.request("POST", OPENAI_FILES_PATH, upload, {**headers, "Content-Type": content_type},
+                                pool_key=api_key)
+        file_id = _json_reply(raw, "uploading the requests")["id"]
+        raw = transport.post_json(OPENAI_BATCHES_PATH, {"input_file_id": file_id, "endpoint": requests[0][1],
+                                                        "completion_window": "24h"}, headers, pool_key=api_key)
+        return _json_reply(raw, "creating the batch")["id"]
+
+    def _result_paths(self, job):
+        """Paths of the job's result files once it has ended, None while it runs."""
+        headers = provider_headers(self.provider, job.api_key)
+        if self.provider == "anthropic":
+            raw = self.client.transport.request("GET", f"{ANTHROPIC_BATCHES_PATH}/{job.batch_id}",
+                                                headers=headers, pool_key=job.api_key)
+            status = raw.json() if raw.status == 200 else {}
+            return [status["results_url"]] if status.get("processing_status") == "ended" else None
+        raw = self.client.transport.request("GET", f"{OPENAI_BATCHES_PATH}/{job.batch_id}",
+                                            headers=headers, pool_key=job.api_key)
+        status = raw.json() if raw.status == 200 else {}
+        if status.get("status") in _OPENAI_FAILED:
+            raise ValueError(f"job {status['status']}")
+        if status.get("status") != "completed":
+            return None
+        return [f"{OPENAI_FILES_PATH}/{file_id}/content"
+                for file_id in (status.get("output_file_id"), status.get("error_file_id")) if file_id]
+
+    def _poll(self, job):
+        try:
+            paths = self._result_paths(job)
+            if paths is not None:
+                headers = provider_headers(self.provider, job.api_key)
+                for path in paths:
+                    raw = self.client.transport.request("GET", path, headers=headers, pool_key=job.api_key)
+                    if raw.status != 200:
+                        raise ValueError(f"HTTP {raw.status} fetching results")
+                    self._resolve(job, raw.body)
+                if job.items:
+                    self._fail(list(job.items.values()), f"Batch {job.batch_id} returned no result")
+                self._finish(job)
+                return
+        except Exception as e:
+            self._fail(list(job.items.values()), f"Batch {job.batch_id} failed: {e}")
+            self._finish(job)
+            return
+        if time.monotonic() - job.submitted_at > self.job_timeout:
+            self._fail(list(job.items.values()), f"Batch {job.batch_id} timed out")
+            self._finish(job)
+            return
+        job.next_poll = time.monotonic() + self.poll_interval
+
+    def _parse_record(self, record):
+        """(provider response JSON, None) for a succeeded result line, or (None, error message)."""
+        if self.provider == "anthropic":
+            result = record.get("result", {})
+            if result.get("type") != "succeeded":
+                return None, f"Batch request {result.get('type', 'failed')}"
+            return result["message"], None
+        response = record.get("response") or {}
+        if response.get("status_code") != 200:
+            error = record.get("error") or response.get("body", {}).get("error") or {}
+            return None, f"Batch request failed: {error.get('message') or response.get('status_code')}"
+        return response["body"], None
+
+    def _resolve(self, job, body):
+        for line in body.splitlines():
+            try:
+                record = json.loads(line) if line.strip() else None
+            except ValueError:
+                continue  # unattributable; its item fails as "returned no result"
+            if not isinstance(record, dict):
+                continue
+            item = job.items.pop(record.get("custom_id"), None)
+            if item is None:
+                continue
+            try:
+                data, error = self._parse_record(record)
+                if error is None:
+                    text, usage = parse_provider_response(self.provider, data)
+                    input_tokens, output_tokens = int(usage["input_tokens"]), int(usage["output_tokens"])
+            except Exception as e:
+                error = f"Malformed batch result: {e!r}"
+            if error is not None:
+                self._fail([item], error)
+                continue
+            cost = self.guard.estimate_cost(item.model, input_tokens, output_tokens, is_batch=True)
+            full_cost = self.guard.estimate_cost(item.model, input_tokens, output_tokens)
+            self.guard.commit_usage(item.reservation_id, cost, input_tokens, output_tokens,
+                                    model=item.model, context=item.context)
+            with self._cond:
+                self.saved_usd += full_cost - cost
+            item.future.set_result({
+                "status": "success",
+                "response": text,
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+                "cost": cost,
+                "batch_id": job.batch_id,
+            })
+
+    def _fail(self, items, message):
+        for item in items:
+            self.guard.release_reservation(item.reservation_id)
+            item.future.set_result({"status": "error", "message": message})
+
+    def _finish(self, job):
+        with self._cond:
+            self._jobs.remove(job)
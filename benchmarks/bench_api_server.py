@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+bench_api_server.py — /status throughput and latency of the API server under concurrent pollers.
+
+Starts api_server.py in a subprocess, once single-threaded over HTTP/1.0 (the
+old stdlib server) and once threaded over HTTP/1.1, and polls GET /status
+from 1 to 256 client threads, each holding its own connection (reopened per
+request when the server closes it). Reports requests/s, p50/p99 latency and
+failed requests at each concurrency.
+
+Usage: python3 benchmarks/bench_api_server.py [--levels 1,4,16,64,256] [--duration 2]
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(port, single_threaded):
+    command = [sys.executable, os.path.join(PROJECT_DIR, "api_server.py"), "--port", str(port)]
+    if single_threaded:
+        command.append("--single-threaded")
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError("api_server.py did not start")
+
+
+def poll(port, concurrency, duration):
+    """Returns (requests, errors, sorted latencies in seconds, elapsed)."""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    start_line = threading.Barrier(concurrency + 1)
+    stop_at = []
+
+    def client(i):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        start_line.wait()
+        while time.perf_counter() < stop_at[0]:
+            t0 = time.perf_counter()
+            try:
+                conn.request("GET", "/status")
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise http.client.HTTPException(response.status)
+            except (OSError, http.client.HTTPException):
+                errors[i] += 1
+                conn.close()
+                continue
+            latencies[i].append(time.perf_counter() - t0)
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    stop_at.append(start + duration)
+    start_line.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    merged = sorted(t for per_client in latencies for t in per_client)
+    return len(merged), sum(errors), merged, elapsed
+
+
+def percentile_ms(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--levels", default="1,4,16,64,256",
+                        help="Comma-separated client counts (default 1,4,16,64,256)")
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds per level (default 2)")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",")]
+
+    print(f"{'server':>22} {'clients':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, single_threaded in (("single-threaded 1.0", True), ("threaded keep-alive", False)):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = start_server(port, single_threaded)
+        try:
+            for concurrency in levels:
+                count, errors, latencies, elapsed = poll(port, concurrency, args.duration)
+                print(f"{name:>22} {concurrency:>8} {count / elapsed:>9.0f} {percentile_ms(latencies, 0.50):>9.2f} "
+                      f"{percentile_ms(latencies, 0.99):>9.2f} {errors:>7}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
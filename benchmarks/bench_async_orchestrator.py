@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+bench_async_orchestrator.py — Event-loop lag with 1000 concurrent agent tasks.
+
+Each simulated agent task runs a preflight on a ~20 KB payload, either by
+calling the sync process_request from a coroutine (blocking the loop) or
+through process_request_async. A ticker coroutine measures how late the
+loop wakes it up, which is the stall every other in-flight task sees.
+
+Usage: python3 benchmarks/bench_async_orchestrator.py [--tasks 1000] [--kb 20]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from orchestrator import GuardOrchestrator
+
+
+def make_messages(i, kb):
+    body = " ".join(f"line {n} of tool output for agent {i}" for n in range(kb * 1024 // 32))
+    return [{"role": "system", "content": "You are agent %d." % i},
+            {"role": "tool", "content": body},
+            {"role": "user", "content": "Summarize the output above."}]
+
+
+async def ticker(lags, interval, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(mode, orchestrator, tasks, kb):
+    lags, stop = [], asyncio.Event()
+    monitor = asyncio.create_task(ticker(lags, 0.005, stop))
+    payloads = [make_messages(i, kb) for i in range(tasks)]
+
+    async def agent(messages):
+        await asyncio.sleep(0)
+        if mode == "sync":
+            return orchestrator.process_request("gemini-flash-1.5", messages, "experiment")
+        return await orchestrator.process_request_async("gemini-flash-1.5", messages, "experiment")
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(agent(m) for m in payloads))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    ok = sum(1 for r in results if r["status"] == "ok")
+    print(f"{mode:>6} {elapsed:>9.2f}s {ok:>6} ok {len(lags):>7} ticks "
+          f"p99 lag {p99 * 1000:>8.1f} ms  max lag {(lags[-1] if lags else 0) * 1000:>8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tasks", type=int, default=1000, help="Concurrent agent tasks (default 1000)")
+    parser.add_argument("--kb", type=int, default=20, help="Approximate payload size in KB (default 20)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Executor threads")
+    args = parser.parse_args()
+
+    for mode in ("sync", "async"):
+        orchestrator = GuardOrchestrator(executor=ThreadPoolExecutor(args.workers))
+        orchestrator.guard.breaker.cost_limit = float("inf")
+        asyncio.run(run(mode, orchestrator, args.tasks, args.kb))
+        orchestrator.executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
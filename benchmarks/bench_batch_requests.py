@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+bench_batch_requests.py — process_requests vs a process_request loop.
+
+Runs the same fan-out of sub-requests (a shared system prompt and shared
+context plus a short per-sub-task instruction) through
+GuardOrchestrator.process_request in a loop and through one
+GuardOrchestrator.process_requests call, and reports requests/sec for each.
+
+Usage: python3 benchmarks/bench_batch_requests.py [--batch 100] [--kb 8] [--rounds 5]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from orchestrator import GuardOrchestrator
+
+
+def make_requests(batch, kb):
+    shared = " ".join(f"shared context line {n}: {{\"id\": {n}, \"ok\": true}}" for n in range(kb * 1024 // 40))
+    requests = []
+    for i in range(batch):
+        requests.append({
+            "model": "gemini-flash-1.5",
+            "context": "experiment",
+            "messages": [{"role": "system", "content": "You are a sub-agent. Answer in JSON."},
+                         {"role": "user", "content": shared},
+                         {"role": "user", "content": f"Sub-task {i}: check item {i} against the context above."}],
+        })
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch", type=int, default=100, help="Requests per batch (default 100)")
+    parser.add_argument("--kb", type=int, default=8, help="Approximate payload size in KB (default 8)")
+    parser.add_argument("--rounds", type=int, default=5, help="Batches per mode (default 5)")
+    args = parser.parse_args()
+
+    requests = make_requests(args.batch, args.kb)
+    orchestrator = GuardOrchestrator()
+    orchestrator.guard.breaker.cost_limit = float("inf")
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for r in requests:
+            orchestrator.process_request(r["model"], r["messages"], r["context"])
+    loop_rps = args.batch * args.rounds / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        orchestrator.process_requests(requests)
+    batch_rps = args.batch * args.rounds / (time.perf_counter() - start)
+
+    print(f"batch size {args.batch}, ~{args.kb} KB per request")
+    print(f"  loop:  {loop_rps:10.1f} req/s")
+    print(f"  batch: {batch_rps:10.1f} req/s  ({batch_rps / loop_rps:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
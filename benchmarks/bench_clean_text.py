@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+bench_clean_text.py — Throughput of optimizer.TokenOptimizer.clean_text.
+
+Compares the compiled single-pass cleaner against the previous approach
+(one whitespace regex, then one str.replace per filler) on multi-megabyte
+transcripts with lexicons of 10 to 10,000 phrases.
+
+Usage: python3 benchmarks/bench_clean_text.py [--mb 4] [--legacy-max 1000]
+"""
+
+import os
+import sys
+import re
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from optimizer import TokenOptimizer
+
+WORDS = ("the agent tool result file error value please note that this is a we can "
+         "you should data model request context token budget call output input").split()
+
+
+def make_lexicon(size, rng):
+    phrases = set()
+    while len(phrases) < size:
+        phrases.add(" ".join(rng.choice(WORDS) + str(rng.randrange(50)) for _ in range(rng.randint(2, 5))))
+    return sorted(phrases)
+
+
+def make_text(megabytes, lexicon, rng):
+    parts, size, target = [], 0, megabytes * 1024 * 1024
+    while size < target:
+        if rng.random() < 0.05:
+            part = rng.choice(lexicon)
+        else:
+            part = rng.choice(WORDS)
+        part += rng.choice(["  ", " ", "\n", "\t ", " "])
+        parts.append(part)
+        size += len(part)
+    return "".join(parts)
+
+
+def legacy_clean(text, fillers):
+    text = re.sub(r'\s+', ' ', text).strip()
+    for filler in fillers:
+        text = text.replace(filler, "")
+    return text
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mb", type=float, default=4, help="Transcript size in MB (default 4)")
+    parser.add_argument("--legacy-max", type=int, default=1000,
+                        help="Largest lexicon to run the legacy cleaner on (default 1000)")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'phrases':>8} {'compile ms':>11} {'compiled MB/s':>14} {'legacy MB/s':>12}")
+    for size in (10, 100, 1000, 10000):
+        lexicon = make_lexicon(size, rng)
+        text = make_text(args.mb, lexicon, rng)
+        mb = len(text) / (1024 * 1024)
+
+        start = time.perf_counter()
+        optimizer = TokenOptimizer(fillers=lexicon)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        compiled = mb / timed(optimizer.clean_text, text)
+        legacy = f"{mb / timed(legacy_clean, text, lexicon):12.1f}" if size <= args.legacy_max else f"{'skipped':>12}"
+        print(f"{size:>8} {compile_ms:>11.1f} {compiled:>14.1f} {legacy}")
+
+
+if __name__ == "__main__":
+    main()
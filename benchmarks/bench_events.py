@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+bench_events.py — /events fan-out lag and /record latency with hundreds of SSE subscribers.
+
+Starts api_server.py in a subprocess, opens N /events subscribers (read from
+one selector loop, so the client side needs no thread per connection) and
+posts /record usage events over a keep-alive connection at a fixed rate. For
+each subscriber count it reports the /record rate and p50/p99 latency (to
+show admission is not slowed by the fan-out), spend updates received per
+subscriber, and p50/p99 lag from the server building an update to a
+subscriber reading it.
+
+Usage: python3 benchmarks/bench_events.py [--levels 0,100,400] [--duration 3] [--rate 200]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import selectors
+import threading
+import subprocess
+import http.client
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(port):
+    command = [sys.executable, os.path.join(PROJECT_DIR, "api_server.py"), "--port", str(port),
+               "--no-dashboard-file"]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError("api_server.py did not start")
+
+
+def subscribe(port, n):
+    selector = selectors.DefaultSelector()
+    for _ in range(n):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(b"GET /events HTTP/1.1\r\nHost: bench\r\nAccept: text/event-stream\r\n\r\n")
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, {"buffer": b"", "headers": False, "updates": 0})
+    return selector
+
+
+def read_events(selector, stop, lags):
+    while not stop.is_set():
+        for key, _ in selector.select(0.05):
+            state = key.data
+            try:
+                chunk = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            if not chunk:
+                selector.unregister(key.fileobj)
+                continue
+            now = time.time()
+            state["buffer"] += chunk
+            if not state["headers"]:
+                if b"\r\n\r\n" not in state["buffer"]:
+                    continue
+                state["buffer"] = state["buffer"].split(b"\r\n\r\n", 1)[1]
+                state["headers"] = True
+            *messages, state["buffer"] = state["buffer"].split(b"\n\n")
+            for message in messages:
+                lines = message.decode().splitlines()
+                if not any(line.startswith("id: ") for line in lines):
+                    continue  # the initial totals, or a keep-alive
+                for line in lines:
+                    if line.startswith("data: "):
+                        data = json.loads(line[6:])
+                        if "spend_delta_usd" in data:
+                            state["updates"] += 1
+                            lags.append(now - data["ts"])
+
+
+def post_records(port, rate, duration):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    body = json.dumps({"cost": 0.000001, "input_tokens": 10}).encode()
+    latencies = []
+    start = time.perf_counter()
+    for i in range(int(rate * duration)):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        t0 = time.perf_counter()
+        conn.request("POST", "/record", body=body, headers={"Content-Type": "application/json"})
+        conn.getresponse().read()
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return len(latencies) / elapsed, sorted(latencies)
+
+
+def percentile_ms(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--levels", default="0,100,400", help="Comma-separated subscriber counts (default 0,100,400)")
+    parser.add_argument("--duration", type=float, default=3.0, help="Seconds of /record traffic per level (default 3)")
+    parser.add_argument("--rate", type=float, default=200.0, help="/record requests per second (default 200)")
+    args = parser.parse_args()
+
+    print(f"{'subscribers':>11} {'record/s':>9} {'rec p50':>8} {'rec p99':>8} "
+          f"{'updates/sub':>12} {'lag p50':>8} {'lag p99':>8}")
+    for subscribers in (int(level) for level in args.levels.split(",")):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = start_server(port)
+        try:
+            selector = subscribe(port, subscribers)
+            lags, stop = [], threading.Event()
+            reader = threading.Thread(target=read_events, args=(selector, stop, lags), daemon=True)
+            reader.start()
+            time.sleep(0.5)  # let the subscriptions settle
+            rate, latencies = post_records(port, args.rate, args.duration)
+            time.sleep(0.5)  # last coalesced update
+            stop.set()
+            reader.join()
+            counts = [key.data["updates"] for key in selector.get_map().values()]
+            lags.sort()
+            per_subscriber = sum(counts) / len(counts) if counts else 0
+            print(f"{subscribers:>11} {rate:>9.0f} {percentile_ms(latencies, 0.5):>8.2f} "
+                  f"{percentile_ms(latencies, 0.99):>8.2f} {per_subscriber:>12.1f} "
+                  f"{percentile_ms(lags, 0.5):>8.1f} {percentile_ms(lags, 0.99):>8.1f}")
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+bench_latency_overhead.py — Per-stage cost of the latency_stats instrumentation.
+
+Times the instrumented pattern (clock read plus LATENCY.lap) against the
+disabled path (one LATENCY.enabled check) and an empty loop, and reports
+the added nanoseconds per stage.
+
+Usage: python3 benchmarks/bench_latency_overhead.py [--iterations 1000000]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from latency_stats import LatencyRecorder
+
+
+def empty(recorder, n):
+    for _ in range(n):
+        pass
+
+
+def instrumented(recorder, n):
+    for _ in range(n):
+        t0 = time.perf_counter_ns() if recorder.enabled else 0
+        if t0:
+            recorder.lap("stage", t0)
+
+
+def per_iteration_ns(fn, recorder, n):
+    start = time.perf_counter_ns()
+    fn(recorder, n)
+    return (time.perf_counter_ns() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=1_000_000,
+                        help="Stages timed per run (default 1000000)")
+    args = parser.parse_args()
+
+    baseline = per_iteration_ns(empty, LatencyRecorder(), args.iterations)
+    disabled = per_iteration_ns(instrumented, LatencyRecorder(enabled=False), args.iterations)
+    enabled = per_iteration_ns(instrumented, LatencyRecorder(enabled=True), args.iterations)
+    print(f"{'mode':>10} {'ns/stage':>10}")
+    print(f"{'disabled':>10} {disabled - baseline:>10.1f}")
+    print(f"{'enabled':>10} {enabled - baseline:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
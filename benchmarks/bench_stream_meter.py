@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+bench_stream_meter.py — Per-chunk cost of metering a streamed response.
+
+Feeds one-token SSE lines through the client's stream accumulator with and
+without a StreamMeter attached, and reports nanoseconds per chunk and the
+stream rate each path could sustain. The meter consults the breaker window
+every --sync-tokens tokens.
+
+Usage: python3 benchmarks/bench_stream_meter.py [--chunks 200000] [--sync-tokens 32]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cost_calculator import BudgetGuard
+from circuit_breaker import CircuitBreaker
+from llm_client import _StreamAccumulator
+
+LINE = b'data: {"choices":[{"index":0,"delta":{"content":"t42 "}}]}\n'
+
+
+def run(meter, chunks):
+    accumulator = _StreamAccumulator("openai", meter, None)
+    feed_line = accumulator.feed_line
+    start = time.perf_counter_ns()
+    for _ in range(chunks):
+        feed_line(LINE)
+    return (time.perf_counter_ns() - start) / chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, default=200_000, help="Streamed chunks per run (default 200000)")
+    parser.add_argument("--sync-tokens", type=int, default=32,
+                        help="Tokens between breaker window checks (default 32)")
+    args = parser.parse_args()
+
+    guard = BudgetGuard()
+    guard.breaker = CircuitBreaker(cost_limit=1e9, token_velocity_limit=10**12)
+    guard.thresholds["bench"] = 1e9
+    meter = guard.meter_stream("gemini-2.5-flash", 100, "bench", sync_tokens=args.sync_tokens)
+    meter.start()
+
+    plain = run(None, args.chunks)
+    metered = run(meter, args.chunks)
+    meter.cancel()
+    print(f"{'path':>10} {'ns/chunk':>10} {'chunks/s':>12}")
+    print(f"{'unmetered':>10} {plain:>10.0f} {1e9 / plain:>12,.0f}")
+    print(f"{'metered':>10} {metered:>10.0f} {1e9 / metered:>12,.0f}")
+    print(f"meter overhead: {metered - plain:.0f} ns/chunk")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+bench_transport.py — Throughput of pooled vs per-request HTTP connections.
+
+Starts the local fake provider in a subprocess (so it does not share this
+process's GIL) with a fixed latency and sends the same chat request N times: with a new http.client connection per request (the old
+integration), through HTTPTransport from a thread pool, and through
+AsyncHTTPTransport with asyncio.gather. Reports requests/s and connections
+opened.
+
+Usage: python3 benchmarks/bench_transport.py [--requests 400] [--concurrency 16] [--latency 0.01]
+"""
+
+import os
+import sys
+import time
+import json
+import socket
+import asyncio
+import subprocess
+import argparse
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_transport import HTTPTransport, AsyncHTTPTransport
+
+PATH = "/v1/chat/completions"
+PAYLOAD = {"model": "fake", "messages": [{"role": "user", "content": "Summarize the release notes."}]}
+HEADERS = {"Authorization": "Bearer bench", "Content-Type": "application/json"}
+
+
+def new_connection_per_request(url, n, concurrency):
+    parts = urlsplit(url)
+    body = json.dumps(PAYLOAD).encode()
+
+    def call(_):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        conn.request("POST", PATH, body=body, headers=HEADERS)
+        conn.getresponse().read()
+        conn.close()
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(call, range(n)))
+    return n
+
+
+def pooled_sync(url, n, concurrency):
+    transport = HTTPTransport(url, max_connections=concurrency)
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda _: transport.post_json(PATH, PAYLOAD, HEADERS), range(n)))
+    transport.close()
+    return transport.connections_opened
+
+
+def pooled_async(url, n, concurrency):
+    async def run():
+        transport = AsyncHTTPTransport(url, max_connections=concurrency)
+        await asyncio.gather(*[transport.post_json(PATH, PAYLOAD, HEADERS) for _ in range(n)])
+        await transport.close()
+        return transport.connections_opened
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400, help="Requests per mode (default 400)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight (default 16)")
+    parser.add_argument("--latency", type=float, default=0.01, help="Fake provider latency in s (default 0.01)")
+    args = parser.parse_args()
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fake_provider.py")
+    server = subprocess.Popen([sys.executable, script, "--port", str(port), "--latency", str(args.latency)],
+                              stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    print(f"{'mode':>22} {'req/s':>9} {'connections':>12}")
+    for name, fn in (("new connection/request", new_connection_per_request),
+                     ("pooled (threads)", pooled_sync),
+                     ("pooled (asyncio)", pooled_async)):
+        start = time.perf_counter()
+        connections = fn(url, args.requests, args.concurrency)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>22} {args.requests / elapsed:>9.0f} {connections:>12}")
+    server.terminate()
+    server.wait()
+
+
+if __name__ == "__main__":
+    main()
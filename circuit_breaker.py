@@ -1,4 +1,6 @@
+import math
 import time
+import itertools
 import collections
 
 class CircuitBreaker:
@@ -15,7 +17,8 @@ class CircuitBreaker:
         token_failure_threshold=3,
         cost_limit=5.0,        # $5 cost limit
         cost_window_seconds=300, # 5 minutes for cost velocity
-        cost_failure_threshold=3
+        cost_failure_threshold=3,
+        reservation_timeout=600  # in-flight reservations not settled by then are released
     ):
         self.token_failure_threshold = token_failure_threshold
         self.cost_failure_threshold = cost_failure_threshold
@@ -24,6 +27,7 @@ class CircuitBreaker:
         self.token_window_seconds = token_window_seconds
         self.cost_limit = cost_limit
         self.cost_window_seconds = cost_window_seconds
+        self.reservation_timeout = reservation_timeout
         
         self.state = "CLOSED"
         # Track overall failures for the old mechanism, but now
@@ -39,6 +43,17 @@ class CircuitBreaker:
         # For cost velocity tracking
         self.cost_events = collections.deque() # Stores (timestamp, cost_incurred)
 
+        # In-flight reservations: id -> (expires_at, cost, tokens). They count
+        # towards both windows until committed with actual usage or released.
+        self.reservations = {}
+        self._reservation_ids = itertools.count(1)
+        # Bumped by every change made through these methods, so readers can
+        # cache views of the breaker (see summary)
+        self.version = 0
+        # Lifetime usage recorded, for readers that report spend as deltas
+        self.total_cost = 0.0
+        self.total_tokens = 0
+
     def _clean_old_events(self, event_deque, window_seconds):
         now = time.time()
         while event_deque and event_deque[0][0] < now - window_seconds:
@@ -47,15 +62,192 @@ class CircuitBreaker:
     def _get_current_sum(self, event_deque):
         return sum(event[1] for event in event_deque)
 
+    def _window_sum(self, event_deque, window_seconds):
+        self._clean_old_events(event_deque, window_seconds)
+        return self._get_current_sum(event_deque)
+
+    def _expire_reservations(self):
+        now = time.time()
+        expired = [rid for rid, (expires_at, _, _) in self.reservations.items() if expires_at <= now]
+        for rid in expired:
+            del self.reservations[rid]
+        if expired:
+            self.version += 1
+
+    def reserved(self):
+        """(cost, tokens) held by in-flight reservations."""
+        self._expire_reservations()
+        return (sum(r[1] for r in self.reservations.values()),
+                sum(r[2] for r in self.reservations.values()))
+
+    def would_exceed(self, cost=0.0, tokens=0):
+        """
+        Returns True if adding cost/tokens now, on top of recorded usage and
+        in-flight reservations, would push either velocity window over its
+        limit. Read-only: nothing is recorded or evicted.
+        """
+        now = time.time()
+        reserved_cost = reserved_tokens = 0
+        for expires_at, r_cost, r_tokens in self.reservations.values():
+            if expires_at > now:
+                reserved_cost += r_cost
+                reserved_tokens += r_tokens
+        if tokens > 0:
+            cutoff = now - self.token_window_seconds
+            used = sum(t for ts, t in self.token_events if ts >= cutoff)
+            if used + reserved_tokens + tokens > self.token_velocity_limit:
+                return True
+        if cost > 0.0:
+            cutoff = now - self.cost_window_seconds
+            used = sum(c for ts, c in self.cost_events if ts >= cutoff)
+            if used + reserved_cost + cost > self.cost_limit:
+                return True
+        return False
+
+    def reserve(self, cost=0.0, tokens=0, timeout=None):
+        """
+        Holds cost/tokens for a call about to be made. Returns a reservation id,
+        or None (recording a failure, as track_usage does) if the hold would
+        push a window over its limit. Settle it with commit() once the call
+        returns, or release() if it fails; unsettled holds lapse after timeout
+        (default reservation_timeout) seconds.
+        """
+        reserved_cost, reserved_tokens = self.reserved()
+        if tokens > 0:
+            current_tokens = self._window_sum(self.token_events, self.token_window_seconds) + reserved_tokens + tokens
+            if current_tokens > self.token_velocity_limit:
+                print(f"[CIRCUIT BREAKER] ALERT: Reserving {tokens} tokens would bring token velocity to {current_tokens} (limit {self.token_velocity_limit}) in {self.token_window_seconds}s.")
+                self.record_failure(reason="token_velocity", failure_type="token")
+                return None
+        if cost > 0.0:
+            current_cost = self._window_sum(self.cost_events, self.cost_window_seconds) + reserved_cost + cost
+            if current_cost > self.cost_limit:
+                print(f"[CIRCUIT BREAKER] ALERT: Reserving ${cost:.4f} would bring cost velocity to ${current_cost:.2f} (limit ${self.cost_limit:.2f}) in {self.cost_window_seconds}s.")
+                self.record_failure(reason="cost_velocity", failure_type="cost")
+                return None
+        reservation_id = next(self._reservation_ids)
+        timeout = self.reservation_timeout if timeout is None else timeout
+        self.reservations[reservation_id] = (time.time() + timeout, cost, tokens)
+        self.version += 1
+        return reservation_id
+
+    def extend(self, reservation_id, cost=0.0, tokens=0):
+        """
+        Raises a held reservation to cost/tokens in total, for a call whose
+        usage grows while it runs (a streaming response), and renews its
+        lapse time to at least reservation_timeout from now, so a call still
+        making progress keeps its hold. Returns False, leaving the hold
+        unchanged, if the new total would push a window over its limit or
+        the id is not held (see holds()).
+        """
+        self._expire_reservations()
+        held = self.reservations.get(reservation_id)
+        if held is None:
+            return False
+        expires_at, held_cost, held_tokens = held
+        reserved_cost, reserved_tokens = self.reserved()
+        if tokens > held_tokens:
+            used = self._window_sum(self.token_events, self.token_window_seconds)
+            if used + reserved_tokens - held_tokens + tokens > self.token_velocity_limit:
+                return False
+        if cost > held_cost:
+            used = self._window_sum(self.cost_events, self.cost_window_seconds)
+            if used + reserved_cost - held_cost + cost > self.cost_limit:
+                return False
+        self.reservations[reservation_id] = (max(expires_at, time.time() + self.reservation_timeout), cost, tokens)
+        self.version += 1
+        return True
+
+    def holds(self, reservation_id):
+        """True if reservation_id is held (neither settled, released nor lapsed)."""
+        self._expire_reservations()
+        return reservation_id in self.reservations
+
+    def commit(self, reservation_id, cost=0.0, tokens=0):
+        """
+        Replaces a reservation with the actual usage of the call. Returns
+        track_usage's verdict for the actual figures. An unknown or lapsed id
+        still records the usage: the money was spent either way.
+        """
+        if self.reservations.pop(reservation_id, None) is not None:
+            self.version += 1
+        return self.track_usage(tokens=tokens, cost=cost)
+
+    def release(self, reservation_id):
+        """Drops a reservation whose call failed or was abandoned. Returns False if it was not held."""
+        if self.reservations.pop(reservation_id, None) is None:
+            return False
+        self.version += 1
+        return True
+
     def check_state(self):
         if self.state == "OPEN":
             if time.time() - self.last_failure_time > self.recovery_timeout:
                 self.state = "HALF_OPEN"
+                self.version += 1
                 print("[CIRCUIT BREAKER] Transitioning to HALF_OPEN...")
         return self.state
 
+    def reset(self):
+        """Closes the circuit and clears failure counts; recorded usage stays."""
+        self.state = "CLOSED"
+        self.failures = 0
+        self.token_failures = 0
+        self.cost_failures = 0
+        self.version += 1
+
+    def summary(self, now=None):
+        """
+        Read-only view for monitoring: the state check_state() would report,
+        live window sums and reservations, and "stable_until", the time these
+        figures next change without new activity (an event ageing out of a
+        window, a reservation lapsing, or the recovery timeout of an OPEN
+        circuit). Together with version it tells a caller how long a view
+        stays current. Nothing is evicted or transitioned.
+        """
+        now = time.time() if now is None else now
+        stable_until = math.inf
+        state = self.state
+        if state == "OPEN":
+            if now - self.last_failure_time > self.recovery_timeout:
+                state = "HALF_OPEN"
+            else:
+                stable_until = self.last_failure_time + self.recovery_timeout
+        sums = []
+        for events, window_seconds in ((self.cost_events, self.cost_window_seconds),
+                                       (self.token_events, self.token_window_seconds)):
+            cutoff = now - window_seconds
+            total = 0
+            for ts, amount in events:
+                if ts >= cutoff:
+                    total += amount
+                    stable_until = min(stable_until, ts + window_seconds)
+            sums.append(total)
+        reserved_cost = reserved_tokens = 0
+        for expires_at, r_cost, r_tokens in self.reservations.values():
+            if expires_at > now:
+                reserved_cost += r_cost
+                reserved_tokens += r_tokens
+                stable_until = min(stable_until, expires_at)
+        return {
+            "state": state,
+            "cost_limit": self.cost_limit,
+            "cost_window_seconds": self.cost_window_seconds,
+            "window_cost": sums[0],
+            "window_tokens": sums[1],
+            "reserved_cost": reserved_cost,
+            "reserved_tokens": reserved_tokens,
+            "token_velocity_limit": self.token_velocity_limit,
+            "token_window_seconds": self.token_window_seconds,
+            "cost_failures": self.cost_failures,
+            "token_failures": self.token_failures,
+            "last_failure_time": self.last_failure_time,
+            "stable_until": stable_until,
+        }
+
     def record_failure(self, reason="unknown", failure_type="general"):
         self.last_failure_time = time.time()
+        self.version += 1
 
         if failure_type == "token":
             self.token_failures += 1
@@ -81,6 +273,7 @@ class CircuitBreaker:
             print(f"[CIRCUIT BREAKER] Circuit is now OPEN due to {failure_type} failure.")
 
     def record_success(self):
+        self.version += 1
         if self.state == "HALF_OPEN":
             self.state = "CLOSED"
             self.token_failures = 0
@@ -92,15 +285,20 @@ class CircuitBreaker:
 
     def track_usage(self, tokens=0, cost=0.0):
         """
-        Tracks token and cost usage. Returns True if within limits, False if circuit should open.
+        Tracks token and cost usage. Returns True if within limits (counting
+        in-flight reservations), False if circuit should open.
         """
         now = time.time()
+        if tokens > 0 or cost > 0.0:
+            self.version += 1
+            self.total_cost += cost
+            self.total_tokens += tokens
 
         # Token velocity check
         if tokens > 0:
             self.token_events.append((now, tokens))
             self._clean_old_events(self.token_events, self.token_window_seconds)
-            current_tokens = self._get_current_sum(self.token_events)
+            current_tokens = self._get_current_sum(self.token_events) + self.reserved()[1]
             if current_tokens > self.token_velocity_limit:
                 print(f"[CIRCUIT BREAKER] ALERT: Token velocity ({current_tokens} tokens) exceeded limit ({self.token_velocity_limit} tokens) in {self.token_window_seconds}s.")
                 self.record_failure(reason="token_velocity", failure_type="token")
@@ -110,7 +308,7 @@ class CircuitBreaker:
         if cost > 0.0:
             self.cost_events.append((now, cost))
             self._clean_old_events(self.cost_events, self.cost_window_seconds)
-            current_cost = self._get_current_sum(self.cost_events)
+            current_cost = self._get_current_sum(self.cost_events) + self.reserved()[0]
             if current_cost > self.cost_limit:
                 print(f"[CIRCUIT BREAKER] ALERT: Cost velocity (${current_cost:.2f}) exceeded limit (${self.cost_limit:.2f}) in {self.cost_window_seconds}s.")
                 self.record_failure(reason="cost_velocity", failure_type="cost")
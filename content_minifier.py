@@ -0,0 +1,175 @@
+"""
+content_minifier.py — Structure-aware minification of message content.
+
+Splits message text into prose, JSON, fenced code and tabular segments and
+minifies each one in a way that keeps it valid: JSON is re-serialized with
+compact separators, code loses blank lines and full-line comments but keeps
+its indentation, table cells lose their padding, and prose gets the usual
+whitespace collapse.
+"""
+
+import re
+import json
+
+CONTENT_TYPES = ("prose", "json", "code", "table")
+
+_FENCE_RE = re.compile(r"^[ \t]*```[ \t]*([\w+#.-]*)[^\n]*\n(.*?)^[ \t]*```[ \t]*$", re.M | re.S)
+_JSON_DECODER = json.JSONDecoder()
+
+# Languages whose full-line comments can be dropped without changing meaning.
+_LINE_COMMENT = {
+    "python": "#", "py": "#", "sh": "#", "bash": "#", "shell": "#", "zsh": "#",
+    "ruby": "#", "rb": "#", "toml": "#", "dockerfile": "#", "r": "#",
+    "javascript": "//", "js": "//", "typescript": "//", "ts": "//", "jsx": "//", "tsx": "//",
+    "java": "//", "c": "//", "cpp": "//", "c++": "//", "h": "//", "cs": "//", "csharp": "//",
+    "go": "//", "rust": "//", "rs": "//", "swift": "//", "kotlin": "//", "kt": "//", "scala": "//",
+    "php": "//",
+}
+# Multi-line string delimiters whose contents must be left untouched.
+_MULTILINE_STRINGS = {
+    "python": ('"""', "'''"), "py": ('"""', "'''"),
+    "javascript": ("`",), "js": ("`",), "typescript": ("`",), "ts": ("`",), "jsx": ("`",), "tsx": ("`",),
+    "go": ("`",), "kotlin": ('"""',), "kt": ('"""',), "scala": ('"""',), "swift": ('"""',), "java": ('"""',),
+}
+
+_PIPE_ROW_RE = re.compile(r"^\s*\|?[^|\n]*(\|[^|\n]*){2,}\s*$")
+_ALIGNED_ROW_RE = re.compile(r"\S( {2,}|\t)\S.*\S( {2,}|\t)\S")
+
+
+def minify_json(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def minify_code(code, lang=""):
+    """
+    Drops trailing whitespace everywhere, and for known languages drops blank
+    lines and full-line comments outside multi-line strings. Indentation and
+    inline comments (which may sit inside string literals) are kept.
+    """
+    lang = lang.lower()
+    marker = _LINE_COMMENT.get(lang)
+    delimiters = _MULTILINE_STRINGS.get(lang, ())
+    open_string = None
+    lines = []
+    for line in code.splitlines():
+        stripped = line.strip()
+        if open_string is None and marker:
+            if not stripped:
+                continue
+            if stripped.startswith(marker) and not stripped.startswith("#!"):
+                continue
+        lines.append(line if open_string else line.rstrip())
+        for delim in delimiters:
+            if open_string in (None, delim) and line.count(delim) % 2 == 1:
+                open_string = None if open_string else delim
+    return "\n".join(lines)
+
+
+def minify_table(rows):
+    """Removes cell padding from pipe, tab or space-aligned table rows."""
+    out = []
+    for row in rows:
+        row = row.strip()
+        if "|" in row:
+            row = re.sub(r"[ \t]*\|[ \t]*", "|", row)
+            row = re.sub(r"-{3,}", "---", row)
+        else:
+            row = re.sub(r"( {2,}|\t)[ \t]*", "\t", row)
+        out.append(row)
+    return "\n".join(out)
+
+
+def _is_table_row(line):
+    return bool(_PIPE_ROW_RE.match(line) or _ALIGNED_ROW_RE.search(line))
+
+
+def split_segments(text):
+    """
+    Splits text into (content_type, original_text, minified_text) segments,
+    in order. Fenced blocks tagged json that parse are JSON, other fences are
+    code; unfenced lines starting a complete JSON value are JSON; runs of two
+    or more table-like rows are tables; everything else is prose.
+    """
+    segments = []
+    pos = 0
+    for m in _FENCE_RE.finditer(text):
+        segments.extend(_split_unfenced(text[pos:m.start()]))
+        lang, body = m.group(1), m.group(2)
+        if lang.lower() in ("json", "jsonc"):
+            try:
+                minified = minify_json(json.loads(body))
+                segments.append(("json", m.group(0), f"```json\n{minified}\n```"))
+                pos = m.end()
+                continue
+            except ValueError:
+                pass
+        segments.append(("code", m.group(0), f"```{lang}\n{minify_code(body, lang)}\n```"))
+        pos = m.end()
+    segments.extend(_split_unfenced(text[pos:]))
+    return segments
+
+
+def _split_unfenced(text):
+    segments = []
+    prose = []
+    lines = text.splitlines(keepends=True)
+    offsets = []
+    offset = 0
+    for line in lines:
+        offsets.append(offset)
+        offset += len(line)
+
+    def flush_prose():
+        chunk = "".join(prose)
+        if chunk.strip():
+            segments.append(("prose", chunk, " ".join(chunk.split())))
+        prose.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        head = line.lstrip()
+        if head[:1] in ("{", "["):
+            start = offsets[i] + len(line) - len(head)
+            try:
+                value, end = _JSON_DECODER.raw_decode(text, start)
+            except ValueError:
+                value, end = None, None
+            line_end = text.find("\n", end) if end is not None else -1
+            if line_end == -1:
+                line_end = len(text)
+            if end is not None and not text[end:line_end].strip():
+                flush_prose()
+                segments.append(("json", text[start:end], minify_json(value)))
+                while i < len(lines) and offsets[i] < end:
+                    i += 1
+                continue
+        j = i
+        while j < len(lines) and _is_table_row(lines[j]):
+            j += 1
+        if j - i >= 2:
+            flush_prose()
+            rows = [l.rstrip("\n") for l in lines[i:j]]
+            segments.append(("table", "".join(lines[i:j]), minify_table(rows)))
+            i = j
+            continue
+        prose.append(line)
+        i += 1
+    flush_prose()
+    return segments
+
+
+def minify_content(text, count_tokens=None, savings=None):
+    """
+    Minifies text segment by segment and joins the non-empty results with
+    newlines. When count_tokens and a savings dict are given, tokens saved are
+    accumulated per content type in savings.
+    """
+    pieces = []
+    for kind, original, minified in split_segments(text):
+        if savings is not None and count_tokens is not None and original != minified:
+            saved = count_tokens(original) - count_tokens(minified)
+            savings[kind] = savings.get(kind, 0) + max(0, saved)
+        if minified:
+            pieces.append(minified)
+    return "\n".join(pieces)
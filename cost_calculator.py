@@ -2,14 +2,61 @@ import sys
 import json
 import os
 import time
+import queue
+import asyncio
+import threading
 
 from circuit_breaker import CircuitBreaker
+from output_predictor import OutputTokenPredictor
+from stream_meter import StreamMeter
+from latency_stats import LATENCY
+
+# Alerts are sent by one background worker so admission never waits on SMTP.
+_notification_queue = queue.Queue(maxsize=100)
+_notification_worker = None
+_notification_worker_lock = threading.Lock()
+
+
+def _notification_loop():
+    while True:
+        subject, message = _notification_queue.get()
+        try:
+            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+            from notifier import send_alert_email
+            send_alert_email(subject, message)
+        except ImportError:
+            pass  # Notifier optional — alert already printed
+        except Exception as e:
+            print(f"[NOTIFICATION SYSTEM] Failed to send alert: {e}")
+
+
+def _dispatch_notification(subject, message):
+    """Fire-and-forget: queue the alert, dropping it if the queue is full."""
+    global _notification_worker
+    with _notification_worker_lock:
+        if _notification_worker is None or not _notification_worker.is_alive():
+            _notification_worker = threading.Thread(target=_notification_loop, name="budget-guard-notifier", daemon=True)
+            _notification_worker.start()
+    try:
+        _notification_queue.put_nowait((subject, message))
+    except queue.Full:
+        pass
 
 class BudgetGuard:
     def __init__(self, config_path="config.json"):
         self.config_path = config_path
         self.load_config()
         self.breaker = CircuitBreaker(cost_limit=5.00, cost_window_seconds=300) # $5 limit every 5 mins
+        self._optimizer = None # TokenOptimizer, created on first prepare_request
+        # Guards breaker state so sync threads and asyncio tasks can share one guard
+        self.lock = threading.RLock()
+        self.output_predictor = self._load_output_predictor()
+        # Calls answered from the response cache: admitted at zero cost
+        self.cache_hits = 0
+        self.cache_saved_usd = 0.0
+        # Requests refused by any admission check, and the latest reason
+        self.blocked_requests = 0
+        self.last_block_message = None
         
         # 2026 Model Pricing Metadata (per 1M tokens, base currency: USD)
         self.model_pricing = {
@@ -47,6 +94,49 @@ class BudgetGuard:
         self.notification_email = self.config.get("notification_email", "")
         self.display_currency = self.config.get("currency", "USD")
 
+    def _load_output_predictor(self):
+        """
+        Builds the output-token predictor from the "output_prediction" config
+        section. Paths are relative to the config file. With no saved state,
+        the predictor is bootstrapped in memory from the usage log, using
+        logged tasks that name a budget context as that context.
+        """
+        options = self.config.get("output_prediction", {})
+        base_dir = os.path.dirname(os.path.abspath(self.config_path))
+        state_path = os.path.join(base_dir, options.get("state_path", "data/output_predictor.json"))
+        usage_log = os.path.join(base_dir, options.get("usage_log", "data/usage_log.jsonl"))
+        predictor = OutputTokenPredictor(
+            percentile=options.get("percentile", 0.9),
+            default_tokens=options.get("default_tokens", 500),
+            state_path=state_path,
+        )
+        if not os.path.exists(state_path) and os.path.exists(usage_log):
+            predictor.bootstrap_from_usage_log(usage_log, contexts=self.thresholds)
+        return predictor
+
+    def predict_output_tokens(self, model, context="routine"):
+        """Output tokens to assume for a preflight estimate (learned from actual usage)."""
+        return self.output_predictor.predict(model, context)
+
+    def record_output_tokens(self, model, context, output_tokens):
+        """Feeds the actual output tokens of a finished call to the predictor."""
+        self.output_predictor.observe(model, context, output_tokens)
+
+    def record_cache_hit(self, model, input_tokens=0, output_tokens=0):
+        """
+        Records a call served from the response cache as a zero-cost call: it
+        adds nothing to the breaker windows, and what it would have cost is
+        added to the saved-spend total. Returns that saved cost in USD.
+        """
+        saved = self.estimate_cost(model, input_tokens, output_tokens)
+        with self.lock:
+            self.cache_hits += 1
+            self.cache_saved_usd += saved
+        return saved
+
+    def get_cache_savings(self):
+        return {"hits": self.cache_hits, "saved_usd": self.cache_saved_usd}
+
     def set_currency(self, currency_code: str):
         """Set display currency for cost estimates. Raises ValueError if unsupported."""
         if currency_code not in self.fx_rates:
@@ -96,36 +186,165 @@ class BudgetGuard:
         Cleans messages and checks budget before confirming the request.
         """
         try:
-            from token_optimizer import TokenOptimizer
-            optimizer = TokenOptimizer()
-            optimized_messages = optimizer.optimize_payload(messages)
+            if self._optimizer is None:
+                from token_optimizer import TokenOptimizer
+                self._optimizer = TokenOptimizer()
+            payload = self._optimizer.optimize_payload_with_counts(messages)
+            optimized_messages = payload["messages"]
             
-            # Simple token estimation (approximate)
-            input_tokens = sum(len(m['content']) // 4 for m in optimized_messages)
-            cost = self.estimate_cost(model, input_tokens, target_output_tokens=500) # Assumption
+            # Exact token count from the optimizer (no re-estimation)
+            input_tokens = payload["input_tokens"]
+            cost = self.estimate_cost(model, input_tokens, self.predict_output_tokens(model, context))
             
             ok, msg = self.check_budget(cost, context)
             return ok, msg, optimized_messages
         except ImportError:
             return True, "Optimizer not found, proceeding with raw messages.", messages
 
+    async def prepare_request_async(self, model, messages, context="routine"):
+        """
+        prepare_request for asyncio callers: tokenization runs on the default
+        executor, admission through check_budget_async.
+        """
+        try:
+            if self._optimizer is None:
+                from token_optimizer import TokenOptimizer
+                self._optimizer = TokenOptimizer()
+        except ImportError:
+            return True, "Optimizer not found, proceeding with raw messages.", messages
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(None, self._optimizer.optimize_payload_with_counts, messages)
+        cost = self.estimate_cost(model, payload["input_tokens"], self.predict_output_tokens(model, context))
+        ok, msg = await self.check_budget_async(cost, context)
+        return ok, msg, payload["messages"]
+
+    def check_circuit(self):
+        """
+        Cheapest admission check: blocks when the breaker is OPEN, without
+        recording any usage. Returns (ok, message).
+        """
+        with self.lock:
+            if self.breaker.check_state() == "OPEN":
+                msg = "[CIRCUIT BREAKER] Request blocked: Circuit is OPEN due to prior budget breaches."
+                self._count_block(msg)
+                self.trigger_notification(msg)
+                return False, msg
+            return True, "Circuit OK."
+
+    def reject_over_limit(self, estimated_cost, context, limit):
+        """Alerts on and records a per-request limit breach. Returns (False, message)."""
+        alert_msg = f"ALERT: Estimated cost ${estimated_cost:.4f} exceeds {context} limit of ${limit:.4f}."
+        self.trigger_notification(alert_msg)
+        with self.lock:
+            self._count_block(alert_msg)
+            self.breaker.record_failure(reason="per_request_limit", failure_type="cost") # Record as a cost failure
+        return False, alert_msg
+
+    def reject_over_window(self, estimated_cost):
+        """
+        Alerts on and records a velocity-window breach for a request that will
+        not be made, without adding its cost to the window. Returns (False, message).
+        """
+        with self.lock:
+            self.breaker.record_failure(reason="cost_velocity", failure_type="cost")
+            msg = (f"[CIRCUIT BREAKER] Request blocked: Circuit is now {self.breaker.check_state()} "
+                   f"due to cost velocity exceeding limits.")
+            self._count_block(msg)
+        print(f"[CIRCUIT BREAKER] ALERT: ${estimated_cost:.4f} would push cost velocity over its limit.")
+        self.trigger_notification(msg)
+        return False, msg
+
     def check_budget(self, estimated_cost, context="routine"):
+        if not LATENCY.enabled:
+            with self.lock:
+                return self._check_budget(estimated_cost, context)
+        t0 = time.perf_counter_ns()
+        with self.lock:
+            t0 = LATENCY.lap("guard.lock_wait", t0)
+            result = self._check_budget(estimated_cost, context)
+        LATENCY.lap("guard.check_budget", t0)
+        return result
+
+    async def check_budget_async(self, estimated_cost, context="routine"):
+        """
+        Non-blocking check_budget for asyncio callers. The check is a few
+        in-memory operations, so it runs inline when the lock is free and moves
+        to the default executor only while a sync caller holds it.
+        """
+        if self.lock.acquire(blocking=False):
+            try:
+                return self._check_budget(estimated_cost, context)
+            finally:
+                self.lock.release()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.check_budget, estimated_cost, context)
+
+    def reserve_budget(self, estimated_cost, context="routine", estimated_tokens=0, timeout=None):
+        """
+        Two-phase form of check_budget: instead of recording the estimate as
+        spent, holds it in the breaker window as an in-flight reservation that
+        concurrent callers see. Returns (ok, message, reservation_id); settle
+        the reservation with commit_usage once the call returns, or
+        release_reservation if it fails or times out. timeout overrides the
+        breaker's reservation_timeout for calls expected to take longer.
+        """
+        with self.lock:
+            return self._check_budget(estimated_cost, context, reserve=True, estimated_tokens=estimated_tokens,
+                                      reservation_timeout=timeout)
+
+    def commit_usage(self, reservation_id, actual_cost, input_tokens=0, output_tokens=0,
+                     model=None, context="routine"):
+        """
+        Replaces a reservation with the call's actual cost and tokens, so the
+        window reflects real spend. With model given, the output tokens also
+        train the output predictor. Returns False (and alerts) if the actual
+        usage pushed a velocity window over its limit.
+        """
+        if model is not None and output_tokens:
+            self.record_output_tokens(model, context, output_tokens)
+        with self.lock:
+            within_limits = self.breaker.commit(reservation_id, cost=actual_cost,
+                                                tokens=input_tokens + output_tokens)
+        if not within_limits:
+            self.trigger_notification(
+                f"[CIRCUIT BREAKER] Actual usage of ${actual_cost:.4f} pushed spend velocity over its limit."
+            )
+        return within_limits
+
+    def release_reservation(self, reservation_id):
+        """Frees a reservation whose call failed or was abandoned."""
+        with self.lock:
+            return self.breaker.release(reservation_id)
+
+    def meter_stream(self, model, input_tokens, context="routine", sync_tokens=32):
+        """StreamMeter for a streaming call; call its start() before sending the request."""
+        return StreamMeter(self, model, input_tokens, context, sync_tokens)
+
+    def _check_budget(self, estimated_cost, context, reserve=False, estimated_tokens=0, reservation_timeout=None):
         current_circuit_state = self.breaker.check_state()
-        if current_circuit_state == "OPEN":
-            msg = "[CIRCUIT BREAKER] Request blocked: Circuit is OPEN due to prior budget breaches."
-            self.trigger_notification(msg)
-            return False, msg
+        ok, msg = self.check_circuit()
+        if not ok:
+            return (False, msg, None) if reserve else (False, msg)
         
-        # Track usage; this will call record_failure internally if limits are exceeded
-        usage_within_limits = self.breaker.track_usage(cost=estimated_cost)
+        # Track (or reserve) usage; this will call record_failure internally if limits are exceeded
+        reservation_id = None
+        if reserve:
+            reservation_id = self.breaker.reserve(cost=estimated_cost, tokens=estimated_tokens,
+                                                  timeout=reservation_timeout)
+            usage_within_limits = reservation_id is not None
+        else:
+            usage_within_limits = self.breaker.track_usage(cost=estimated_cost)
         
         new_circuit_state = self.breaker.check_state()
 
         if not usage_within_limits or new_circuit_state == "OPEN":
             # If track_usage returned False, or it turned OPEN, then a limit was hit
+            if reservation_id is not None:
+                self.breaker.release(reservation_id)
             msg = f"[CIRCUIT BREAKER] Request blocked: Circuit is now {new_circuit_state} due to cost velocity exceeding limits."
+            self._count_block(msg)
             self.trigger_notification(msg)
-            return False, msg
+            return (False, msg, None) if reserve else (False, msg)
 
         # If we reach here, usage was within limits (track_usage returned True)
         # and the circuit is not OPEN (it could be CLOSED or HALF_OPEN)
@@ -137,27 +356,25 @@ class BudgetGuard:
         # 2. Check per-request limit (only if circuit is not open)
         limit = self.thresholds.get(context, self.default_threshold)
         if estimated_cost > limit:
-            alert_msg = f"ALERT: Estimated cost ${estimated_cost:.4f} exceeds {context} limit of ${limit:.4f}."
-            self.trigger_notification(alert_msg)
-            self.breaker.record_failure(reason="per_request_limit", failure_type="cost") # Record as a cost failure
-            return False, alert_msg
+            if reservation_id is not None:
+                self.breaker.release(reservation_id)
+                return self.reject_over_limit(estimated_cost, context, limit) + (None,)
+            return self.reject_over_limit(estimated_cost, context, limit)
         
         # If all checks pass and state was HALF_OPEN, record success (handled above if it transitions to CLOSED)
         # If it's CLOSED and passes, nothing special to do.
         if new_circuit_state == "HALF_OPEN" and usage_within_limits:
             self.breaker.record_success() # If in half-open and successful, close it.
         
-        return True, "Budget OK."
+        return (True, "Budget OK.", reservation_id) if reserve else (True, "Budget OK.")
+
+    def _count_block(self, message):
+        self.blocked_requests += 1
+        self.last_block_message = message
 
     def trigger_notification(self, message):
         print(f"[NOTIFICATION SYSTEM] Sending alert: {message}")
-        try:
-            import sys, os
-            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-            from notifier import send_alert_email
-            send_alert_email("⚠️ Agent Budget Alert", message)
-        except ImportError:
-            pass  # Notifier optional — alert already printed above
+        _dispatch_notification("⚠️ Agent Budget Alert", message)
 
     def get_meter_data(self):
         """
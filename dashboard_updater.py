@@ -11,6 +11,8 @@ import os
 import sys
 import time
 import json
+import tempfile
+import threading
 from datetime import datetime, timezone
 
 # Ensure we can import siblings
@@ -71,17 +73,23 @@ def estimated_daily_cost(velocity_per_hour: float) -> float:
 
 # ─── Dashboard Generation ─────────────────────────────────────────────────────
 
-def generate_dashboard(guard: BudgetGuard) -> str:
+def generate_dashboard(guard: BudgetGuard, summary: dict = None) -> str:
+    """
+    Renders the dashboard markdown. summary is a breaker summary to render
+    from (CircuitBreaker.summary(), which leaves the breaker untouched);
+    by default one is taken with get_circuit_breaker_summary.
+    """
     now_utc = datetime.now(timezone.utc)
     now_local_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    cb = get_circuit_breaker_summary(guard.breaker)
+    cb = summary if summary is not None else get_circuit_breaker_summary(guard.breaker)
     state = cb["state"]
     window_cost = cb["window_cost"]
     window_tokens = int(cb["window_tokens"])
     cost_limit = cb["cost_limit"]
     window_secs = cb["cost_window_seconds"]
 
+    savings = guard.get_cache_savings()
     velocity = spend_velocity(window_cost, window_secs)
     daily_est = estimated_daily_cost(velocity)
 
@@ -160,6 +168,15 @@ def generate_dashboard(guard: BudgetGuard) -> str:
 
 ---
 
+## ♻️ Response Cache
+
+| Metric | Value |
+|--------|-------|
+| **Cache Hits** | {savings["hits"]:,} |
+| **Saved Spend** | {fmt(savings["saved_usd"])} |
+
+---
+
 ## 🎯 Model Pricing Reference
 
 | Model | Input ($/1M) | Output ($/1M) |
@@ -172,6 +189,70 @@ def generate_dashboard(guard: BudgetGuard) -> str:
     return md
 
 
+# ─── Writing ─────────────────────────────────────────────────────────────────
+
+def write_dashboard(path: str, content) -> None:
+    """
+    Replaces path atomically (temp file in the same directory, then rename),
+    so a concurrent reader sees the old or the new dashboard, never half of one.
+    """
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".dashboard-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates it owner-only
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class DashboardWriter:
+    """
+    Writes rendered dashboards to path on a background thread, so callers
+    (request handlers) never wait on the disk. Only the latest submitted
+    content is written; older unwritten versions are skipped.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.writes = 0
+        self._cond = threading.Condition()
+        self._pending = None
+        self._busy = False
+        self._thread = None
+
+    def submit(self, content) -> None:
+        with self._cond:
+            self._pending = content
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="dashboard-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Waits until everything submitted is on disk. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None)
+                content, self._pending = self._pending, None
+                self._busy = True
+            try:
+                write_dashboard(self.path, content)
+                self.writes += 1
+            except OSError as e:
+                print(f"[DASHBOARD] Could not write {self.path}: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
 # ─── Logging ─────────────────────────────────────────────────────────────────
 
 def write_log(base_dir: str, message: str):
@@ -198,9 +279,7 @@ def main():
     try:
         guard = BudgetGuard(config_path=config_path)
         content = generate_dashboard(guard)
-
-        with open(dashboard_path, "w") as f:
-            f.write(content)
+        write_dashboard(dashboard_path, content)
 
         log_path = write_log(base_dir, f"Dashboard updated successfully → {dashboard_path}")
         print(f"✅ Dashboard written to: {dashboard_path}")
@@ -1,4 +1,8 @@
+import time
 import unittest
+import asyncio
+import threading
+from unittest.mock import patch
 import json
 import os
 from orchestrator import GuardOrchestrator
@@ -31,5 +35,141 @@ class TestEndToEnd(unittest.TestCase):
         self.assertEqual(result["recommended_model"], "gemini-flash-1.5")
         print(f"E2E Test Success: Blocked Sonnet, Recommended {result['recommended_model']}")
 
+    def test_input_tokens_come_from_optimizer(self):
+        messages = [{"role": "user", "content": "Summarize   the  release notes."}]
+        result = self.orchestrator.process_request("gemini-flash-1.5", messages, "routine")
+        self.assertEqual(result["status"], "ok")
+        expected = self.orchestrator.optimizer.estimate_tokens("Summarize the release notes.")
+        self.assertEqual(result["input_tokens"], expected)
+
+    def test_open_breaker_blocks_before_optimizing(self):
+        self.orchestrator.guard.breaker.state = "OPEN"
+        self.orchestrator.guard.breaker.last_failure_time = 1e12
+        with patch.object(self.orchestrator.optimizer, "optimize_payload_with_counts") as optimize:
+            result = self.orchestrator.process_request("gemini-flash-1.5", [{"role": "user", "content": "hi"}])
+        optimize.assert_not_called()
+        self.assertEqual(result["status"], "blocked")
+        self.assertEqual(result["decided_by"], "breaker")
+
+    def test_cost_floor_blocks_before_optimizing(self):
+        # 500 output tokens on Sonnet alone cost $0.0075 > $0.005
+        self.orchestrator.guard.thresholds["routine"] = 0.005
+        with patch.object(self.orchestrator.optimizer, "optimize_payload_with_counts") as optimize:
+            result = self.orchestrator.process_request("claude-3-5-sonnet", [{"role": "user", "content": "x" * 10_000_000}])
+        optimize.assert_not_called()
+        self.assertEqual(result["status"], "blocked")
+        self.assertEqual(result["decided_by"], "bounds")
+        self.assertEqual(self.orchestrator.guard.breaker.cost_failures, 1)
+
+    def test_window_block_on_the_floor_adds_no_spend(self):
+        breaker = self.orchestrator.guard.breaker
+        breaker.cost_limit = 0.005  # below the $0.0075 output floor on Sonnet
+        self.orchestrator.guard.thresholds["routine"] = 1.0
+        for reserve in (False, True):
+            result = self.orchestrator.process_request("claude-3-5-sonnet", [{"role": "user", "content": "hi"}],
+                                                       reserve=reserve)
+            self.assertEqual(result["decided_by"], "bounds")
+            self.assertNotIn("reservation_id", result)
+        self.assertEqual(breaker.total_cost, 0.0)
+        self.assertEqual(breaker.reserved(), (0, 0))
+        self.assertEqual(len(breaker.cost_events), 0)
+        self.assertEqual(breaker.cost_failures, 2)
+
+    def test_limit_and_pricing_changes_apply_without_clearing_the_cache(self):
+        limit, floor, _ = self.orchestrator.context_limit("claude-3-5-sonnet", "routine", False)
+        self.orchestrator.guard.thresholds["routine"] = limit / 2
+        self.assertEqual(self.orchestrator.context_limit("claude-3-5-sonnet", "routine", False)[0], limit / 2)
+        pricing = dict(self.orchestrator.guard.model_pricing["claude-3-5-sonnet"])
+        pricing["output"] *= 2
+        self.orchestrator.guard.model_pricing["claude-3-5-sonnet"] = pricing
+        self.assertAlmostEqual(self.orchestrator.context_limit("claude-3-5-sonnet", "routine", False)[1], floor * 2)
+
+    def test_budget_stage_decides_when_bounds_are_inconclusive(self):
+        result = self.orchestrator.process_request("gemini-flash-1.5", [{"role": "user", "content": "hi"}])
+        self.assertEqual(result["status"], "ok")
+        self.assertEqual(result["decided_by"], "budget")
+
+    def test_process_requests_returns_results_in_order(self):
+        requests = [
+            {"model": "gemini-flash-1.5", "messages": [{"role": "user", "content": "short task"}]},
+            {"model": "claude-3-5-sonnet", "messages": [{"role": "user", "content": "x" * 100000}]},
+            {"model": "gemini-flash-1.5", "messages": [{"role": "user", "content": "another   task"}], "context": "routine"},
+        ]
+        results = self.orchestrator.process_requests(requests)
+        self.assertEqual([r["status"] for r in results], ["ok", "blocked", "ok"])
+        self.assertEqual(results[2]["optimized_messages"][0]["content"], "another task")
+        self.assertEqual(results[1]["recommended_model"], "gemini-flash-1.5")
+
+    def test_process_requests_open_breaker_skips_tokenizing(self):
+        self.orchestrator.guard.breaker.state = "OPEN"
+        self.orchestrator.guard.breaker.last_failure_time = 1e12
+        requests = [{"model": "gemini-flash-1.5", "messages": [{"role": "user", "content": "hi"}]}] * 3
+        with patch.object(self.orchestrator.optimizer, "encoding") as encoding:
+            results = self.orchestrator.process_requests(requests)
+        encoding.encode_batch.assert_not_called()
+        self.assertEqual([r["decided_by"] for r in results], ["breaker"] * 3)
+
+    def test_process_request_async_matches_sync(self):
+        messages = [{"role": "user", "content": "Summarize   the  release notes."}]
+        result = asyncio.run(self.orchestrator.process_request_async("gemini-flash-1.5", messages, "routine"))
+        self.assertEqual(result["status"], "ok")
+        self.assertEqual(result["optimized_messages"][0]["content"], "Summarize the release notes.")
+
+    def test_async_admission_does_not_block_the_loop_on_the_guard_lock(self):
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with self.orchestrator.guard.lock:
+                held.set()
+                release.wait(2)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+
+        async def run():
+            task = asyncio.ensure_future(self.orchestrator.process_request_async(
+                "gemini-flash-1.5", [{"role": "user", "content": "hi"}]))
+            start = time.monotonic()
+            for _ in range(5):
+                await asyncio.sleep(0.01)
+            ticking = time.monotonic() - start
+            self.assertFalse(task.done())
+            release.set()
+            return ticking, await task
+
+        ticking, result = asyncio.run(run())
+        holder.join()
+        self.assertLess(ticking, 1.0)
+        self.assertEqual(result["status"], "ok")
+
+    def test_repeated_request_reuses_payload_but_rechecks_budget(self):
+        messages = [{"role": "user", "content": "Heartbeat: report   status."}]
+        first = self.orchestrator.process_request("gemini-flash-1.5", messages, "routine")
+        with patch.object(self.orchestrator.optimizer, "optimize_payload_with_counts") as optimize:
+            second = self.orchestrator.process_request("gemini-flash-1.5", messages, "routine")
+            optimize.assert_not_called()
+            self.assertEqual(second["optimized_messages"], first["optimized_messages"])
+            self.assertEqual(second["input_tokens"], first["input_tokens"])
+
+            self.orchestrator.guard.thresholds["routine"] = 1e-9
+            third = self.orchestrator.process_request("gemini-flash-1.5", messages, "routine")
+            optimize.assert_not_called()
+        # Admission is never cached: the tightened limit blocks the same payload
+        self.assertEqual(third["status"], "blocked")
+        self.assertEqual(self.orchestrator.preflight_cache.stats()["hits"], 1)
+
+    def test_reserve_then_commit_actual_usage(self):
+        messages = [{"role": "user", "content": "Summarize the release notes."}]
+        result = self.orchestrator.process_request("gemini-flash-1.5", messages, "routine", reserve=True)
+        self.assertEqual(result["status"], "ok")
+        breaker = self.orchestrator.guard.breaker
+        self.assertAlmostEqual(breaker.reserved()[0], result["estimated_cost"])
+        self.assertEqual(len(breaker.cost_events), 0)
+        self.orchestrator.guard.commit_usage(result["reservation_id"], 0.00002, result["input_tokens"], 40,
+                                             model="gemini-flash-1.5", context="routine")
+        self.assertEqual(breaker.reserved(), (0, 0))
+        self.assertEqual([c for _, c in breaker.cost_events], [0.00002])
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,235 @@
+"""
+event_stream.py — Server-sent events of live spend, blocks and breaker transitions.
+
+Monitoring UIs subscribe to an EventHub instead of polling /status. A single
+broadcaster thread watches the guard: every poll_interval it compares the
+breaker's version (one integer read, no lock), and when something changed it
+reads a breaker summary under the guard lock and sends the difference since
+the previous update:
+
+  event: spend    {"spend_delta_usd", "tokens_delta", "window_cost", "window_tokens",
+                   "reserved_cost", "reserved_tokens", "cost_limit", "state", "ts"}
+  event: block    {"count", "total", "message", "ts"}     requests refused since the last update
+  event: breaker  {"from", "to", "ts"}                    circuit state changed
+
+Updates are coalesced: at most max_rate per second go out, each covering
+everything since the previous one, so a burst of calls costs one message.
+Each message is encoded once and handed to every subscriber's bounded queue
+without blocking; a subscriber whose queue is full (a consumer that is not
+keeping up) is dropped and its connection closed. Admission never waits on a
+subscriber.
+"""
+
+import json
+import time
+import queue
+import threading
+
+
+def format_sse(event, data, event_id=None):
+    """One SSE message as bytes."""
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+KEEPALIVE = b": keep-alive\n\n"
+
+
+def stream_messages(hub, subscriber):
+    """
+    Yields a subscriber's messages for writing to its connection, with
+    KEEPALIVE after hub.keepalive seconds of silence; ends if the subscriber
+    is dropped. Unsubscribes when the caller stops iterating.
+    """
+    try:
+        while True:
+            message = subscriber.get(hub.keepalive)
+            if message is None:
+                if subscriber.dropped:
+                    return
+                message = KEEPALIVE
+            yield message
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+class Subscriber:
+    """A consumer's bounded queue of encoded messages."""
+    def __init__(self, queue_size):
+        self._queue = queue.Queue(queue_size)
+        self.dropped = False
+
+    def get(self, timeout=None):
+        """Next message, or None if none arrived within timeout or the subscriber was dropped."""
+        if self.dropped:
+            return None
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _offer(self, message):
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            self.dropped = True
+            return False
+
+
+class EventHub:
+    """
+    max_rate: most updates per second a subscriber receives.
+    queue_size: messages a subscriber may fall behind by before it is dropped.
+    max_subscribers: subscribe() refuses beyond this many.
+    keepalive: seconds of silence after which a server should send KEEPALIVE
+    (callers use it as the timeout of Subscriber.get).
+    """
+    def __init__(self, guard, max_rate=4.0, queue_size=64, max_subscribers=512, keepalive=15.0,
+                 poll_interval=0.05):
+        self.guard = guard
+        self.min_gap = 1.0 / max_rate
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.keepalive = keepalive
+        self.poll_interval = min(poll_interval, self.min_gap)
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+        self._ids = 0
+        self._last = None  # baseline of the previous update
+        self.messages_sent = 0
+        self.subscribers_dropped = 0
+
+    # ── Subscriptions ───────────────────────────────────────────────────
+
+    def subscribe(self):
+        """A new Subscriber primed with the current totals, or None when the hub is full."""
+        with self._lock:
+            if self._closed or len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber = Subscriber(self.queue_size)
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+                self._thread.start()
+        with self.guard.lock:
+            state = self._read()
+        subscriber._offer(format_sse("spend", self._spend_data(state, 0.0, 0)))
+        self._wake.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for subscriber in self._subscribers:
+                subscriber.dropped = True
+            self._subscribers.clear()
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "messages_sent": self.messages_sent,
+                "subscribers_dropped": self.subscribers_dropped,
+            }
+
+    # ── Broadcaster ─────────────────────────────────────────────────────
+
+    def _read(self):
+        """Current figures (under the guard lock)."""
+        breaker = self.guard.breaker
+        now = time.time()
+        return {
+            "breaker": breaker,
+            "version": breaker.version,
+            "blocked": self.guard.blocked_requests,
+            "block_message": self.guard.last_block_message,
+            "total_cost": breaker.total_cost,
+            "total_tokens": breaker.total_tokens,
+            "summary": breaker.summary(now),
+            "ts": now,
+        }
+
+    @staticmethod
+    def _spend_data(state, spend_delta, tokens_delta):
+        summary = state["summary"]
+        return {
+            "spend_delta_usd": spend_delta,
+            "tokens_delta": tokens_delta,
+            "window_cost": summary["window_cost"],
+            "window_tokens": summary["window_tokens"],
+            "reserved_cost": summary["reserved_cost"],
+            "reserved_tokens": summary["reserved_tokens"],
+            "cost_limit": summary["cost_limit"],
+            "state": summary["state"],
+            "ts": state["ts"],
+        }
+
+    def _changed(self, last):
+        breaker = self.guard.breaker
+        return (breaker is not last["breaker"] or breaker.version != last["version"]
+                or self.guard.blocked_requests != last["blocked"]
+                or time.time() >= last["summary"]["stable_until"])
+
+    def _run(self):
+        with self.guard.lock:
+            self._last = self._read()
+        last_sent = 0.0
+        while True:
+            self._wake.clear()  # before looking, so a subscribe() after the look still wakes us
+            with self._lock:
+                if self._closed:
+                    return
+                idle = not self._subscribers
+            if idle:
+                self._wake.wait()
+                with self.guard.lock:
+                    self._last = self._read()  # deltas start from when someone is listening
+                continue
+            time.sleep(self.poll_interval)
+            if not self._changed(self._last):
+                continue
+            wait = last_sent + self.min_gap - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)  # coalesce: everything until then goes into one update
+            with self.guard.lock:
+                state = self._read()
+            self._broadcast(self._messages(self._last, state))
+            self._last = state
+            last_sent = time.monotonic()
+
+    def _messages(self, last, state):
+        same_breaker = state["breaker"] is last["breaker"]
+        spend_delta = state["total_cost"] - last["total_cost"] if same_breaker else state["total_cost"]
+        tokens_delta = state["total_tokens"] - last["total_tokens"] if same_breaker else state["total_tokens"]
+        self._ids += 1
+        message = format_sse("spend", self._spend_data(state, spend_delta, tokens_delta), self._ids)
+        blocks = state["blocked"] - last["blocked"]
+        if blocks > 0:
+            message += format_sse("block", {"count": blocks, "total": state["blocked"],
+                                            "message": state["block_message"], "ts": state["ts"]})
+        before, after = last["summary"]["state"], state["summary"]["state"]
+        if before != after:
+            message += format_sse("breaker", {"from": before, "to": after, "ts": state["ts"]})
+        return message
+
+    def _broadcast(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        dropped = [s for s in subscribers if not s._offer(message)]
+        with self._lock:
+            self.messages_sent += 1
+            for subscriber in dropped:
+                self._subscribers.discard(subscriber)
+            self.subscribers_dropped += len(dropped)
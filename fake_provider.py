@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+fake_provider.py — Local OpenAI/Anthropic-compatible server for offline tests and benchmarks.
+
+Endpoints:
+  POST /v1/chat/completions  — OpenAI-style; usage.prompt_tokens / completion_tokens
+  POST /v1/messages          — Anthropic-style; usage.input_tokens / output_tokens
+  POST /v1/messages/batches  — batch job of Anthropic-style requests ({"requests":
+                               [{"custom_id", "params"}]}); ends batch_delay seconds later
+  GET  /v1/messages/batches/<id>          — job status ("in_progress" / "ended")
+  GET  /v1/messages/batches/<id>/results  — JSONL, one {"custom_id", "result"} per request
+  POST /v1/files             — multipart upload of an OpenAI batch input file (purpose "batch")
+  POST /v1/batches           — OpenAI-style batch job of an uploaded file's chat requests
+                               ({"input_file_id", "endpoint"}); ends batch_delay seconds later
+  GET  /v1/batches/<id>      — job status ("in_progress" / "completed", "output_file_id")
+  GET  /v1/files/<id>/content — the output file: JSONL, one {"custom_id", "response"} per request
+
+Requests with "stream": true get a chunked text/event-stream response in
+the provider's SSE format: stream_tokens one-token deltas, token_delay
+seconds apart, then the usage. With corrupt_stream_after set, a malformed
+data line follows that many deltas.
+
+Speaks HTTP/1.1 with keep-alive. Injects latency (fixed plus random jitter,
+plus extra delay for chosen API keys or models) and 429 responses with a
+Retry-After header at a configurable ratio, and rejects requests without an
+API key with 401. Token counts are approximate (one token per four
+characters).
+
+Usage: python3 fake_provider.py [--port 8900] [--latency 0.05] [--rate-limit-ratio 0.1]
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # benchmarks open many connections at once
+
+
+def _approx_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _fake_message(model, messages, max_tokens, message_id):
+    """Anthropic-style message for a request, with approximate usage."""
+    text = f"Fake reply from {model}."
+    return {
+        "id": message_id, "type": "message", "role": "assistant", "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": _approx_tokens(_message_text(messages)),
+                  "output_tokens": min(max_tokens or 16, _approx_tokens(text))},
+    }
+
+
+def _fake_completion(model, messages, max_tokens, completion_id):
+    """OpenAI-style chat completion for a request, with approximate usage."""
+    message = _fake_message(model, messages, max_tokens, completion_id)
+    input_tokens, output_tokens = message["usage"]["input_tokens"], message["usage"]["output_tokens"]
+    return {
+        "id": completion_id, "object": "chat.completion", "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": message["content"][0]["text"]},
+                     "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                  "total_tokens": input_tokens + output_tokens},
+    }
+
+
+def _message_text(messages):
+    parts = []
+    for m in messages:
+        content = m.get("content", "")
+        if isinstance(content, list):  # Anthropic content blocks
+            content = " ".join(block.get("text", "") for block in content if isinstance(block, dict))
+        parts.append(str(content))
+    return " ".join(parts)
+
+
+class FakeProviderServer:
+    """
+    In-process fake provider. start() returns the base URL; the server runs
+    on daemon threads until stop(). Counters record requests, connections
+    and injected 429s.
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 rate_limit_ratio=0.0, retry_after=1, seed=None, stream_tokens=64, token_delay=0.0,
+                 key_latency=None, model_latency=None, batch_delay=0.0, corrupt_stream_after=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.stream_tokens = stream_tokens
+        self.token_delay = token_delay
+        self.streams_aborted = 0
+        self.corrupt_stream_after = corrupt_stream_after
+        # Extra delay for requests made with a given API key or for a given model
+        self.key_latency = dict(key_latency or {})
+        self.model_latency = dict(model_latency or {})
+        self.batch_delay = batch_delay
+        self.batches = {}  # id -> {"requests", "ends_at"}; OpenAI jobs also have "input_file_id"
+        self.files = {}  # id -> uploaded bytes
+        self.requests = 0
+        self.connections = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _draw(self):
+        """(delay seconds, throttle?) for one request."""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+            throttle = self.rate_limit_ratio > 0 and self.rng.random() < self.rate_limit_ratio
+            if throttle:
+                self.rate_limited += 1
+        return delay, throttle
+
+    def _handler_class(self):
+        fake = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without TCP_NODELAY,
+            # Nagle plus delayed ACKs would stall every keep-alive response.
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def log_message(self, fmt, *args):
+                pass
+
+            def _send_json(self, data, status=200, headers=None):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # client gave up (timeout/deadline)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                if self.path not in ("/v1/chat/completions", "/v1/messages", "/v1/messages/batches",
+                                     "/v1/files", "/v1/batches"):
+                    return self._send_json({"error": {"message": "not found"}}, 404)
+                if not (self.headers.get("Authorization") or self.headers.get("x-api-key")):
+                    return self._send_json({"error": {"message": "missing API key"}}, 401)
+                if self.path == "/v1/files":
+                    return self._upload_file(body)
+                try:
+                    request = json.loads(body or b"{}")
+                except ValueError:
+                    return self._send_json({"error": {"message": "invalid JSON"}}, 400)
+                if self.path == "/v1/messages/batches":
+                    return self._create_batch(request)
+                if self.path == "/v1/batches":
+                    return self._create_openai_batch(request)
+
+                delay, throttle = fake._draw()
+                if delay:
+                    time.sleep(delay)
+                if throttle:
+                    return self._send_json({"error": {"type": "rate_limit_error", "message": "rate limited"}},
+                                           429, {"Retry-After": str(fake.retry_after)})
+
+                model = request.get("model", "fake-model")
+                api_key = self.headers.get("x-api-key") or self.headers.get("Authorization", "").split()[-1]
+                extra = fake.key_latency.get(api_key, 0.0) + fake.model_latency.get(model, 0.0)
+                if extra:
+                    time.sleep(extra)
+                input_tokens = _approx_tokens(_message_text(request.get("messages", [])))
+                if request.get("stream"):
+                    return self._stream(model, input_tokens, min(request.get("max_tokens") or 16, fake.stream_tokens))
+                if self.path == "/v1/messages":
+                    self._send_json(_fake_message(model, request.get("messages", []), request.get("max_tokens"),
+                                                  f"msg_{fake.requests}"))
+                else:
+                    self._send_json(_fake_completion(model, request.get("messages", []), request.get("max_tokens"),
+                                                     f"chatcmpl-{fake.requests}"))
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                if not (self.headers.get("Authorization") or self.headers.get("x-api-key")):
+                    return self._send_json({"error": {"message": "missing API key"}}, 401)
+                if len(parts) == 3 and parts[:2] == ["v1", "batches"]:
+                    with fake._lock:
+                        batch = fake.batches.get(parts[2])
+                    if batch is None or "input_file_id" not in batch:
+                        return self._send_json({"error": {"message": "not found"}}, 404)
+                    return self._send_json(self._openai_batch_status(parts[2], batch))
+                if len(parts) == 4 and parts[:2] == ["v1", "files"] and parts[3] == "content":
+                    return self._send_openai_output(parts[2])
+                if len(parts) not in (4, 5) or parts[:3] != ["v1", "messages", "batches"]:
+                    return self._send_json({"error": {"message": "not found"}}, 404)
+                with fake._lock:
+                    batch = fake.batches.get(parts[3])
+                if batch is None or (len(parts) == 5 and parts[4] != "results"):
+                    return self._send_json({"error": {"message": "not found"}}, 404)
+                ended = time.time() >= batch["ends_at"]
+                if len(parts) == 4:
+                    return self._send_json(self._batch_status(parts[3], batch, ended))
+                if not ended:
+                    return self._send_json({"error": {"message": "batch still in progress"}}, 409)
+                lines = []
+                for i, item in enumerate(batch["requests"]):
+                    params = item.get("params", {})
+                    message = _fake_message(params.get("model", "fake-model"), params.get("messages", []),
+                                            params.get("max_tokens"), f"msg_{parts[3]}_{i}")
+                    lines.append(json.dumps({"custom_id": item.get("custom_id"),
+                                             "result": {"type": "succeeded", "message": message}}))
+                self._send_jsonl(lines)
+
+            def _send_jsonl(self, lines):
+                body = ("\n".join(lines) + "\n").encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-jsonl")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _upload_file(self, body):
+                content_type = self.headers.get("Content-Type", "")
+                if not content_type.startswith("multipart/form-data"):
+                    return self._send_json({"error": {"message": "expected multipart/form-data"}}, 400)
+                form = BytesParser(policy=policy.default).parsebytes(
+                    b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+                fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                          for part in form.iter_parts()}
+                if fields.get("purpose") != b"batch" or not fields.get("file"):
+                    return self._send_json({"error": {"message": "expected purpose=batch and a file"}}, 400)
+                with fake._lock:
+                    file_id = f"file-{len(fake.files) + 1}"
+                    fake.files[file_id] = fields["file"]
+                self._send_json({"id": file_id, "object": "file", "bytes": len(fields["file"]), "purpose": "batch"})
+
+            def _create_openai_batch(self, request):
+                with fake._lock:
+                    content = fake.files.get(request.get("input_file_id"))
+                if content is None:
+                    return self._send_json({"error": {"message": "no such input file"}}, 400)
+                try:
+                    requests = [json.loads(line) for line in content.decode().splitlines() if line.strip()]
+                except ValueError:
+                    return self._send_json({"error": {"message": "input file is not JSONL"}}, 400)
+                with fake._lock:
+                    batch_id = f"batch_{len(fake.batches) + 1}"
+                    batch = fake.batches[batch_id] = {"requests": requests, "input_file_id": request["input_file_id"],
+                                                      "ends_at": time.time() + fake.batch_delay}
+                self._send_json(self._openai_batch_status(batch_id, batch))
+
+            @staticmethod
+            def _openai_batch_status(batch_id, batch):
+                ended = time.time() >= batch["ends_at"]
+                count = len(batch["requests"])
+                return {
+                    "id": batch_id, "object": "batch", "endpoint": "/v1/chat/completions",
+                    "input_file_id": batch["input_file_id"], "completion_window": "24h",
+                    "status": "completed" if ended else "in_progress",
+                    "output_file_id": f"file-out-{batch_id}" if ended else None, "error_file_id": None,
+                    "request_counts": {"total": count, "completed": count if ended else 0, "failed": 0},
+                }
+
+            def _send_openai_output(self, file_id):
+                batch_id = file_id[len("file-out-"):] if file_id.startswith("file-out-") else None
+                with fake._lock:
+                    batch = fake.batches.get(batch_id)
+                if batch is None or "input_file_id" not in batch or time.time() < batch["ends_at"]:
+                    return self._send_json({"error": {"message": "not found"}}, 404)
+                lines = []
+                for i, item in enumerate(batch["requests"]):
+                    body = item.get("body", {})
+                    completion = _fake_completion(body.get("model", "fake-model"), body.get("messages", []),
+                                                  body.get("max_tokens"), f"chatcmpl-{batch_id}-{i}")
+                    lines.append(json.dumps({"id": f"batch_req_{i}", "custom_id": item.get("custom_id"),
+                                             "response": {"status_code": 200, "body": completion},
+                                             "error": None}))
+                self._send_jsonl(lines)
+
+            def _create_batch(self, request):
+                requests = request.get("requests")
+                if not requests:
+                    return self._send_json({"error": {"message": "requests must be a non-empty list"}}, 400)
+                with fake._lock:
+                    batch_id = f"msgbatch_{len(fake.batches) + 1}"
+                    batch = fake.batches[batch_id] = {"requests": requests,
+                                                      "ends_at": time.time() + fake.batch_delay}
+                self._send_json(self._batch_status(batch_id, batch, False))
+
+            @staticmethod
+            def _batch_status(batch_id, batch, ended):
+                count = len(batch["requests"])
+                return {
+                    "id": batch_id, "type": "message_batch",
+                    "processing_status": "ended" if ended else "in_progress",
+                    "request_counts": {"processing": 0 if ended else count, "succeeded": count if ended else 0,
+                                       "errored": 0, "canceled": 0, "expired": 0},
+                    "results_url": f"/v1/messages/batches/{batch_id}/results" if ended else None,
+                }
+
+            def _stream(self, model, input_tokens, output_tokens):
+                anthropic = self.path == "/v1/messages"
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                if anthropic:
+                    events = [{"type": "message_start", "message": {"model": model, "usage": {
+                        "input_tokens": input_tokens, "output_tokens": 0}}}]
+                    delta = lambda i: {"type": "content_block_delta", "index": 0,
+                                       "delta": {"type": "text_delta", "text": f"t{i % 100:02d} "}}
+                    tail = [{"type": "message_delta", "delta": {"stop_reason": "end_turn"},
+                             "usage": {"output_tokens": output_tokens}},
+                            {"type": "message_stop"}]
+                else:
+                    events = []
+                    delta = lambda i: {"choices": [{"index": 0, "delta": {"content": f"t{i % 100:02d} "}}]}
+                    tail = [{"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+                            {"choices": [], "usage": {"prompt_tokens": input_tokens,
+                                                      "completion_tokens": output_tokens}}]
+                try:
+                    for event in events:
+                        self._send_event(event)
+                    for i in range(output_tokens):
+                        if fake.token_delay and i:
+                            time.sleep(fake.token_delay)
+                        self._send_event(delta(i))
+                        if i + 1 == fake.corrupt_stream_after:
+                            self._send_chunk(b"data: {\"type\": \"content_block_del\n\n")
+                    for event in tail:
+                        self._send_event(event)
+                    if not anthropic:
+                        self._send_chunk(b"data: [DONE]\n\n")
+                    self._send_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    with fake._lock:
+                        fake.streams_aborted += 1
+                    self.close_connection = True
+
+            def _send_event(self, event):
+                self._send_chunk(b"data: " + json.dumps(event, separators=(",", ":")).encode() + b"\n\n")
+
+            def _send_chunk(self, data):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+        return _Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.05, help="Fixed delay per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay up to this many seconds")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--stream-tokens", type=int, default=64, help="Output tokens per streamed response")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed tokens")
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Seconds until a batch job ends")
+    args = parser.parse_args()
+    server = FakeProviderServer(args.host, args.port, args.latency, args.jitter,
+                                args.rate_limit_ratio, args.retry_after,
+                                stream_tokens=args.stream_tokens, token_delay=args.token_delay,
+                                batch_delay=args.batch_delay)
+    print(f"Fake provider listening on {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
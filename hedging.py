@@ -0,0 +1,135 @@
+"""
+hedging.py — Hedged LLM requests: learned per-model hedge delays and a hedge spend cap.
+
+A few slow upstream responses dominate p99 latency. When a call has not
+returned by the p95 of that model's recent latencies, LLMClient fires a
+second attempt (on another key, or on a cheaper model when no other key has
+room) and keeps whichever succeeds first. HedgePolicy supplies the delay
+(a P² sketch per model, as output_predictor uses for tokens) and caps what
+hedging may spend: the extra attempts in the breaker's cost window may not
+exceed budget_fraction of its cost_limit. Every hedge is also reserved in
+the breaker like any other call and settled with what the losing attempt
+actually cost.
+"""
+
+import time
+import threading
+import collections
+
+from output_predictor import P2Quantile
+
+
+class HedgePlan:
+    """A fired hedge: its model, key exclusions and the spend held for it."""
+    __slots__ = ("model", "exclude", "input_tokens", "estimated_cost", "reservation_id", "event")
+
+    def __init__(self, model, exclude, input_tokens, estimated_cost, reservation_id, event):
+        self.model = model
+        self.exclude = exclude
+        self.input_tokens = input_tokens
+        self.estimated_cost = estimated_cost
+        self.reservation_id = reservation_id
+        self.event = event  # [timestamp, cost] in HedgePolicy's spend window
+
+
+class HedgePolicy:
+    """
+    percentile: latency quantile after which to hedge (0.95).
+    min_samples: latencies a model needs before its calls are hedged.
+    budget_fraction: share of the breaker's cost window hedges may use.
+    context: thresholds context the hedge reservations are checked against.
+    """
+    def __init__(self, percentile=0.95, min_samples=20, budget_fraction=0.05, context="routine"):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget_fraction = budget_fraction
+        self.context = context
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._spend = collections.deque()  # [timestamp, cost]
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.skipped_over_budget = 0
+
+    def observe(self, model, seconds):
+        """Feeds the latency of a successful attempt."""
+        with self._lock:
+            sketch = self._latency.get(model)
+            if sketch is None:
+                sketch = self._latency[model] = P2Quantile(self.percentile)
+            sketch.add(seconds)
+
+    def delay(self, model):
+        """Seconds to wait before hedging a call to model, or None while still learning."""
+        with self._lock:
+            sketch = self._latency.get(model)
+            if sketch is None or sketch.count < self.min_samples:
+                return None
+            return sketch.value()
+
+    def hedge_spend(self, window_seconds):
+        """What hedges have cost (or hold) in the last window_seconds."""
+        with self._lock:
+            self._evict(time.time() - window_seconds)
+            return sum(event[1] for event in self._spend)
+
+    def _evict(self, cutoff):
+        while self._spend and self._spend[0][0] < cutoff:
+            self._spend.popleft()
+
+    def reserve(self, guard, model, exclude, input_tokens, output_tokens):
+        """
+        Holds the estimated cost of a hedge against both the hedge cap and the
+        guard. Returns a HedgePlan, or None if either says no.
+        """
+        breaker = guard.breaker
+        estimated_cost = guard.estimate_cost(model, input_tokens, output_tokens)
+        with self._lock:
+            self._evict(time.time() - breaker.cost_window_seconds)
+            spent = sum(event[1] for event in self._spend)
+            if spent + estimated_cost > self.budget_fraction * breaker.cost_limit:
+                self.skipped_over_budget += 1
+                return None
+            event = [time.time(), estimated_cost]
+            self._spend.append(event)
+        # A hedge is optional: skip it rather than let it record a breaker failure
+        with guard.lock:
+            crowded = guard.breaker.would_exceed(cost=estimated_cost, tokens=input_tokens + output_tokens)
+        ok, reservation_id = False, None
+        if not crowded:
+            ok, _, reservation_id = guard.reserve_budget(estimated_cost, self.context,
+                                                     estimated_tokens=input_tokens + output_tokens)
+        if not ok:
+            with self._lock:
+                event[1] = 0.0
+            return None
+        with self._lock:
+            self.hedges += 1
+        return HedgePlan(model, exclude, input_tokens, estimated_cost, reservation_id, event)
+
+    def settle(self, guard, plan, cost, input_tokens=0, output_tokens=0):
+        """Replaces a hedge's estimate with what the losing attempt actually cost."""
+        with self._lock:
+            plan.event[1] = cost
+        guard.commit_usage(plan.reservation_id, cost, input_tokens, output_tokens)
+
+    def release(self, guard, plan):
+        """Frees a hedge's hold when what its losing attempt cost is unknown (the attempt raised)."""
+        with self._lock:
+            plan.event[1] = 0.0
+        guard.release_reservation(plan.reservation_id)
+
+    def record_outcome(self, hedge_won):
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "skipped_over_budget": self.skipped_over_budget,
+                "delays": {model: sketch.value() for model, sketch in self._latency.items()
+                           if sketch.count >= self.min_samples},
+            }
@@ -0,0 +1,570 @@
+"""
+http_transport.py — Connection-pooled HTTP/1.1 transport for LLM provider calls.
+
+Keeps persistent keep-alive connections per pool key (one pool per API key,
+so a throttled key never holds connections another key needs), caps the
+number of concurrent requests per pool, and enforces per-request timeouts and
+absolute deadlines (time.monotonic() values shared across retries).
+
+HTTPTransport is the threaded front end built on http.client;
+AsyncHTTPTransport is the asyncio front end built on asyncio streams. Both
+return TransportResponse objects and raise TransportTimeout / TransportError.
+stream() returns the response as it arrives instead (TransportStream /
+AsyncTransportStream), holding the pool slot until the body is read to the
+end or the stream is closed; a stream closed early also closes its
+connection, since the rest of the body was never read. Standard library only.
+"""
+
+import ssl
+import json
+import socket
+import time
+import asyncio
+import threading
+import collections
+import http.client
+from urllib.parse import urlsplit
+
+
+class TransportError(Exception):
+    """The request could not be completed (connection refused, reset, bad response)."""
+
+
+class TransportTimeout(TransportError):
+    """The timeout or deadline ran out before a response arrived."""
+
+
+class TransportResponse:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers  # lower-cased names
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else {}
+
+
+def _remaining(timeout, deadline):
+    """Seconds this attempt may take: the timeout, cut short by the deadline."""
+    if deadline is None:
+        return timeout
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TransportTimeout("deadline exceeded")
+    return left if timeout is None else min(timeout, left)
+
+
+def _pool_label(key):
+    """A pool key safe to show in errors: pool keys are API keys, so only their last 4 characters."""
+    return "default" if key is None else f"...{str(key)[-4:]}"
+
+
+def _encode_body(body, headers):
+    if body is None or isinstance(body, bytes):
+        return body
+    headers.setdefault("Content-Type", "application/json")
+    return json.dumps(body, separators=(",", ":")).encode("utf-8")
+
+
+class _Pool:
+    """Idle connections plus a cap on requests in flight."""
+
+    def __init__(self, max_connections):
+        self.idle = collections.deque()
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_connections)
+
+
+class HTTPTransport:
+    """
+    Threaded transport: many threads may call request() at once. Each pool
+    key allows up to max_connections requests in flight; further callers wait
+    for a slot (bounded by their timeout/deadline).
+    """
+    def __init__(self, base_url, max_connections=8, timeout=30.0, headers=None):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or "http"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.scheme == "https" else 80)
+        self.base_path = parts.path.rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context() if self.scheme == "https" else None
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    def _pool(self, key):
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._pools_lock:
+                pool = self._pools.setdefault(key, _Pool(self.max_connections))
+        return pool
+
+    def _connect(self, timeout):
+        self.connections_opened += 1
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout, context=self._ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def request(self, method, path, body=None, headers=None, pool_key=None, timeout=None, deadline=None):
+        """
+        Sends one request on a pooled connection and reads the whole response.
+        body may be bytes or a JSON-serializable object. A reused connection
+        the server has since closed is replaced once, transparently.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        all_headers = {**self.headers, **(headers or {})}
+        payload = _encode_body(body, all_headers)
+        pool = self._pool(pool_key)
+        if not pool.slots.acquire(timeout=_remaining(timeout, deadline)):
+            raise TransportTimeout(f"no free connection for pool {_pool_label(pool_key)}")
+        try:
+            with pool.lock:
+                conn = pool.idle.pop() if pool.idle else None
+            for attempt in range(2):
+                reused = conn is not None
+                if conn is None:
+                    conn = self._connect(_remaining(timeout, deadline))
+                try:
+                    response = self._send(conn, method, path, payload, all_headers, _remaining(timeout, deadline))
+                except TransportTimeout:
+                    conn.close()
+                    raise
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                    conn.close()
+                    conn = None
+                    if reused and attempt == 0:
+                        continue  # stale keep-alive connection; retry on a fresh one
+                    raise TransportError(str(e)) from e
+                except (OSError, http.client.HTTPException) as e:
+                    conn.close()
+                    raise TransportError(str(e)) from e
+                if response.headers.get("connection", "").lower() == "close":
+                    conn.close()
+                else:
+                    with pool.lock:
+                        pool.idle.append(conn)
+                return response
+        finally:
+            pool.slots.release()
+
+    def _send(self, conn, method, path, payload, headers, timeout):
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        self.requests_sent += 1
+        try:
+            conn.request(method, self.base_path + path, body=payload, headers=headers)
+            raw = conn.getresponse()
+            body = raw.read()
+        except socket.timeout as e:
+            raise TransportTimeout(f"no response within {timeout:.3f}s") from e
+        headers = {k.lower(): v for k, v in raw.getheaders()}
+        if raw.will_close:
+            headers["connection"] = "close"
+        return TransportResponse(raw.status, headers, body)
+
+    def post_json(self, path, payload, headers=None, pool_key=None, timeout=None, deadline=None):
+        return self.request("POST", path, payload, headers, pool_key, timeout, deadline)
+
+    def stream(self, method, path, body=None, headers=None, pool_key=None, timeout=None, deadline=None):
+        """
+        Sends one request and returns a TransportStream once the response
+        headers arrive. timeout applies to each read; deadline to the whole
+        stream.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        all_headers = {**self.headers, **(headers or {})}
+        payload = _encode_body(body, all_headers)
+        pool = self._pool(pool_key)
+        if not pool.slots.acquire(timeout=_remaining(timeout, deadline)):
+            raise TransportTimeout(f"no free connection for pool {_pool_label(pool_key)}")
+        try:
+            with pool.lock:
+                conn = pool.idle.pop() if pool.idle else None
+            for attempt in range(2):
+                reused = conn is not None
+                if conn is None:
+                    conn = self._connect(_remaining(timeout, deadline))
+                try:
+                    conn.timeout = _remaining(timeout, deadline)
+                    if conn.sock is not None:
+                        conn.sock.settimeout(conn.timeout)
+                    self.requests_sent += 1
+                    conn.request(method, self.base_path + path, body=payload, headers=all_headers)
+                    raw = conn.getresponse()
+                except socket.timeout as e:
+                    conn.close()
+                    raise TransportTimeout(f"no response within {conn.timeout:.3f}s") from e
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                    conn.close()
+                    conn = None
+                    if reused and attempt == 0:
+                        continue  # stale keep-alive connection; retry on a fresh one
+                    raise TransportError(str(e)) from e
+                except (OSError, http.client.HTTPException) as e:
+                    conn.close()
+                    raise TransportError(str(e)) from e
+                return TransportStream(pool, conn, raw, timeout, deadline)
+        except BaseException:
+            pool.slots.release()
+            raise
+
+    def close(self):
+        with self._pools_lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            with pool.lock:
+                while pool.idle:
+                    pool.idle.pop().close()
+
+
+class TransportStream:
+    """
+    A response being read as it arrives. Iterate it for body lines (bytes,
+    with their line endings) or call read() for the rest of the body. Use it
+    as a context manager, or call close(), to give back the pool slot.
+    """
+    def __init__(self, pool, conn, raw, timeout, deadline):
+        self.status = raw.status
+        self.headers = {k.lower(): v for k, v in raw.getheaders()}
+        self._pool = pool
+        self._conn = conn
+        self._raw = raw
+        self._timeout = timeout
+        self._deadline = deadline
+        self._open = True
+
+    def __iter__(self):
+        raw, sock = self._raw, self._conn.sock
+        try:
+            while True:
+                if self._deadline is not None:
+                    sock.settimeout(_remaining(self._timeout, self._deadline))
+                line = raw.readline()
+                if not line:
+                    break
+                yield line
+        except socket.timeout as e:
+            self.close()
+            raise TransportTimeout("stream stalled past its timeout") from e
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            raise TransportError(str(e)) from e
+        self._finish()
+
+    def read(self):
+        try:
+            body = self._raw.read()
+        except socket.timeout as e:
+            self.close()
+            raise TransportTimeout("stream stalled past its timeout") from e
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            raise TransportError(str(e)) from e
+        self._finish()
+        return body
+
+    def json(self):
+        body = self.read()
+        return json.loads(body) if body else {}
+
+    def _finish(self):
+        """Body fully read: the connection can serve the next request."""
+        if not self._open:
+            return
+        self._open = False
+        if self._raw.will_close:
+            self._conn.close()
+        else:
+            with self._pool.lock:
+                self._pool.idle.append(self._conn)
+        self._pool.slots.release()
+
+    def close(self):
+        if not self._open:
+            return
+        self._open = False
+        self._conn.close()
+        self._pool.slots.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def _body_pieces(reader, status, headers):
+    """Yields the response body as it arrives, undoing chunked encoding."""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if size == 0:
+                while await reader.readuntil(b"\r\n") != b"\r\n":
+                    pass  # trailers
+                return
+            yield await reader.readexactly(size)
+            await reader.readexactly(2)
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining:
+            piece = await reader.read(min(remaining, 65536))
+            if not piece:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            remaining -= len(piece)
+            yield piece
+    elif not (status in (204, 304) or 100 <= status < 200):
+        while True:
+            piece = await reader.read(65536)
+            if not piece:
+                return
+            yield piece
+
+
+class AsyncTransportStream:
+    """
+    Async form of TransportStream: `async for line in stream`, await
+    read(), and `async with` / close().
+    """
+    def __init__(self, pool, conn, status, headers, keep_alive, timeout, deadline):
+        self.status = status
+        self.headers = headers
+        self._pool = pool
+        self._conn = conn
+        self._keep_alive = keep_alive
+        self._timeout = timeout
+        self._deadline = deadline
+        self._open = True
+
+    async def _pieces(self):
+        pieces = _body_pieces(self._conn[0], self.status, self.headers)
+        try:
+            while True:
+                try:
+                    piece = await asyncio.wait_for(pieces.__anext__(), _remaining(self._timeout, self._deadline))
+                except StopAsyncIteration:
+                    break
+                yield piece
+        except asyncio.TimeoutError:
+            self.close()
+            raise TransportTimeout("stream stalled past its timeout") from None
+        except (asyncio.IncompleteReadError, OSError, ValueError) as e:
+            self.close()
+            raise TransportError(str(e) or type(e).__name__) from e
+        self._finish()
+
+    async def __aiter__(self):
+        buffer = b""
+        async for piece in self._pieces():
+            buffer += piece
+            if b"\n" in buffer:
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    yield line + b"\n"
+        if buffer:
+            yield buffer
+
+    async def read(self):
+        return b"".join([piece async for piece in self._pieces()])
+
+    async def json(self):
+        body = await self.read()
+        return json.loads(body) if body else {}
+
+    def _finish(self):
+        if not self._open:
+            return
+        self._open = False
+        if self._keep_alive:
+            self._pool.idle.append(self._conn)
+        else:
+            self._conn[1].close()
+        self._pool.slots.release()
+
+    def close(self):
+        if not self._open:
+            return
+        self._open = False
+        self._conn[1].close()
+        self._pool.slots.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+
+class _AsyncPool:
+    def __init__(self, max_connections):
+        self.idle = collections.deque()  # (reader, writer)
+        self.slots = asyncio.Semaphore(max_connections)
+
+
+class AsyncHTTPTransport:
+    """
+    asyncio transport with the same pooling, concurrency cap, timeout and
+    deadline rules as HTTPTransport. Use it from one event loop.
+    """
+    def __init__(self, base_url, max_connections=8, timeout=30.0, headers=None):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or "http"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.scheme == "https" else 80)
+        self.base_path = parts.path.rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self._pools = {}
+        self._ssl_context = ssl.create_default_context() if self.scheme == "https" else None
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    def _pool(self, key):
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _AsyncPool(self.max_connections)
+        return pool
+
+    async def request(self, method, path, body=None, headers=None, pool_key=None, timeout=None, deadline=None):
+        """Async form of HTTPTransport.request."""
+        timeout = self.timeout if timeout is None else timeout
+        all_headers = {**self.headers, **(headers or {})}
+        payload = _encode_body(body, all_headers)
+        pool = self._pool(pool_key)
+        try:
+            await asyncio.wait_for(pool.slots.acquire(), _remaining(timeout, deadline))
+        except asyncio.TimeoutError:
+            raise TransportTimeout(f"no free connection for pool {_pool_label(pool_key)}") from None
+        try:
+            conn = pool.idle.pop() if pool.idle else None
+            for attempt in range(2):
+                reused = conn is not None
+                try:
+                    if conn is None:
+                        conn = await asyncio.wait_for(self._connect(), _remaining(timeout, deadline))
+                    response, keep_alive = await asyncio.wait_for(
+                        self._send(conn, method, path, payload, all_headers), _remaining(timeout, deadline))
+                except asyncio.TimeoutError:
+                    if conn is not None:
+                        conn[1].close()
+                    raise TransportTimeout(f"no response within {timeout}s") from None
+                except asyncio.CancelledError:
+                    if conn is not None:
+                        conn[1].close()  # mid-request: the connection cannot be reused
+                    raise
+                except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError) as e:
+                    if conn is not None:
+                        conn[1].close()
+                    conn = None
+                    if reused and attempt == 0:
+                        continue  # stale keep-alive connection; retry on a fresh one
+                    raise TransportError(str(e) or type(e).__name__) from e
+                except (OSError, ValueError) as e:
+                    if conn is not None:
+                        conn[1].close()
+                    raise TransportError(str(e)) from e
+                if keep_alive:
+                    pool.idle.append(conn)
+                else:
+                    conn[1].close()
+                return response
+        finally:
+            pool.slots.release()
+
+    async def _connect(self):
+        self.connections_opened += 1
+        return await asyncio.open_connection(self.host, self.port, ssl=self._ssl_context)
+
+    async def _send_head(self, conn, method, path, payload, headers):
+        """Writes the request and reads the response head: (status, headers, keep_alive)."""
+        reader, writer = conn
+        self.requests_sent += 1
+        lines = [f"{method} {self.base_path + path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        if payload is not None:
+            lines.append(f"Content-Length: {len(payload)}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (payload or b""))
+        await writer.drain()
+
+        status_line = await reader.readuntil(b"\r\n")
+        parts = status_line.decode("latin-1").split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ValueError(f"malformed status line: {status_line!r}")
+        version, status = parts[0], int(parts[1])
+        response_headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+        keep_alive = response_headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+        if ("transfer-encoding" not in response_headers and "content-length" not in response_headers
+                and not (status in (204, 304) or 100 <= status < 200)):
+            keep_alive = False  # body runs to EOF
+        return status, response_headers, keep_alive
+
+    async def _send(self, conn, method, path, payload, headers):
+        status, response_headers, keep_alive = await self._send_head(conn, method, path, payload, headers)
+        body = b"".join([piece async for piece in _body_pieces(conn[0], status, response_headers)])
+        return TransportResponse(status, response_headers, body), keep_alive
+
+    async def post_json(self, path, payload, headers=None, pool_key=None, timeout=None, deadline=None):
+        return await self.request("POST", path, payload, headers, pool_key, timeout, deadline)
+
+    async def stream(self, method, path, body=None, headers=None, pool_key=None, timeout=None, deadline=None):
+        """Async form of HTTPTransport.stream; returns an AsyncTransportStream."""
+        timeout = self.timeout if timeout is None else timeout
+        all_headers = {**self.headers, **(headers or {})}
+        payload = _encode_body(body, all_headers)
+        pool = self._pool(pool_key)
+        try:
+            await asyncio.wait_for(pool.slots.acquire(), _remaining(timeout, deadline))
+        except asyncio.TimeoutError:
+            raise TransportTimeout(f"no free connection for pool {_pool_label(pool_key)}") from None
+        try:
+            conn = pool.idle.pop() if pool.idle else None
+            for attempt in range(2):
+                reused = conn is not None
+                try:
+                    if conn is None:
+                        conn = await asyncio.wait_for(self._connect(), _remaining(timeout, deadline))
+                    status, response_headers, keep_alive = await asyncio.wait_for(
+                        self._send_head(conn, method, path, payload, all_headers), _remaining(timeout, deadline))
+                except asyncio.TimeoutError:
+                    if conn is not None:
+                        conn[1].close()
+                    raise TransportTimeout(f"no response within {timeout}s") from None
+                except asyncio.CancelledError:
+                    if conn is not None:
+                        conn[1].close()  # mid-request: the connection cannot be reused
+                    raise
+                except (asyncio.IncompleteReadError, ConnectionResetError, BrokenPipeError) as e:
+                    if conn is not None:
+                        conn[1].close()
+                    conn = None
+                    if reused and attempt == 0:
+                        continue  # stale keep-alive connection; retry on a fresh one
+                    raise TransportError(str(e) or type(e).__name__) from e
+                except (OSError, ValueError) as e:
+                    if conn is not None:
+                        conn[1].close()
+                    raise TransportError(str(e)) from e
+                return AsyncTransportStream(pool, conn, status, response_headers, keep_alive, timeout, deadline)
+        except BaseException:
+            pool.slots.release()
+            raise
+
+    async def close(self):
+        pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            while pool.idle:
+                _, writer = pool.idle.pop()
+                writer.close()
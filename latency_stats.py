@@ -0,0 +1,128 @@
+"""
+latency_stats.py — Per-stage latency histograms for the preflight pipeline.
+
+Each stage records its elapsed time from time.perf_counter_ns() into an
+HDR-style histogram: one bucket group per power of two, split into eight
+linear sub-buckets, so any value is kept within ~12% with a fixed 520-slot
+list. Recording a stage is two clock reads, a few integer operations and a
+list increment: well under a microsecond (benchmarks/bench_latency_overhead.py).
+Instrumented code checks LATENCY.enabled before reading the clock, so a
+disabled recorder costs one attribute lookup per call.
+
+Disable with BUDGET_GUARD_LATENCY_STATS=0 or LATENCY.enabled = False.
+"""
+
+import os
+import time
+
+_SUB_BUCKET_BITS = 3
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+_LINEAR_MAX = 1 << (_SUB_BUCKET_BITS + 1)  # values below this get exact buckets
+_BUCKET_COUNT = (64 << _SUB_BUCKET_BITS) + _SUB_BUCKETS
+_now = time.perf_counter_ns
+
+
+def _bucket_index(value):
+    if value < _LINEAR_MAX:
+        return value if value > 0 else 0
+    exponent = value.bit_length()
+    return (exponent << _SUB_BUCKET_BITS) | ((value >> (exponent - _SUB_BUCKET_BITS - 1)) & (_SUB_BUCKETS - 1))
+
+
+def _bucket_bounds(index):
+    """(lowest, highest) value that falls in a bucket."""
+    if index < _LINEAR_MAX:
+        return index, index
+    exponent = index >> _SUB_BUCKET_BITS
+    width = 1 << (exponent - _SUB_BUCKET_BITS - 1)
+    lowest = (_SUB_BUCKETS | (index & (_SUB_BUCKETS - 1))) * width
+    return lowest, lowest + width - 1
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed histogram of nanosecond durations. add() only touches one
+    bucket and the running total; the count and maximum are derived from the
+    buckets when read. Increments are not locked: a count lost to a thread
+    switch mid-increment is an accepted trade for keeping the hot path cheap.
+    """
+    __slots__ = ("counts", "total_ns")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKET_COUNT
+        self.total_ns = 0
+
+    def add(self, elapsed_ns):
+        # _bucket_index, inlined
+        if elapsed_ns < _LINEAR_MAX:
+            index = elapsed_ns if elapsed_ns > 0 else 0
+        else:
+            exponent = elapsed_ns.bit_length()
+            index = (exponent << _SUB_BUCKET_BITS) | ((elapsed_ns >> (exponent - _SUB_BUCKET_BITS - 1)) & (_SUB_BUCKETS - 1))
+        self.counts[index] += 1
+        self.total_ns += elapsed_ns
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-quantile (0 < p <= 1), in ns."""
+        count = self.count
+        if not count:
+            return 0
+        rank = max(1, int(-(-p * count // 1)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return _bucket_bounds(index)[1]
+
+    def summary(self):
+        """Count and mean/p50/p90/p99/max in microseconds (max is its bucket's upper bound)."""
+        count = self.count
+        return {
+            "count": count,
+            "mean_us": self.total_ns / count / 1000 if count else 0.0,
+            "p50_us": self.percentile(0.50) / 1000,
+            "p90_us": self.percentile(0.90) / 1000,
+            "p99_us": self.percentile(0.99) / 1000,
+            "max_us": self.percentile(1.0) / 1000,
+        }
+
+
+class LatencyRecorder:
+    """Named stage histograms, created on first use."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._histograms = {}
+
+    def record(self, stage, elapsed_ns):
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = self._histograms.setdefault(stage, LatencyHistogram())
+        histogram.add(elapsed_ns)
+
+    def lap(self, stage, started_ns):
+        """Records the time since started_ns under stage and returns now, for chaining stages."""
+        now = _now()
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            histogram = self._histograms.setdefault(stage, LatencyHistogram())
+        histogram.add(now - started_ns)
+        return now
+
+    def histogram(self, stage):
+        return self._histograms.get(stage)
+
+    def stats(self):
+        """{stage: summary} for every stage recorded so far, sorted by name."""
+        return {stage: self._histograms[stage].summary() for stage in sorted(self._histograms)}
+
+    def reset(self):
+        self._histograms = {}
+
+
+# Shared by the orchestrator, guard and optimizer, and served at GET /latency.
+LATENCY = LatencyRecorder(enabled=os.environ.get("BUDGET_GUARD_LATENCY_STATS", "1") != "0")
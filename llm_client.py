@@ -1,44 +1,626 @@
 import os
 import time
+import asyncio
+import concurrent.futures
 from api_key_manager import APIKeyManager
+from http_transport import TransportError
+from singleflight import SingleFlight, request_key
+from response_cache import ResponseCache
 import json # Added json import for test config setup
 
+# Endpoint paths of the wire formats LLMClient can speak through a transport.
+PROVIDER_PATHS = {
+    "openai": "/v1/chat/completions",
+    "anthropic": "/v1/messages",
+}
+
+
+def provider_headers(provider, api_key):
+    """Authentication (and version) headers for a provider's API."""
+    if provider == "anthropic":
+        return {"x-api-key": api_key, "anthropic-version": "2023-06-01"}
+    return {"Authorization": f"Bearer {api_key}"}
+
+
+def build_provider_request(provider, model, messages, api_key, max_tokens=1024, stream=False):
+    """(path, headers, JSON payload) for a chat call in the provider's wire format."""
+    payload = {"model": model, "messages": messages, "max_tokens": max_tokens}
+    if stream:
+        payload["stream"] = True
+        if provider != "anthropic":
+            payload["stream_options"] = {"include_usage": True}
+    if provider == "anthropic":
+        system = [m["content"] for m in messages if m.get("role") == "system"]
+        payload["messages"] = [m for m in messages if m.get("role") != "system"]
+        if system:
+            payload["system"] = "\n\n".join(system)
+    return PROVIDER_PATHS[provider], provider_headers(provider, api_key), payload
+
+
+def parse_provider_response(provider, data):
+    """(reply text, {"input_tokens", "output_tokens"}) from a provider's JSON response."""
+    usage = data.get("usage", {})
+    if provider == "anthropic":
+        text = "".join(block.get("text", "") for block in data.get("content", []) if block.get("type") == "text")
+        return text, {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)}
+    choices = data.get("choices") or [{}]
+    text = choices[0].get("message", {}).get("content", "")
+    return text, {"input_tokens": usage.get("prompt_tokens", 0), "output_tokens": usage.get("completion_tokens", 0)}
+
+
+def parse_stream_event(provider, event):
+    """(text delta, partial usage dict or None) from one decoded SSE data event."""
+    if provider == "anthropic":
+        kind = event.get("type")
+        if kind == "content_block_delta":
+            return event.get("delta", {}).get("text", ""), None
+        if kind == "message_start":
+            usage = event.get("message", {}).get("usage", {})
+            return "", {"input_tokens": usage.get("input_tokens", 0)}
+        if kind == "message_delta":
+            return "", {"output_tokens": event.get("usage", {}).get("output_tokens", 0)}
+        return "", None
+    usage = event.get("usage")
+    choices = event.get("choices") or [{}]
+    text = choices[0].get("delta", {}).get("content") or ""
+    if usage:
+        return text, {"input_tokens": usage.get("prompt_tokens", 0), "output_tokens": usage.get("completion_tokens", 0)}
+    return text, None
+
+
+class _StreamAccumulator:
+    """Collects a streamed reply line by line, feeding each text delta to the meter and callback."""
+
+    def __init__(self, provider, meter, on_text):
+        self.provider = provider
+        self.meter = meter
+        self.on_text = on_text
+        self.parts = []
+        self.usage = {"input_tokens": 0, "output_tokens": 0}
+
+    def feed_line(self, line):
+        """
+        Returns False once the stream is finished or must be cut off. Raises
+        ValueError for a data line that is not a JSON event.
+        """
+        if not line.startswith(b"data:"):
+            return True  # "event:" lines, keep-alive comments, blank separators
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            return False
+        try:
+            event = json.loads(data)
+        except ValueError:
+            event = None
+        if not isinstance(event, dict):
+            raise ValueError(f"Malformed stream event: {data[:80]!r}")
+        text, usage = parse_stream_event(self.provider, event)
+        if usage:
+            self.usage.update(usage)
+        if text:
+            self.parts.append(text)
+            # Metered before the callback runs, so a delta is charged even if on_text raises
+            cut_off = self.meter is not None and not self.meter.feed(text)
+            if self.on_text is not None:
+                self.on_text(text)
+            if cut_off:
+                return False
+        return True
+
+    def result(self, error=None):
+        meter = self.meter
+        usage = dict(self.usage)
+        response = {"status": "success", "response": "".join(self.parts), "usage": usage}
+        if meter is not None:
+            # Not reported (a cut-off stream never gets its usage event): estimated
+            if not usage["input_tokens"]:
+                usage["input_tokens"] = meter.input_tokens
+            if not usage["output_tokens"] or meter.cut_off_reason:
+                usage["output_tokens"] = meter.output_tokens
+            response["cost"] = meter.finish(usage)
+            if meter.cut_off_reason:
+                response["status"] = "cut_off"
+                response["cut_off_reason"] = meter.cut_off_reason
+        if error is not None:
+            response["status"] = "error"
+            response["message"] = error
+        return response
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
 class LLMClient:
-    def __init__(self, service_name="GEMINI", config_path="projects/agent_budget_guard/config.json"): # Modified init
+    def __init__(self, service_name="GEMINI", config_path="projects/agent_budget_guard/config.json",
+                 transport=None, async_transport=None, provider="openai", max_tokens=1024,
+                 coalesce=True, response_cache=None, guard=None, hedging=None): # Modified init
         self.api_key_manager = APIKeyManager(service_name=service_name, config_path=config_path)
         self.service_name = service_name
+        # Real calls go through a pooled transport (http_transport); without one, calls are simulated
+        self.transport = transport
+        self.async_transport = async_transport
+        self.provider = provider
+        self.max_tokens = max_tokens
+        # Concurrent identical calls share one upstream request (singleflight)
+        self.singleflight = SingleFlight() if coalesce else None
+        # Exact-match disk cache (a ResponseCache or its file path); hits are
+        # reported to guard (a BudgetGuard) as zero-cost calls
+        self.response_cache = ResponseCache(response_cache) if isinstance(response_cache, str) else response_cache
+        self.guard = guard
+        # Hedged requests (a hedging.HedgePolicy); hedge spend is accounted in guard
+        if hedging is not None and guard is None:
+            raise ValueError("hedging needs a guard to cap and account hedge spend")
+        self.hedging = hedging
+        self._hedge_executor = None
         # Internal counter for simulation to ensure rate limit triggers for the first key
         self._simulate_call_count = 0
 
-    def make_api_call(self, prompt, model="default", max_retries=3):
+    def make_api_call(self, prompt, model="default", max_retries=3, timeout=None, use_cache=True):
         """
-        Simulates an API call to an LLM with API key rotation on failure.
+        Makes an API call to an LLM with API key rotation on failure. prompt is
+        a string or a list of chat messages. timeout bounds the whole call,
+        retries included. Successful responses carry "usage" when sent through
+        a transport.
+
+        Each attempt is scheduled on the key with the most RPM/TPM headroom
+        (APIKeyManager.acquire_slot). A rate-limited key is put on cooldown
+        (Retry-After or backoff) and the next attempt goes to another key at
+        once; the call only waits when no key has room.
+
+        Identical calls (same model, prompt and parameters) made while one is
+        in flight wait for it instead of going upstream; their responses are
+        marked "coalesced" and carry zero usage (see singleflight).
+
+        With a hedging policy, a call still running after the model's learned
+        p95 latency gets a second attempt, on another key or a cheaper model;
+        the first success is returned marked "hedged" (see hedging).
+
+        With a response cache, a stored response for the same request is
+        returned marked "cached" with zero usage, and successful responses are
+        stored. Pass use_cache=False for calls whose output should vary.
         """
+        key = self._request_key(prompt, model)
+        if use_cache and self.response_cache is not None:
+            cached = self._cache_hit(key, model)
+            if cached is not None:
+                return cached
+        upstream = self._call_upstream if self.hedging is None else self._hedged_call
+        if self.singleflight is None:
+            response = upstream(prompt, model, max_retries, timeout)
+        else:
+            response = self.singleflight.do(key, lambda: upstream(prompt, model, max_retries, timeout), timeout)
+        if use_cache:
+            self._cache_store(key, response)
+        return response
+
+    def _call_upstream(self, prompt, model, max_retries, timeout, exclude=(), keys_used=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
         for retry_count in range(max_retries):
-            current_key = self.api_key_manager.get_key()
-            if not current_key:
-                print(f"Error: No API keys available for {self.service_name}.")
-                return {"status": "error", "message": "No API keys available"}
+            if deadline is not None and time.monotonic() >= deadline:
+                return {"status": "error", "message": "Deadline exceeded"}
+            lease = self.api_key_manager.acquire_slot(self._estimate_tokens(prompt), deadline, exclude)
+            if lease is None:
+                return self._no_key_error()
+            current_key = lease.key
+            if keys_used is not None:
+                keys_used.append(current_key)
+            response = {}
 
             print(f"Attempting API call with key (index {self.api_key_manager.current_key_index}) for {self.service_name}...")
-            # Simulate API call
             try:
-                response = self._simulate_api_request(prompt, model, current_key)
+                if self.transport is not None:
+                    response = self._provider_request(prompt, model, current_key, deadline)
+                else:
+                    response = self._simulate_api_request(prompt, model, current_key)
                 if response.get("status") == "success":
                     print("API call successful.")
+                    self.api_key_manager.mark_success(current_key)
                     return response
                 elif response.get("status") == "rate_limited":
-                    print(f"Rate limit encountered with key (index {self.api_key_manager.current_key_index}). Rotating key.")
-                    self.api_key_manager.rotate_key()
-                    time.sleep(1) # Wait a bit before retrying with a new key
+                    cooldown = self.api_key_manager.mark_rate_limited(current_key, response.get("retry_after"))
+                    print(f"Rate limit encountered with key (index {self.api_key_manager.current_key_index}). "
+                          f"Cooling it for {cooldown:.1f}s.")
                 else:
-                    print(f"API error: {response.get('message')}. Retrying with same key.") # Other errors might not need key rotation
+                    print(f"API error: {response.get('message')}. Retrying.") # Other errors do not cool the key
             except Exception as e:
                 print(f"An unexpected error occurred: {e}. Retrying.")
+            finally:
+                self.api_key_manager.release_slot(lease, self._used_tokens(response))
             
         print(f"Failed to make API call after {max_retries} retries.")
         return {"status": "error", "message": "Failed after multiple retries"}
 
+    async def make_api_call_async(self, prompt, model="default", max_retries=3, timeout=None, use_cache=True):
+        """make_api_call for asyncio callers, sent through self.async_transport."""
+        key = self._request_key(prompt, model)
+        if use_cache and self.response_cache is not None:
+            cached = self._cache_hit(key, model)
+            if cached is not None:
+                return cached
+        upstream = self._call_upstream_async if self.hedging is None else self._hedged_call_async
+        if self.singleflight is None:
+            response = await upstream(prompt, model, max_retries, timeout)
+        else:
+            response = await self.singleflight.do_async(
+                key, lambda: upstream(prompt, model, max_retries, timeout), timeout)
+        if use_cache:
+            self._cache_store(key, response)
+        return response
+
+    async def _call_upstream_async(self, prompt, model, max_retries, timeout, exclude=(), keys_used=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for retry_count in range(max_retries):
+            if deadline is not None and time.monotonic() >= deadline:
+                return {"status": "error", "message": "Deadline exceeded"}
+            lease = await self.api_key_manager.acquire_slot_async(self._estimate_tokens(prompt), deadline,
+                                                                  exclude=exclude)
+            if lease is None:
+                return self._no_key_error()
+            current_key = lease.key
+            if keys_used is not None:
+                keys_used.append(current_key)
+            path, headers, payload = build_provider_request(
+                self.provider, model, self._messages(prompt), current_key, self.max_tokens)
+            response = {}
+            try:
+                raw = await self.async_transport.post_json(path, payload, headers, pool_key=current_key,
+                                                           deadline=deadline)
+                response = self._parse(raw)
+            except TransportError as e:
+                response = {"status": "error", "message": str(e)}
+            except Exception as e:  # e.g. a 200 whose body is not JSON, as in _call_upstream
+                response = {"status": "error", "message": f"Unexpected error: {e}"}
+            finally:
+                self.api_key_manager.release_slot(lease, self._used_tokens(response))
+            if response["status"] == "success":
+                self.api_key_manager.mark_success(current_key)
+                return response
+            if response["status"] == "rate_limited":
+                self.api_key_manager.mark_rate_limited(current_key, response.get("retry_after"))
+        return {"status": "error", "message": "Failed after multiple retries"}
+
+    def _hedged_call(self, prompt, model, max_retries, timeout):
+        """
+        _call_upstream run on the hedge executor, hedged once it outlives the
+        model's learned delay. A threaded attempt cannot be interrupted: the
+        loser runs to completion in the background and the hedge reservation
+        is settled with its actual cost when it does.
+        """
+        if self._hedge_executor is None:
+            self._hedge_executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="llm-hedge")
+        executor = self._hedge_executor
+        delay = self.hedging.delay(model)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        primary_keys = []
+        primary = executor.submit(self._timed_attempt, prompt, model, max_retries, deadline, (), primary_keys)
+        if delay is None or concurrent.futures.wait([primary], timeout=delay).done:
+            return primary.result()
+        plan = self._plan_hedge(prompt, model, primary_keys)
+        if plan is None:
+            return primary.result()
+        hedge = executor.submit(self._timed_attempt, prompt, plan.model, max_retries, deadline, plan.exclude)
+        winner, pending = None, {primary, hedge}
+        while pending and winner is None:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            winner = next((f for f in (primary, hedge) if f in done and f.exception() is None
+                           and f.result().get("status") == "success"), None)
+        winner = winner or primary
+        loser = hedge if winner is primary else primary
+        loser_model = plan.model if loser is hedge else model
+        loser.add_done_callback(lambda f: self._settle_hedged_future(plan, loser_model, f))
+        return self._hedge_result(winner.result(), plan, winner is hedge)
+
+    async def _hedged_call_async(self, prompt, model, max_retries, timeout):
+        """_hedged_call for asyncio callers; the losing attempt is cancelled."""
+        delay = self.hedging.delay(model)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        primary_keys = []
+        primary = asyncio.ensure_future(
+            self._timed_attempt_async(prompt, model, max_retries, deadline, (), primary_keys))
+        if delay is None or (await asyncio.wait({primary}, timeout=delay))[0]:
+            return await primary
+        plan = self._plan_hedge(prompt, model, primary_keys)
+        if plan is None:
+            return await primary
+        hedge = asyncio.ensure_future(
+            self._timed_attempt_async(prompt, plan.model, max_retries, deadline, plan.exclude))
+        winner, pending = None, {primary, hedge}
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in (primary, hedge) if t in done and t.exception() is None
+                               and t.result().get("status") == "success"), None)
+        finally:
+            winner = winner or primary
+            loser = hedge if winner is primary else primary
+            if not winner.done():  # this call was cancelled while both were running
+                winner.cancel()
+            await self._settle_hedged_task(plan, plan.model if loser is hedge else model, loser)
+        return self._hedge_result(winner.result(), plan, winner is hedge)
+
+    def _timed_attempt(self, prompt, model, max_retries, deadline, exclude=(), keys_used=None):
+        started = time.monotonic()
+        timeout = None if deadline is None else max(0.0, deadline - started)
+        response = self._call_upstream(prompt, model, max_retries, timeout, exclude, keys_used)
+        if response.get("status") == "success":
+            self.hedging.observe(model, time.monotonic() - started)
+        return response
+
+    async def _timed_attempt_async(self, prompt, model, max_retries, deadline, exclude=(), keys_used=None):
+        started = time.monotonic()
+        timeout = None if deadline is None else max(0.0, deadline - started)
+        response = await self._call_upstream_async(prompt, model, max_retries, timeout, exclude, keys_used)
+        if response.get("status") == "success":
+            self.hedging.observe(model, time.monotonic() - started)
+        return response
+
+    def _plan_hedge(self, prompt, model, primary_keys):
+        """
+        Hedge target: the same model on a key the primary is not using if one
+        has room, else the cheapest model recommend_model finds within the
+        primary's estimated cost, on any key with room. None if neither, or
+        the hedge cap says no.
+        """
+        input_tokens = self._estimate_tokens(prompt) - self.max_tokens
+        output_tokens = self.guard.predict_output_tokens(model, self.hedging.context)
+        exclude = tuple(primary_keys)
+        if self.api_key_manager.has_room(input_tokens + self.max_tokens, exclude):
+            hedge_model = model
+        else:
+            primary_cost = self.guard.estimate_cost(model, input_tokens, output_tokens)
+            hedge_model, _, _ = self.guard.recommend_model(input_tokens, output_tokens, max_budget=primary_cost)
+            exclude = ()
+            if (hedge_model is None or hedge_model == model
+                    or not self.api_key_manager.has_room(input_tokens + self.max_tokens)):
+                return None
+        return self.hedging.reserve(self.guard, hedge_model, exclude, input_tokens, output_tokens)
+
+    def _settle_hedge(self, plan, model, response, cancelled_input_tokens=0):
+        """Charges the hedge reservation with what the attempt that was not returned cost."""
+        usage = response.get("usage") if response.get("status") == "success" else None
+        input_tokens = usage["input_tokens"] if usage else cancelled_input_tokens
+        output_tokens = usage["output_tokens"] if usage else 0
+        cost = self.guard.estimate_cost(model, input_tokens, output_tokens)
+        self.hedging.settle(self.guard, plan, cost, input_tokens, output_tokens)
+
+    def _settle_hedged_future(self, plan, model, future):
+        """_settle_hedge for a finished threaded attempt; one that raised releases the hold instead."""
+        if future.exception() is not None:
+            self.hedging.release(self.guard, plan)
+        else:
+            self._settle_hedge(plan, model, future.result())
+
+    async def _settle_hedged_task(self, plan, model, task):
+        """
+        _settle_hedged_future for an asyncio attempt. One still running is
+        cancelled; the request was sent, so it is charged its input.
+        """
+        if not task.done():
+            task.cancel()
+            await asyncio.wait({task})
+        if task.cancelled():
+            self._settle_hedge(plan, model, {}, cancelled_input_tokens=plan.input_tokens)
+        elif task.exception() is not None:
+            self.hedging.release(self.guard, plan)
+        else:
+            self._settle_hedge(plan, model, task.result())
+
+    def close(self, wait=True):
+        """
+        Shuts down the hedge executor. With wait, returns once losing attempts
+        still running in the background have finished and been settled.
+        """
+        executor, self._hedge_executor = self._hedge_executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _hedge_result(self, response, plan, hedge_won):
+        self.hedging.record_outcome(hedge_won)
+        response = dict(response)
+        response["hedged"] = True
+        response["hedge_won"] = hedge_won
+        if hedge_won:
+            response["model"] = plan.model
+        return response
+
+    def stream_api_call(self, prompt, model="default", context="routine", max_retries=3, timeout=None,
+                        on_text=None):
+        """
+        Streams a reply through self.transport, calling on_text with each text
+        delta as it arrives. With a guard, the call is metered as it streams
+        (stream_meter.StreamMeter): it is blocked up front if the input alone
+        does not fit the budget, and cut off, with status "cut_off" and a
+        cut_off_reason, once its projected cost crosses the per-request limit
+        of `context` or the breaker window. The returned dict has the full
+        text, the usage (output estimated when the provider did not report it)
+        and, when metered, the cost charged. Streams bypass the response cache
+        and coalescing. Failures before the first byte are retried on another
+        key; a stream that breaks midway is not. An exception from on_text (or
+        the caller's cancellation) propagates once the metered usage so far has
+        been charged.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        meter = self._start_meter(prompt, model, context)
+        if isinstance(meter, dict):
+            return meter
+        response = {"status": "error", "message": "Failed after multiple retries"}
+        try:
+            for retry_count in range(max_retries):
+                if deadline is not None and time.monotonic() >= deadline:
+                    response = {"status": "error", "message": "Deadline exceeded"}
+                    break
+                lease = self.api_key_manager.acquire_slot(self._estimate_tokens(prompt), deadline)
+                if lease is None:
+                    response = self._no_key_error()
+                    break
+                path, headers, payload = build_provider_request(
+                    self.provider, model, self._messages(prompt), lease.key, self.max_tokens, stream=True)
+                accumulator = None
+                try:
+                    with self.transport.stream("POST", path, payload, headers, pool_key=lease.key,
+                                               deadline=deadline) as stream:
+                        if stream.status == 429:
+                            self.api_key_manager.mark_rate_limited(lease.key, _retry_after(stream))
+                            continue
+                        if stream.status != 200:
+                            body = stream.read()
+                            response = {"status": "error", "message": f"HTTP {stream.status}: {body[:200]!r}"}
+                            continue
+                        accumulator = _StreamAccumulator(self.provider, meter, on_text)
+                        for line in stream:
+                            if not accumulator.feed_line(line):
+                                break
+                    response = accumulator.result()
+                    self.api_key_manager.mark_success(lease.key)
+                    break
+                except (TransportError, ValueError) as e:  # ValueError: a malformed event
+                    if accumulator is None:
+                        response = {"status": "error", "message": str(e)}
+                        continue
+                    response = accumulator.result(error=str(e))
+                    break
+                except BaseException as e:  # on_text raised, or the caller gave up: charge what streamed
+                    if accumulator is not None:
+                        response = accumulator.result(error=f"Stream aborted: {e!r}")
+                    raise
+                finally:
+                    self.api_key_manager.release_slot(lease, self._used_tokens(response) if accumulator else None)
+        finally:
+            if meter is not None and "cost" not in response:
+                meter.cancel()
+        return response
+
+    async def stream_api_call_async(self, prompt, model="default", context="routine", max_retries=3,
+                                    timeout=None, on_text=None):
+        """stream_api_call for asyncio callers, sent through self.async_transport."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        meter = self._start_meter(prompt, model, context)
+        if isinstance(meter, dict):
+            return meter
+        response = {"status": "error", "message": "Failed after multiple retries"}
+        try:
+            for retry_count in range(max_retries):
+                if deadline is not None and time.monotonic() >= deadline:
+                    response = {"status": "error", "message": "Deadline exceeded"}
+                    break
+                lease = await self.api_key_manager.acquire_slot_async(self._estimate_tokens(prompt), deadline)
+                if lease is None:
+                    response = self._no_key_error()
+                    break
+                path, headers, payload = build_provider_request(
+                    self.provider, model, self._messages(prompt), lease.key, self.max_tokens, stream=True)
+                accumulator = None
+                try:
+                    async with await self.async_transport.stream("POST", path, payload, headers, pool_key=lease.key,
+                                                                 deadline=deadline) as stream:
+                        if stream.status == 429:
+                            self.api_key_manager.mark_rate_limited(lease.key, _retry_after(stream))
+                            continue
+                        if stream.status != 200:
+                            body = await stream.read()
+                            response = {"status": "error", "message": f"HTTP {stream.status}: {body[:200]!r}"}
+                            continue
+                        accumulator = _StreamAccumulator(self.provider, meter, on_text)
+                        async for line in stream:
+                            if not accumulator.feed_line(line):
+                                break
+                    response = accumulator.result()
+                    self.api_key_manager.mark_success(lease.key)
+                    break
+                except (TransportError, ValueError) as e:  # ValueError: a malformed event
+                    if accumulator is None:
+                        response = {"status": "error", "message": str(e)}
+                        continue
+                    response = accumulator.result(error=str(e))
+                    break
+                except BaseException as e:  # on_text raised, or the caller gave up: charge what streamed
+                    if accumulator is not None:
+                        response = accumulator.result(error=f"Stream aborted: {e!r}")
+                    raise
+                finally:
+                    self.api_key_manager.release_slot(lease, self._used_tokens(response) if accumulator else None)
+        finally:
+            if meter is not None and "cost" not in response:
+                meter.cancel()
+        return response
+
+    def _start_meter(self, prompt, model, context):
+        """A started StreamMeter, None without a guard, or a "blocked" response."""
+        if self.guard is None:
+            return None
+        input_tokens = self._estimate_tokens(prompt) - self.max_tokens
+        meter = self.guard.meter_stream(model, input_tokens, context)
+        ok, msg = meter.start()
+        if not ok:
+            return {"status": "blocked", "message": msg}
+        return meter
+
+    def _no_key_error(self):
+        if not self.api_key_manager.api_keys:
+            print(f"Error: No API keys available for {self.service_name}.")
+            return {"status": "error", "message": "No API keys available"}
+        return {"status": "error", "message": "All API keys are cooling down past the deadline"}
+
+    def coalescing_stats(self):
+        """SingleFlight.stats(), or None when coalescing is off."""
+        return self.singleflight.stats() if self.singleflight is not None else None
+
+    def _cache_hit(self, key, model):
+        response = self.response_cache.get(key)
+        if response is None:
+            return None
+        usage = response.get("usage") or {}
+        response["cached"] = True
+        response["cached_usage"] = dict(usage)
+        response["usage"] = {name: 0 for name in usage}
+        if self.guard is not None:
+            response["saved_cost"] = self.guard.record_cache_hit(
+                model, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+        return response
+
+    def _cache_store(self, key, response):
+        # Only first-hand successes: followers' copies carry zeroed usage
+        if (self.response_cache is not None and response.get("status") == "success"
+                and not response.get("coalesced")):
+            self.response_cache.put(key, response)
+
+    def _request_key(self, prompt, model):
+        return request_key(model, self._messages(prompt), {"provider": self.provider, "max_tokens": self.max_tokens})
+
+    def _estimate_tokens(self, prompt):
+        """Rough TPM reservation for one attempt: ~4 chars per input token plus max_tokens."""
+        return sum(len(str(m.get("content", ""))) for m in self._messages(prompt)) // 4 + self.max_tokens
+
+    @staticmethod
+    def _used_tokens(response):
+        usage = response.get("usage")
+        return usage["input_tokens"] + usage["output_tokens"] if usage else None
+
+    @staticmethod
+    def _messages(prompt):
+        return [{"role": "user", "content": prompt}] if isinstance(prompt, str) else list(prompt)
+
+    def _provider_request(self, prompt, model, api_key, deadline=None):
+        path, headers, payload = build_provider_request(
+            self.provider, model, self._messages(prompt), api_key, self.max_tokens)
+        try:
+            raw = self.transport.post_json(path, payload, headers, pool_key=api_key, deadline=deadline)
+        except TransportError as e:
+            return {"status": "error", "message": str(e)}
+        return self._parse(raw)
+
+    def _parse(self, raw):
+        if raw.status == 429:
+            return {"status": "rate_limited", "message": "Rate limited", "retry_after": _retry_after(raw)}
+        if raw.status != 200:
+            return {"status": "error", "message": f"HTTP {raw.status}: {raw.body[:200]!r}"}
+        text, usage = parse_provider_response(self.provider, raw.json())
+        return {"status": "success", "response": text, "usage": usage}
+
     def _simulate_api_request(self, prompt, model, api_key):
         """
         Internal function to simulate an actual API request to an LLM.
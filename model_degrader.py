@@ -35,6 +35,15 @@ class ModelDegrader:
         else:
             return None, 0.0, f"FAILURE: No models found within budget of ${limit:.4f}. Reason: {budget_msg}"
 
+    def auto_degrade_payload(self, current_model, payload, target_output_tokens=None, context="routine"):
+        """
+        auto_degrade for a payload returned by TokenOptimizer.optimize_payload_with_counts,
+        reusing its exact input token count. Output tokens default to the guard's prediction.
+        """
+        if target_output_tokens is None:
+            target_output_tokens = self.guard.predict_output_tokens(current_model, context)
+        return self.auto_degrade(current_model, payload["input_tokens"], target_output_tokens, context)
+
 if __name__ == "__main__":
     guard = BudgetGuard()
     degrader = ModelDegrader(guard)
@@ -1,23 +1,81 @@
 import re
 
+# Filler phrases stripped by default; extend with `fillers` or a lexicon file.
+DEFAULT_FILLERS = ["I understand that", "As an AI language model", "I'm happy to help"]
+
+
+def load_lexicon(path):
+    """
+    Reads a filler/boilerplate lexicon: one phrase per line, blank lines and
+    lines starting with '#' are ignored.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def _trie_pattern(phrases):
+    """
+    Compiles phrases into a single regex alternation shaped like a trie, so
+    shared prefixes are matched once instead of once per phrase. Whitespace
+    inside a phrase matches any whitespace run.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for part in re.findall(r"\s+|\S", phrase.strip()):
+            node = node.setdefault(" " if part.isspace() else part, {})
+        node[""] = {}  # end of phrase
+
+    def build(node):
+        ends = "" in node
+        branches = []
+        for key in sorted(k for k in node if k):
+            atom = r"\s+" if key == " " else re.escape(key)
+            branches.append(atom + build(node[key]))
+        if not branches:
+            return ""
+        if len(branches) == 1 and not ends:
+            return branches[0]
+        # Longer continuations first, then the optional empty tail.
+        return "(?:" + "|".join(branches) + ")" + ("?" if ends else "")
+
+    return build(trie)
+
+
 class TokenOptimizer:
     """
     Core logic for reducing token usage by optimizing prompts and context.
     """
-    def __init__(self, max_context_tokens=4000):
+    def __init__(self, max_context_tokens=4000, fillers=None, lexicon_path=None, ignore_case=False):
         self.max_context_tokens = max_context_tokens
+        phrases = list(DEFAULT_FILLERS if fillers is None else fillers)
+        if lexicon_path:
+            phrases.extend(load_lexicon(lexicon_path))
+        self.fillers = phrases
+        self._cleaner = self.compile_cleaner(phrases, ignore_case)
+
+    @staticmethod
+    def compile_cleaner(phrases, ignore_case=False):
+        """
+        Builds one regex that matches either a filler phrase (with the
+        whitespace around it) or a whitespace run. Substituting a single space
+        normalizes whitespace and strips fillers in one pass over the text.
+        """
+        phrases = [p for p in phrases if p.strip()]
+        pattern = r"\s+"
+        if phrases:
+            # Both branches start with a fixed character set (whitespace or a
+            # phrase's first character), which lets the regex engine skip ahead
+            # quickly over text that cannot start a match.
+            trie = _trie_pattern(phrases)
+            pattern = rf"\s+(?:{trie}\s*)?|{trie}\s*"
+        return re.compile(pattern, re.IGNORECASE if ignore_case else 0)
 
     def clean_text(self, text):
         """
         Removes redundant whitespace, newlines, and common 'filler' phrases.
         """
-        # Remove multiple spaces and newlines
-        text = re.sub(r'\s+', ' ', text).strip()
-        # Remove repetitive phrases common in AI responses (example)
-        fillers = ["I understand that", "As an AI language model", "I'm happy to help"]
-        for filler in fillers:
-            text = text.replace(filler, "")
-        return text
+        return self._cleaner.sub(" ", text).strip()
 
     def truncate_history(self, messages, limit=10):
         """
@@ -1,58 +1,282 @@
 import json
 import os
+import time
+import asyncio
 from cost_calculator import BudgetGuard
 from token_optimizer import TokenOptimizer
+from preflight_cache import PreflightCache, payload_fingerprint
+from latency_stats import LATENCY
 
 class GuardOrchestrator:
     """
     Main entry point for coordinating cost estimation,
     token optimization, and model routing.
     """
-    def __init__(self, config_path="config.json"):
-        self.guard = BudgetGuard(config_path)
+    def __init__(self, config_path="config.json", executor=None, guard=None):
+        self.guard = guard or BudgetGuard(config_path)  # pass a guard to share its breaker
         self.optimizer = TokenOptimizer()
+        self.executor = executor # Runs tokenization for process_request_async
+        self._price_cache = {}  # (model, is_batch) -> (pricing entry, output price per token)
+        cache_options = self.guard.config.get("preflight_cache", {})
+        self.preflight_cache = PreflightCache(
+            max_entries=cache_options.get("max_entries", 256),
+            ttl_seconds=cache_options.get("ttl_seconds", 600),
+        )
 
-    def process_request(self, model, messages, context="routine", auto_fallback=False, is_batch=False):
-        # 1. Optimize tokens (strip whitespace, etc)
-        optimized_messages = self.optimizer.optimize_payload(messages)
-        
-        # 2. Calculate current token counts
-        input_text = " ".join([m["content"] for m in optimized_messages])
-        input_tokens = len(input_text) // 4 # Standard 2026 rough estimation
-        
-        # 3. Estimate cost
-        est_cost = self.guard.estimate_cost(model, input_tokens, 500, is_batch=is_batch) # Assuming 500 output
-        
-        # 4. Check budget
-        ok, msg = self.guard.check_budget(est_cost, context)
-        
+    def context_limit(self, model, context, is_batch=False):
+        """
+        (per-request limit, cost floor, predicted output tokens) for a
+        model/context pair. The limit is read from the guard's thresholds on
+        every call, so threshold changes apply at once. The model's output
+        price is cached for as long as its pricing entry is the same object;
+        the floor is the cost of the predicted output tokens alone, so a request
+        is expected to cost at least this much whatever its input.
+        """
+        limit = self.guard.thresholds.get(context, self.guard.default_threshold)
+        pricing = self.guard.model_pricing.get(model)
+        cached = self._price_cache.get((model, is_batch))
+        if cached is None or cached[0] is not pricing:
+            output_price = self.guard.estimate_cost(model, 0, 1_000_000, is_batch=is_batch) / 1_000_000
+            cached = self._price_cache[(model, is_batch)] = (pricing, output_price)
+        output_tokens = self.guard.predict_output_tokens(model, context)
+        return limit, cached[1] * output_tokens, output_tokens
+
+    def clear_limit_cache(self):
+        """Call after editing a model's pricing entry in place (a replaced entry is noticed)."""
+        self._price_cache.clear()
+
+    def clear_preflight_cache(self):
+        """Call after changing optimizer settings."""
+        self.preflight_cache.clear()
+
+    def process_request(self, model, messages, context="routine", auto_fallback=False, is_batch=False,
+                        reserve=False):
+        """
+        Runs the preflight pipeline, cheapest decisive checks first:
+          1. breaker  — circuit OPEN blocks before any work on the payload
+          2. bounds   — the predicted output tokens alone set a cost floor;
+                        if even that breaks the per-request limit or the
+                        velocity window, block without touching the payload
+          3. budget   — optimize, count exactly, and run check_budget
+        The response's "decided_by" names the stage that decided. Optimized
+        payloads are cached briefly by fingerprint (see preflight_cache), so
+        retries of an identical request skip straight to admission, which
+        always runs. Stage timings go to latency_stats.LATENCY ("preflight.*").
+
+        With reserve=True the budget stage holds the estimate as an in-flight
+        reservation instead of recording it as spent; an "ok" response then
+        carries "reservation_id", to be settled with guard.commit_usage (actual
+        cost and tokens) or guard.release_reservation (call failed).
+        """
+        started = time.perf_counter_ns() if LATENCY.enabled else 0
+        verdict = self._fast_checks(model, messages, context, is_batch)
+        if verdict is not None and not self._verdict_needs_payload(verdict, auto_fallback):
+            result = self._early_response(verdict, model, messages, auto_fallback)
+        else:
+            # 3. Optimize tokens (dedup, minify, pack into the context budget)
+            t0 = time.perf_counter_ns() if started else 0
+            key = payload_fingerprint(model, messages, context)
+            payload = self.preflight_cache.get(key)
+            if payload is None:
+                payload = self._optimize(key, messages)
+            if t0:
+                LATENCY.lap("preflight.optimize", t0)
+            if verdict is not None:
+                result = self._early_response(verdict, model, messages, auto_fallback, payload)
+            else:
+                result = self._check_payload(model, payload, context, auto_fallback, is_batch, reserve)
+        if started:
+            LATENCY.lap("preflight.total", started)
+        return result
+
+    async def process_request_async(self, model, messages, context="routine", auto_fallback=False,
+                                    is_batch=False, reserve=False):
+        """
+        process_request for asyncio callers. The cheap stages run inline; the
+        CPU-heavy optimization and tokenization run on self.executor (the loop's
+        default executor when None), so other tasks keep running meanwhile.
+        Shares the guard, and its lock, with the sync API: while a sync caller
+        holds the lock, the stages that need it wait on the default executor
+        rather than on the loop (as in BudgetGuard.check_budget_async).
+        """
+        verdict = await self._under_lock_async(self._fast_checks, model, messages, context, is_batch)
+        if verdict is not None and not self._verdict_needs_payload(verdict, auto_fallback):
+            return self._early_response(verdict, model, messages, auto_fallback)
+
+        key = payload_fingerprint(model, messages, context)
+        payload = self.preflight_cache.get(key)
+        if payload is None:
+            loop = asyncio.get_running_loop()
+            payload = await loop.run_in_executor(self.executor, self._optimize, key, messages)
+        if verdict is not None:
+            return self._early_response(verdict, model, messages, auto_fallback, payload)
+        return await self._under_lock_async(self._check_payload, model, payload, context, auto_fallback,
+                                            is_batch, reserve)
+
+    async def _under_lock_async(self, fn, *args):
+        """Runs fn under the guard lock: inline if it is free, else on the default executor."""
+        lock = self.guard.lock
+        if lock.acquire(blocking=False):
+            try:
+                return fn(*args)
+            finally:
+                lock.release()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._under_lock, fn, *args)
+
+    def _under_lock(self, fn, *args):
+        with self.guard.lock:
+            return fn(*args)
+
+    def process_requests(self, requests, auto_fallback=False, reserve=False):
+        """
+        Batch form of process_request. requests is a list of dicts with the
+        process_request arguments ("model", "messages", optional "context" and
+        "is_batch"); reserve applies to the whole batch. The cheap stages run for every request first, all payloads
+        that still need it are tokenized together, and admission for the whole
+        batch happens in one critical section, in order. Returns one result per
+        request, in order.
+        """
+        specs = [(r["model"], r["messages"], r.get("context", "routine"), r.get("is_batch", False))
+                 for r in requests]
+        with self.guard.lock:
+            verdicts = [self._fast_checks(model, messages, context, is_batch)
+                        for model, messages, context, is_batch in specs]
+
+        pending = [i for i, verdict in enumerate(verdicts)
+                   if verdict is None or self._verdict_needs_payload(verdict, auto_fallback)]
+        payloads = {}
+        misses = []
+        for i in pending:
+            model, messages, context, _ = specs[i]
+            key = payload_fingerprint(model, messages, context)
+            payload = self.preflight_cache.get(key)
+            if payload is None:
+                misses.append((i, key))
+            else:
+                payloads[i] = payload
+        if misses:
+            started = time.perf_counter()
+            computed = self.optimizer.optimize_payloads_with_counts([specs[i][1] for i, _ in misses])
+            per_payload = (time.perf_counter() - started) / len(misses)
+            for (i, key), payload in zip(misses, computed):
+                self.preflight_cache.put(key, payload, per_payload)
+                payloads[i] = payload
+
+        results = []
+        with self.guard.lock:
+            for i, (model, messages, context, is_batch) in enumerate(specs):
+                if verdicts[i] is not None:
+                    results.append(self._early_response(verdicts[i], model, messages, auto_fallback, payloads.get(i)))
+                else:
+                    results.append(self._check_payload(model, payloads[i], context, auto_fallback, is_batch, reserve))
+        return results
+
+    def _optimize(self, key, messages):
+        """Optimizes and counts a payload and caches the result under key."""
+        started = time.perf_counter()
+        payload = self.optimizer.optimize_payload_with_counts(messages)
+        self.preflight_cache.put(key, payload, time.perf_counter() - started)
+        return payload
+
+    def _fast_checks(self, model, messages, context, is_batch):
+        """Stages 1 and 2. Returns None to continue, or a verdict dict for a block."""
+        t0 = time.perf_counter_ns() if LATENCY.enabled else 0
+        # 1. Breaker state
+        ok, msg = self.guard.check_circuit()
+        if t0:
+            t0 = LATENCY.lap("preflight.breaker", t0)
         if not ok:
-            # 5. Recommend or Auto-Fallback
-            limit = self.guard.thresholds.get(context, 0.10)
-            rec_model, rec_cost, reason = self.guard.recommend_model(input_tokens, 500, limit)
-            
-            if auto_fallback and rec_model:
-                print(f"[AUTO-FALLBACK] Over budget on {model}. Switching to {rec_model}.")
-                return {
-                    "status": "fallback",
-                    "original_model": model,
-                    "new_model": rec_model,
-                    "estimated_cost": rec_cost,
-                    "optimized_messages": optimized_messages
-                }
+            return {"stage": "breaker", "message": msg}
 
-            return {
-                "status": "blocked",
-                "message": msg,
-                "recommended_model": rec_model,
-                "estimated_saving": f"${(est_cost - rec_cost):.4f}" if rec_model else "N/A"
-            }
+        # 2. Cost floor from the limit and the predicted output
+        limit, cost_floor, output_tokens = self.context_limit(model, context, is_batch)
+        verdict = {"stage": "bounds", "limit": limit, "cost": cost_floor, "output_tokens": output_tokens}
+        if cost_floor > limit:
+            ok, verdict["message"] = self.guard.reject_over_limit(cost_floor, context, limit)
+        else:
+            with self.guard.lock:
+                ok = not self.guard.breaker.would_exceed(cost=cost_floor)
+                if not ok:
+                    # Counts the breach; the floor is not spend, so it stays out of the window
+                    ok, verdict["message"] = self.guard.reject_over_window(cost_floor)
+        if t0:
+            LATENCY.lap("preflight.bounds", t0)
+        return None if ok else verdict
+
+    @staticmethod
+    def _verdict_needs_payload(verdict, auto_fallback):
+        # A fallback needs the optimized messages and exact count; a plain block does not.
+        return verdict["stage"] == "bounds" and auto_fallback
+
+    def _early_response(self, verdict, model, messages, auto_fallback, payload=None):
+        if verdict["stage"] == "breaker":
+            return {"status": "blocked", "decided_by": "breaker", "message": verdict["message"],
+                    "recommended_model": None, "estimated_saving": "N/A"}
+        if payload is not None:
+            input_tokens, messages = payload["input_tokens"], payload["messages"]
+        else:
+            input_tokens = 0  # not counted: the block was decided on the output-only floor
+        return self._blocked(verdict["message"], "bounds", model, input_tokens, verdict["output_tokens"],
+                             verdict["cost"], verdict["limit"], auto_fallback, messages)
+
+    def _check_payload(self, model, payload, context, auto_fallback, is_batch, reserve=False):
+        """Stage 3: price the optimized payload from its exact token count and admit it."""
+        optimized_messages = payload["messages"]
+        input_tokens = payload["input_tokens"]
+        t0 = time.perf_counter_ns() if LATENCY.enabled else 0
+        limit, _, output_tokens = self.context_limit(model, context, is_batch)
+        est_cost = self.guard.estimate_cost(model, input_tokens, output_tokens, is_batch=is_batch)
+        if t0:
+            t0 = LATENCY.lap("preflight.pricing", t0)
         
-        return {
+        reservation_id = None
+        if reserve:
+            ok, msg, reservation_id = self.guard.reserve_budget(est_cost, context, input_tokens + output_tokens)
+        else:
+            ok, msg = self.guard.check_budget(est_cost, context)
+        if t0:
+            LATENCY.lap("preflight.admission", t0)
+        if not ok:
+            return self._blocked(msg, "budget", model, input_tokens, output_tokens, est_cost, limit,
+                                 auto_fallback, optimized_messages)
+        
+        result = {
             "status": "ok",
+            "decided_by": "budget",
             "optimized_messages": optimized_messages,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
             "estimated_cost": est_cost
         }
+        if reserve:
+            result["reservation_id"] = reservation_id
+        return result
+
+    def _blocked(self, msg, stage, model, input_tokens, output_tokens, est_cost, limit, auto_fallback, messages):
+        # Recommend or Auto-Fallback
+        rec_model, rec_cost, reason = self.guard.recommend_model(input_tokens, output_tokens, limit)
+        
+        if auto_fallback and rec_model:
+            print(f"[AUTO-FALLBACK] Over budget on {model}. Switching to {rec_model}.")
+            return {
+                "status": "fallback",
+                "decided_by": stage,
+                "original_model": model,
+                "new_model": rec_model,
+                "estimated_cost": rec_cost,
+                "input_tokens": input_tokens,
+                "optimized_messages": messages
+            }
+
+        return {
+            "status": "blocked",
+            "decided_by": stage,
+            "message": msg,
+            "recommended_model": rec_model,
+            "estimated_saving": f"${(est_cost - rec_cost):.4f}" if rec_model else "N/A"
+        }
+
 
 if __name__ == "__main__":
     orchestrator = GuardOrchestrator()
@@ -0,0 +1,204 @@
+"""
+output_predictor.py — Learned output-token prediction for preflight estimates.
+
+Keeps one streaming quantile sketch (the P² algorithm: five markers, O(1)
+memory) per (model, context) and per model, fed with the actual output
+tokens of finished calls. Preflight asks for the configured percentile
+instead of assuming a fixed 500 output tokens. State is persisted to a small
+JSON file and can be bootstrapped from data/usage_log.jsonl.
+"""
+
+import os
+import json
+import tempfile
+import threading
+
+DEFAULT_OUTPUT_TOKENS = 500
+_ANY = "*"
+
+
+class P2Quantile:
+    """
+    Streaming estimate of the p-quantile of a sequence (Jain & Chlamtac's P²).
+    Memory is five marker heights and positions, whatever the sample count.
+    """
+    __slots__ = ("p", "count", "heights", "positions", "desired", "increments")
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def value(self):
+        if not self.heights:
+            return None
+        if self.count <= 5:
+            return self.heights[min(len(self.heights) - 1, int(self.p * len(self.heights)))]
+        return self.heights[2]
+
+    def to_dict(self):
+        return {"count": self.count, "heights": self.heights,
+                "positions": self.positions, "desired": self.desired}
+
+    @classmethod
+    def from_dict(cls, p, data):
+        sketch = cls(p)
+        sketch.count = data["count"]
+        sketch.heights = list(data["heights"])
+        sketch.positions = list(data["positions"])
+        sketch.desired = list(data["desired"])
+        return sketch
+
+
+class OutputTokenPredictor:
+    """
+    Predicts output tokens per (model, context) at a configurable percentile.
+    Keys with fewer than min_samples observations fall back to the model-wide
+    sketch, then to default_tokens.
+    """
+    def __init__(self, percentile=0.9, default_tokens=DEFAULT_OUTPUT_TOKENS, min_samples=5,
+                 state_path=None, save_every=20):
+        self.percentile = percentile
+        self.default_tokens = default_tokens
+        self.min_samples = min_samples
+        self.state_path = state_path
+        self.save_every = save_every
+        self._sketches = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one writer at a time, so saves land in order
+        if state_path and os.path.exists(state_path):
+            self.load(state_path)
+
+    def observe(self, model, context, output_tokens):
+        """
+        Feeds the actual output tokens of a finished call. Every save_every
+        observations the state is saved; a failed save is skipped (the next
+        one writes everything), never raised to the caller.
+        """
+        with self._lock:
+            self._add(model, context, output_tokens)
+            self._unsaved += 1
+            save = self.state_path and self.save_every and self._unsaved >= self.save_every
+        if save:
+            try:
+                self.save()
+            except OSError:
+                pass
+
+    def _add(self, model, context, output_tokens):
+        """Feeds one observation to the (model, context) and model-wide sketches (under the lock)."""
+        for key in ((model, context), (model, _ANY)) if context != _ANY else ((model, _ANY),):
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = P2Quantile(self.percentile)
+            sketch.add(output_tokens)
+
+    def predict(self, model, context):
+        """Output tokens to reserve for a call: the percentile estimate, rounded up."""
+        with self._lock:
+            for key in ((model, context), (model, _ANY)):
+                sketch = self._sketches.get(key)
+                if sketch is not None and sketch.count >= self.min_samples:
+                    return max(1, int(-(-sketch.value() // 1)))
+        return self.default_tokens
+
+    def bootstrap_from_usage_log(self, path, contexts=()):
+        """
+        Feeds the "out" field of every record in a usage_log.jsonl file.
+        Models are logged with a provider prefix ("anthropic/claude-sonnet-4-6"),
+        which is dropped to match pricing names. A record's "task" is used as
+        its context only if it is one of contexts; other records feed just the
+        model-wide estimate. Nothing is saved.
+        """
+        count = 0
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    model = record["model"].rsplit("/", 1)[-1]
+                    task = record.get("task")
+                    with self._lock:
+                        self._add(model, task if task in contexts else _ANY, int(record["out"]))
+                    count += 1
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    continue
+        return count
+
+    def save(self, path=None):
+        """Writes the sketches atomically (temp file in the same directory + rename)."""
+        path = path or self.state_path
+        if not path:
+            return
+        with self._save_lock:
+            with self._lock:
+                state = {
+                    "percentile": self.percentile,
+                    "sketches": [[model, context, sketch.to_dict()]
+                                 for (model, context), sketch in self._sketches.items()],
+                }
+                self._unsaved = 0
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=".output_predictor-", dir=directory)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def load(self, path):
+        """Loads saved sketches; state saved for a different percentile is ignored."""
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get("percentile") != self.percentile:
+            return False
+        with self._lock:
+            self._sketches = {(model, context): P2Quantile.from_dict(self.percentile, data)
+                              for model, context, data in state.get("sketches", [])}
+        return True
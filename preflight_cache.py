@@ -0,0 +1,86 @@
+"""
+preflight_cache.py — Short-TTL LRU cache for the deterministic part of preflight.
+
+Retries and heartbeats resubmit byte-identical payloads. Optimizing and
+tokenizing them again gives the same answer, so the result is cached under a
+fingerprint of (model, context, messages) for a short time. Only the
+optimized payload is cached; budget admission is always re-run by the caller.
+"""
+
+import json
+import time
+import hashlib
+import threading
+import collections
+
+
+def payload_fingerprint(model, messages, context):
+    """Stable digest of a request's model, context and messages."""
+    blob = json.dumps([model, context, messages], sort_keys=True, separators=(",", ":"),
+                      ensure_ascii=False, default=str)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _copy_payload(payload):
+    # Callers may edit the returned messages; keep the cached copy intact.
+    copied = dict(payload)
+    copied["messages"] = [dict(m) for m in payload["messages"]]
+    copied["token_counts"] = list(payload["token_counts"])
+    return copied
+
+
+class PreflightCache:
+    """
+    Bounded LRU of optimized payloads with a per-entry TTL. Tracks hits,
+    misses and the compute time hits have saved.
+    """
+    def __init__(self, max_entries=256, ttl_seconds=600.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries = collections.OrderedDict()  # key -> (expires_at, compute_seconds, payload)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key):
+        """Returns a copy of the cached payload, or None on a miss or expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry[1]
+            payload = entry[2]
+        return _copy_payload(payload)
+
+    def put(self, key, payload, compute_seconds=0.0):
+        """Stores a payload; compute_seconds is what a later hit saves."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl_seconds, compute_seconds, _copy_payload(payload))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
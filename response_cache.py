@@ -0,0 +1,194 @@
+"""
+response_cache.py — Disk-backed exact-match cache of LLM responses.
+
+Deterministic calls (temperature 0 extraction, classification) are re-issued
+across runs. Successful responses are stored under a content address: the
+request_key digest of (model, normalized messages, params). Entries carry
+their own TTL; the cache is bounded in bytes and evicts least recently used
+entries first.
+
+On-disk format: one append-only file, an 8-byte magic followed by records of
+a fixed 28-byte little-endian header (16-byte key, float64 expires_at,
+uint32 length) and `length` bytes of UTF-8 JSON. expires_at 0 marks a
+tombstone for an evicted key. Fixed-width headers let a warm start mmap the
+file and build the index by hopping from header to header without parsing
+any JSON; reads go through the same map. Later records for a key override
+earlier ones. When dead records make up more than half the file it is
+rewritten (compacted) with only the live entries.
+"""
+
+import os
+import json
+import mmap
+import time
+import struct
+import threading
+import collections
+
+_MAGIC = b"ABGRC\x00\x00\x01"
+_HEADER = struct.Struct("<16sdI")
+_MIN_COMPACT_BYTES = 64 * 1024
+
+
+class ResponseCache:
+    """
+    Thread-safe. get() returns a copy of the stored response or None;
+    put() stores a response for ttl_seconds (default: the cache's TTL).
+    Recency survives a restart only as file order (last written first out).
+    """
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, ttl_seconds=7 * 24 * 3600, clock=time.time):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._index = collections.OrderedDict()  # key bytes -> (payload offset, length, expires_at)
+        self._live_bytes = 0
+        self._map = None
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._open()
+
+    # ── File handling ───────────────────────────────────────────────────
+
+    def _open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < len(_MAGIC):
+            with open(self.path, "wb") as f:
+                f.write(_MAGIC)
+        self._file = open(self.path, "r+b")
+        self._size = self._load()
+
+    def _load(self):
+        """Rebuilds the index from the file; returns the valid file length."""
+        size = os.fstat(self._file.fileno()).st_size
+        self._index.clear()
+        self._live_bytes = 0
+        if size <= len(_MAGIC):
+            return len(_MAGIC)
+        now = self.clock()
+        with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[:len(_MAGIC)] != _MAGIC:
+                raise ValueError(f"{self.path} is not a response cache file")
+            offset = len(_MAGIC)
+            while offset + _HEADER.size <= size:
+                key, expires_at, length = _HEADER.unpack_from(view, offset)
+                end = offset + _HEADER.size + length
+                if end > size:
+                    break  # torn write at the tail
+                self._drop(key)
+                if expires_at > now:
+                    self._index[key] = (offset + _HEADER.size, length, expires_at)
+                    self._live_bytes += _HEADER.size + length
+                offset = end
+        if offset < size:
+            self._file.truncate(offset)
+        return offset
+
+    def _view(self, end):
+        """A read-only map covering at least `end` bytes of the file."""
+        if self._map is None or len(self._map) < end:
+            if self._map is not None:
+                self._map.close()
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _append(self, key, expires_at, payload):
+        self._file.seek(self._size)
+        self._file.write(_HEADER.pack(key, expires_at, len(payload)) + payload)
+        offset = self._size + _HEADER.size
+        self._size = offset + len(payload)
+        return offset
+
+    def _drop(self, key):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self._live_bytes -= _HEADER.size + entry[1]
+        return entry
+
+    def _compact(self):
+        view = self._view(self._size)
+        tmp_path = self.path + ".tmp"
+        index = collections.OrderedDict()
+        with open(tmp_path, "wb") as out:
+            out.write(_MAGIC)
+            position = len(_MAGIC)
+            for key, (offset, length, expires_at) in self._index.items():
+                out.write(_HEADER.pack(key, expires_at, length) + view[offset:offset + length])
+                index[key] = (position + _HEADER.size, length, expires_at)
+                position += _HEADER.size + length
+            out.flush()
+            os.fsync(out.fileno())
+        self._map.close()
+        self._map = None
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "r+b")
+        self._index = index
+        self._size = position
+
+    # ── Public API ──────────────────────────────────────────────────────
+
+    def get(self, key):
+        """key is a hex digest (singleflight.request_key)."""
+        raw_key = bytes.fromhex(key)
+        with self._lock:
+            entry = self._index.get(raw_key)
+            if entry is not None and entry[2] <= self.clock():
+                self._drop(raw_key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            offset, length, _ = entry
+            payload = self._view(offset + length)[offset:offset + length]
+            self._index.move_to_end(raw_key)
+            self.hits += 1
+        return json.loads(payload.decode("utf-8"))
+
+    def put(self, key, response, ttl_seconds=None):
+        """Stores a JSON-serializable response; oversized responses are not cached."""
+        raw_key = bytes.fromhex(key)
+        payload = json.dumps(response, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        if _HEADER.size + len(payload) > self.max_bytes:
+            return False
+        expires_at = self.clock() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self._drop(raw_key)
+            offset = self._append(raw_key, expires_at, payload)
+            self._index[raw_key] = (offset, len(payload), expires_at)
+            self._live_bytes += _HEADER.size + len(payload)
+            while self._live_bytes > self.max_bytes:
+                evicted, (_, evicted_length, _) = self._index.popitem(last=False)
+                self._live_bytes -= _HEADER.size + evicted_length
+                self._append(evicted, 0.0, b"")
+            self._file.flush()
+            if self._size > _MIN_COMPACT_BYTES and self._size > 2 * self._live_bytes:
+                self._compact()
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._index.clear()
+            self._live_bytes = 0
+            self._compact()
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._file.close()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._live_bytes,
+                "file_bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
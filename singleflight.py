@@ -0,0 +1,156 @@
+"""
+singleflight.py — Coalesces identical in-flight LLM calls into one upstream request.
+
+Parallel sub-agents often send the same prompt to the same model at the same
+moment. The first caller for a key (the leader) makes the call; callers that
+arrive while it is in flight (followers) wait for and share its result. Only
+concurrent calls are merged: once the leader finishes, the key is forgotten
+and the next caller goes upstream again.
+
+Followers get a copy of the leader's response marked "coalesced": True whose
+"usage" is zeroed (the leader's usage is kept under "coalesced_usage"), so a
+caller that charges the budget from "usage" pays for the call once. If
+the leader is cancelled, its followers (who were not) get a "Request
+cancelled" error instead of a CancelledError.
+"""
+
+import json
+import asyncio
+import hashlib
+import threading
+
+
+def request_key(model, messages, params=None):
+    """Digest of (model, normalized messages, params) identifying an upstream call."""
+    normalized = [
+        {"role": str(m.get("role", "user")).lower(),
+         "content": m.get("content", "").strip() if isinstance(m.get("content"), str) else m.get("content")}
+        for m in messages
+    ]
+    blob = json.dumps([model, normalized, params or {}], sort_keys=True, separators=(",", ":"),
+                      ensure_ascii=False, default=str)
+    return hashlib.blake2b(blob.encode("utf-8"), digest_size=16).hexdigest()
+
+
+_CANCELLED = {"status": "error", "message": "Request cancelled"}
+
+
+def _follower_copy(response):
+    shared = dict(response)
+    shared["coalesced"] = True
+    usage = response.get("usage")
+    if usage:
+        shared["coalesced_usage"] = dict(usage)
+        shared["usage"] = {name: 0 for name in usage}
+    return shared
+
+
+class _Call:
+    __slots__ = ("done", "response", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Threaded and asyncio coalescing with shared counters. Threaded callers
+    use do(); coroutines use do_async(). The two never share an in-flight
+    call, since an asyncio future cannot be awaited from another thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}  # (loop id, key) -> asyncio.Future
+        self.calls = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.saved_tokens = 0
+
+    def do(self, key, fn, timeout=None):
+        """
+        Returns fn()'s response, running fn only if no identical call is in
+        flight. A follower whose timeout runs out first gets a deadline error;
+        the leader's call is not affected. Exceptions raised by fn reach every
+        waiter.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.upstream_calls += 1
+        if not leader:
+            if not call.done.wait(timeout):
+                return {"status": "error", "message": "Deadline exceeded"}
+            if call.error is not None:
+                raise call.error
+            return self._shared(call.response)
+        try:
+            call.response = fn()
+            return call.response
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn, timeout=None):
+        """do() for coroutines: fn is a zero-argument coroutine function."""
+        loop = asyncio.get_running_loop()
+        slot = (id(loop), key)
+        with self._lock:
+            self.calls += 1
+            future = self._async_calls.get(slot)
+            leader = future is None
+            if leader:
+                future = self._async_calls[slot] = loop.create_future()
+                self.upstream_calls += 1
+        if not leader:
+            try:
+                response = await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                return {"status": "error", "message": "Deadline exceeded"}
+            if response is _CANCELLED:
+                return dict(_CANCELLED)
+            return self._shared(response)
+        try:
+            response = await fn()
+        except asyncio.CancelledError:
+            future.set_result(_CANCELLED)  # only the leader was cancelled
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when there are no followers
+            raise
+        else:
+            future.set_result(response)
+            return response
+        finally:
+            with self._lock:
+                del self._async_calls[slot]
+
+    def _shared(self, response):
+        shared = _follower_copy(response)
+        with self._lock:
+            self.coalesced += 1
+            usage = shared.get("coalesced_usage")
+            if usage:
+                self.saved_tokens += sum(usage.values())
+        return shared
+
+    def stats(self):
+        """Calls seen, calls served from another caller's request, and the tokens that saved."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "upstream_calls": self.upstream_calls,
+                "dedup_ratio": self.coalesced / self.calls if self.calls else 0.0,
+                "saved_tokens": self.saved_tokens,
+            }
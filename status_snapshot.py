@@ -0,0 +1,112 @@
+"""
+status_snapshot.py — Cached renderings of guard state (the /status body, the dashboard).
+
+Dashboards poll /status every second while the breaker changes far less
+often. A Snapshot keeps the rendered bytes and their ETag and rebuilds them
+only when the state's version moves (by default the breaker's version: any
+recorded usage, reservation, failure or state change), when the guard's
+thresholds are reconfigured, or when the figures
+change on their own: the breaker's summary() reports the time the oldest
+in-window event ages out, a reservation lapses or an OPEN circuit may
+half-open. A poll that finds the snapshot current does a few comparisons and
+touches no guard state; one whose If-None-Match carries the ETag can be
+answered 304 without a body.
+
+Expensive renderings (the markdown dashboard) can set min_interval, to be
+rebuilt at most that often however fast the state changes, and compress, to
+keep a gzip copy for clients that accept it.
+"""
+
+import gzip
+import json
+import time
+import hashlib
+import collections
+
+Rendered = collections.namedtuple("Rendered", "body etag gzipped")  # gzipped is None without compress
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value lists etag (or is "*")."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag or candidate == "*":
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding):
+    """True if an Accept-Encoding header value allows gzip."""
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            q = params.replace(" ", "")
+            try:
+                return not (q.startswith("q=") and float(q[2:]) == 0)
+            except ValueError:
+                return True
+    return False
+
+
+class Snapshot:
+    """
+    guard: the BudgetGuard whose state is rendered (guard.breaker is re-read
+    on every get(), so swapping the breaker is noticed).
+    render: render(summary, now) -> bytes, where summary is
+    guard.breaker.summary(now); called under the guard lock.
+    version: version() -> a value that changes whenever state the rendering
+    shows changes (default: the breaker's version). The guard's thresholds
+    are always part of the key, since both renderings show them.
+    on_render: on_render(body) after each rebuild, outside the lock.
+    """
+    def __init__(self, guard, render, version=None, min_interval=0.0, compress=False, on_render=None,
+                 clock=time.time):
+        self.guard = guard
+        self.render = render
+        self.version = version or (lambda: guard.breaker.version)
+        self.min_interval = min_interval
+        self.compress = compress
+        self.on_render = on_render
+        self.clock = clock
+        self._current = None  # (key, stable_until, built_at, Rendered)
+        self.builds = 0
+
+    def get(self):
+        """Returns the current Rendered, rebuilding only if it is out of date."""
+        now = self.clock()
+        current = self._current
+        if current is not None:
+            key, stable_until, built_at, rendered = current
+            if now - built_at < self.min_interval or (
+                    now < stable_until and key == self._key()):
+                return rendered
+        with self.guard.lock:
+            breaker = self.guard.breaker
+            key = self._key()
+            summary = breaker.summary(now)
+            body = self.render(summary, now)
+        etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        gzipped = gzip.compress(body, mtime=0) if self.compress else None
+        rendered = Rendered(body, etag, gzipped)
+        self._current = (key, summary["stable_until"], now, rendered)
+        self.builds += 1
+        if self.on_render is not None:
+            self.on_render(body)
+        return rendered
+
+    def _key(self):
+        guard = self.guard
+        return guard.breaker, self.version(), guard.default_threshold, tuple(guard.thresholds.items())
+
+
+class StatusSnapshot(Snapshot):
+    """
+    Snapshot of a JSON document: build(summary, now) -> JSON-serializable
+    dict, called under the guard lock.
+    """
+    def __init__(self, guard, build, clock=time.time):
+        super().__init__(guard, lambda summary, now: json.dumps(build(summary, now)).encode(), clock=clock)
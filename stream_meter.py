@@ -0,0 +1,113 @@
+"""
+stream_meter.py — Incremental metering of streamed LLM output.
+
+The guard normally decides once, before a call. A StreamMeter keeps deciding
+while the response streams: it reserves the input cost up front, counts
+output tokens as chunks arrive, grows the reservation in the breaker window
+so concurrent callers see the spend live, and tells the caller to cut the
+stream off once the request's cost crosses its per-request limit or the
+window would overflow.
+
+Per chunk, feed() adds the chunk length to a counter and compares one
+integer; the window (which needs the guard lock) is consulted every
+sync_tokens tokens and whenever the per-request cap is reached. Output
+tokens are estimated as the larger of the chunk count (providers send about
+one token per delta) and characters / 4, then replaced by the provider's
+reported usage in finish().
+"""
+
+import math
+
+
+class StreamMeter:
+    """
+    Lifecycle: start() -> feed(text) per chunk -> finish(usage), or cancel()
+    if the call failed before producing output. feed() returns False once
+    the stream must stop; cut_off_reason is then "request_limit",
+    "window_limit", or "reservation_lapsed" if the hold lapsed while the
+    stream stalled.
+    """
+    def __init__(self, guard, model, input_tokens, context="routine", sync_tokens=32):
+        self.guard = guard
+        self.model = model
+        self.context = context
+        self.input_tokens = input_tokens
+        self.sync_tokens = sync_tokens
+        pricing = guard.model_pricing.get(model) or {"input": 0.0, "output": 0.0}
+        self.input_cost = input_tokens / 1_000_000 * pricing["input"]
+        self.output_price = pricing["output"] / 1_000_000  # per token
+        self.limit = guard.thresholds.get(context, guard.default_threshold)
+        if self.output_price:
+            self.request_cap = max(0, math.floor((self.limit - self.input_cost) / self.output_price))
+        else:
+            self.request_cap = math.inf
+        self.reservation_id = None
+        self.chunks = 0
+        self.chars = 0
+        self.cut_off_reason = None
+        self._next_check = min(sync_tokens, self.request_cap + 1)
+
+    @property
+    def output_tokens(self):
+        """Output tokens streamed so far (estimated)."""
+        return max(self.chunks, self.chars >> 2)
+
+    @property
+    def cost(self):
+        """Projected cost of the request so far, in USD."""
+        return self.input_cost + self.output_tokens * self.output_price
+
+    def start(self):
+        """Reserves the input cost. Returns (ok, message) like check_budget."""
+        ok, msg, self.reservation_id = self.guard.reserve_budget(
+            self.input_cost, self.context, estimated_tokens=self.input_tokens)
+        return ok, msg
+
+    def feed(self, text):
+        """Counts one streamed chunk. Returns False when the stream should be cut off."""
+        self.chunks += 1
+        self.chars += len(text)
+        tokens = self.chunks if self.chunks > self.chars >> 2 else self.chars >> 2
+        if tokens < self._next_check:
+            return True
+        return self._check(tokens)
+
+    def _check(self, tokens):
+        if tokens > self.request_cap:
+            self.cut_off_reason = "request_limit"
+            return False
+        with self.guard.lock:
+            breaker = self.guard.breaker
+            within_window = breaker.extend(
+                self.reservation_id, cost=self.input_cost + tokens * self.output_price,
+                tokens=self.input_tokens + tokens)
+            if not within_window:
+                self.cut_off_reason = "window_limit" if breaker.holds(self.reservation_id) else "reservation_lapsed"
+        if not within_window:
+            return False
+        self._next_check = min(tokens + self.sync_tokens, self.request_cap + 1)
+        return True
+
+    def finish(self, usage=None):
+        """
+        Settles the reservation with the provider's usage when it reported
+        one (it may not, if the stream was cut off), else with the estimate.
+        Returns the cost charged.
+        """
+        usage = usage or {}
+        input_tokens = usage.get("input_tokens") or self.input_tokens
+        output_tokens = usage.get("output_tokens") or self.output_tokens
+        cost = self.guard.estimate_cost(self.model, input_tokens, output_tokens)
+        self.guard.commit_usage(self.reservation_id, cost, input_tokens, output_tokens,
+                                model=self.model, context=self.context)
+        if self.cut_off_reason:
+            self.guard.trigger_notification(
+                f"[STREAM CUT-OFF] {self.model} stream stopped after {output_tokens} output tokens "
+                f"(${cost:.4f}, {self.cut_off_reason.replace('_', ' ')} for '{self.context}')."
+            )
+        return cost
+
+    def cancel(self):
+        """Releases the reservation of a call that produced no output."""
+        if self.reservation_id is not None:
+            self.guard.release_reservation(self.reservation_id)
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from api_key_manager import APIKeyManager
+
+
+class TestAPIKeyManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config_path = os.path.join(self.tmp.name, "config.json")
+        with open(self.config_path, "w") as f:
+            json.dump({"api_keys": {"GEMINI": ["key-a", "key-b", "key-c"]}}, f)
+
+    def manager(self, **kwargs):
+        manager = APIKeyManager("GEMINI", self.config_path, **kwargs)
+        self.addCleanup(manager.flush_state, 5)  # the saver must be done before tmp is removed
+        return manager
+
+    def test_keys_keep_config_order(self):
+        self.assertEqual(self.manager().get_all_keys(), ["key-a", "key-b", "key-c"])
+
+    def test_cooling_key_is_skipped_without_waiting(self):
+        manager = self.manager()
+        self.assertEqual(manager.mark_rate_limited("key-a", retry_after=30), 30)
+        start = time.monotonic()
+        self.assertEqual(manager.get_key(), "key-b")
+        self.assertLess(time.monotonic() - start, 0.1)
+        manager.mark_rate_limited("key-b", retry_after=30)
+        manager.mark_rate_limited("key-c", retry_after=30)
+        self.assertIsNone(manager.get_key())
+        self.assertAlmostEqual(manager.next_ready_in(), 30, delta=1)
+
+    def test_backoff_grows_and_is_capped(self):
+        manager = self.manager(base_backoff=1.0, max_backoff=4.0)
+        with patch("random.uniform", side_effect=lambda low, high: high):
+            delays = [manager.mark_rate_limited("key-a") for _ in range(4)]
+        self.assertEqual(delays, [1.0, 2.0, 4.0, 4.0])
+        manager.mark_success("key-a")
+        self.assertEqual(manager.cooldown_remaining("key-a"), 0)
+        self.assertNotIn("key-a", manager.key_state)
+
+    def test_acquire_waits_only_when_all_keys_cool(self):
+        manager = self.manager()
+        for key in manager.get_all_keys():
+            manager.mark_rate_limited(key, retry_after=0.05)
+        self.assertIsNone(manager.acquire_key(deadline=time.monotonic() + 0.01))
+        self.assertIn(manager.acquire_key(), manager.get_all_keys())
+
+    def test_state_survives_restart_without_storing_keys(self):
+        manager = self.manager()
+        manager.mark_rate_limited("key-a", retry_after=60)
+        self.assertTrue(manager.flush_state(timeout=5))
+        with open(manager.state_path) as f:
+            self.assertNotIn("key-a", f.read())
+        restarted = self.manager()
+        self.assertGreater(restarted.cooldown_remaining("key-a"), 50)
+        self.assertEqual(restarted.get_key(), "key-b")
+
+    def test_state_is_saved_off_the_caller_thread_and_never_torn(self):
+        manager = self.manager()
+        writers = []
+        save_state = manager.save_state
+
+        def save():
+            writers.append(threading.current_thread())
+            save_state()
+
+        manager.save_state = save
+
+        def throttle(key):
+            for _ in range(50):
+                manager.mark_rate_limited(key, retry_after=60)
+                manager.mark_success(key)
+            manager.mark_rate_limited(key, retry_after=60)
+
+        threads = [threading.Thread(target=throttle, args=(key,)) for key in manager.get_all_keys()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(manager.flush_state(timeout=5))
+        self.assertTrue(writers)
+        self.assertEqual({w.name for w in writers}, {"api-key-state"})
+        state_dir = os.path.dirname(manager.state_path)
+        self.assertEqual(os.listdir(state_dir), [os.path.basename(manager.state_path)])
+        with open(manager.state_path) as f:
+            self.assertEqual(len(json.load(f)), 3)
+
+
+
+class TestQuotaScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config_path = os.path.join(self.tmp.name, "config.json")
+        with open(self.config_path, "w") as f:
+            json.dump({"api_keys": {"OPENAI": [
+                {"key": "small", "rpm": 2, "tpm": 1000},
+                {"key": "large", "rpm": 10, "tpm": 10000, "max_concurrency": 2},
+                "unlimited-but-cooling",
+            ]}}, f)
+        self.manager = APIKeyManager("OPENAI", self.config_path)
+        self.addCleanup(self.manager.flush_state, 5)
+        self.manager.mark_rate_limited("unlimited-but-cooling", retry_after=60)
+
+    def test_picks_key_with_most_headroom(self):
+        first = self.manager.acquire_slot(100)
+        self.assertEqual(first.key, "small")  # both untouched: config order breaks the tie
+        second = self.manager.acquire_slot(100)
+        self.assertEqual(second.key, "large")  # small is now at 50% of its RPM
+        self.assertAlmostEqual(self.manager.headroom("small"), 0.5)
+        self.assertAlmostEqual(self.manager.headroom("large"), 0.9)
+
+    def test_concurrency_cap_and_quota_exhaustion(self):
+        leases = [self.manager.acquire_slot(100) for _ in range(4)]
+        self.assertEqual(sorted(l.key for l in leases), ["large", "large", "small", "small"])
+        # small is out of RPM and large is at its concurrency cap
+        self.assertIsNone(self.manager.acquire_slot(100, deadline=time.monotonic() + 0.05))
+        self.manager.release_slot(leases[1] if leases[1].key == "large" else leases[2])
+        self.assertEqual(self.manager.acquire_slot(100, deadline=time.monotonic() + 0.05).key, "large")
+
+    def test_release_replaces_token_estimate(self):
+        lease = self.manager.acquire_slot(900)
+        self.manager.release_slot(lease, actual_tokens=150)
+        self.assertEqual(self.manager._usage[lease.key].tokens, 150)
+        self.assertEqual(self.manager._usage[lease.key].in_flight, 0)
+
+    def test_exclude_and_has_room(self):
+        self.assertEqual(self.manager.acquire_slot(100, exclude=("small",)).key, "large")
+        self.assertTrue(self.manager.has_room(100, exclude=("large",)))
+        self.assertEqual(self.manager._usage["small"].in_flight, 0)  # has_room records nothing
+        self.assertFalse(self.manager.has_room(100, exclude=("small", "large")))
+        self.assertIsNone(self.manager.acquire_slot(100, deadline=time.monotonic(), exclude=("small", "large")))
+
+    def test_threads_never_exceed_quotas(self):
+        results = []
+
+        def worker():
+            lease = self.manager.acquire_slot(100, deadline=time.monotonic() + 0.2)
+            results.append(lease)
+            if lease:
+                time.sleep(0.01)
+                self.manager.release_slot(lease)
+
+        threads = [threading.Thread(target=worker) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        used = [l.key for l in results if l]
+        self.assertEqual(used.count("small"), 2)
+        self.assertEqual(used.count("large"), 10)
+        self.assertEqual(results.count(None), 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
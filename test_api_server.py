@@ -11,6 +11,8 @@ import json
 import time
 import threading
 import unittest
+import unittest.mock
+import http.client
 import urllib.request
 import urllib.error
 
@@ -27,7 +29,10 @@ def _start_test_server(port=18765):
     import api_server as srv
 
     # Force stdlib path for testing predictability
-    server = HTTPServer(("127.0.0.1", port), srv._Handler if not srv.USING_FLASK else _make_stdlib_handler())
+    if srv.USING_FLASK:
+        server = HTTPServer(("127.0.0.1", port), _make_stdlib_handler())
+    else:
+        server = srv.make_server("127.0.0.1", port)
     thread = threading.Thread(target=server.serve_forever, daemon=True)
     thread.start()
     time.sleep(0.2)  # brief settle
@@ -64,16 +69,16 @@ def _make_stdlib_handler():
                 self._send_json({"ok": True})
             elif self.path == "/status":
                 self._send_json(api_server._get_status_data())
+            elif self.path == "/latency":
+                self._send_json(api_server._get_latency_data())
             elif self.path == "/dashboard":
                 self._send_text(api_server._read_dashboard())
             else:
                 self._send_json({"error": "not found"}, 404)
 
         def do_POST(self):
-            if self.path == "/reset":
-                self._send_json(api_server._reset_circuit_breaker())
-            else:
-                self._send_json({"error": "not found"}, 404)
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self._send_json(*api_server._handle_post(self.path, body))
 
     return _H
 
@@ -96,6 +101,24 @@ def _post(path, data=b""):
         return r.status, r.read().decode(), r.headers.get("Content-Type", "")
 
 
+def _post_json(path, data):
+    body = data if isinstance(data, bytes) else json.dumps(data).encode()
+    req = urllib.request.Request(BASE + path, data=body, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=5) as r:
+            return r.status, json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def _encoding_available():
+    try:
+        api_server._get_orchestrator()
+        return True
+    except RuntimeError:
+        return False
+
+
 class TestHealth(unittest.TestCase):
     def test_health_ok(self):
         status, body, ct = _get("/health")
@@ -131,6 +154,97 @@ class TestStatus(unittest.TestCase):
             self.assertIn(key, sv)
 
 
+class TestStatusSnapshot(unittest.TestCase):
+    def setUp(self):
+        from cost_calculator import BudgetGuard
+        from circuit_breaker import CircuitBreaker
+        from status_snapshot import StatusSnapshot
+        self.now = 1000.0
+        self.guard = BudgetGuard()
+        self.guard.breaker = CircuitBreaker(cost_window_seconds=60)
+        self.snapshot = StatusSnapshot(self.guard, lambda summary, now: summary, clock=lambda: self.now)
+
+    def test_rebuilt_only_on_change_or_window_boundary(self):
+        with unittest.mock.patch("time.time", return_value=self.now):
+            self.guard.breaker.track_usage(cost=0.5)
+        body, etag, _ = self.snapshot.get()
+        self.assertEqual(self.snapshot.get().etag, etag)
+        self.assertEqual(self.snapshot.builds, 1)
+
+        self.now += 30
+        with unittest.mock.patch("time.time", return_value=self.now):
+            self.guard.breaker.track_usage(cost=0.25)
+        body, new_etag, _ = self.snapshot.get()
+        self.assertNotEqual(new_etag, etag)
+        self.assertAlmostEqual(json.loads(body)["window_cost"], 0.75)
+
+        self.now += 31  # the first event leaves the window
+        body = self.snapshot.get().body
+        self.assertEqual(self.snapshot.builds, 3)
+        self.assertAlmostEqual(json.loads(body)["window_cost"], 0.25)
+        self.assertEqual(len(self.guard.breaker.cost_events), 2)
+
+    def test_threshold_change_rebuilds_the_snapshot(self):
+        from status_snapshot import StatusSnapshot
+        snapshot = StatusSnapshot(self.guard, lambda summary, now: {"thresholds": dict(self.guard.thresholds)},
+                                  clock=lambda: self.now)
+        first = snapshot.get()
+        self.guard.thresholds["routine"] = 0.01
+        second = snapshot.get()
+        self.assertNotEqual(second.etag, first.etag)
+        self.assertEqual(json.loads(second.body)["thresholds"]["routine"], 0.01)
+        self.assertIs(snapshot.get(), second)
+
+    def test_min_interval_throttles_rebuilds_and_keeps_a_gzip_copy(self):
+        import gzip
+        from status_snapshot import Snapshot
+        rendered = []
+        snapshot = Snapshot(self.guard, lambda summary, now: f"cost={summary['window_cost']}".encode(),
+                            min_interval=5.0, compress=True, on_render=rendered.append, clock=lambda: self.now)
+        first = snapshot.get()
+        self.assertEqual(gzip.decompress(first.gzipped), first.body)
+        with unittest.mock.patch("time.time", return_value=self.now):
+            self.guard.breaker.track_usage(cost=0.5)
+        self.now += 1
+        self.assertIs(snapshot.get(), first)
+        self.now += 5
+        self.assertEqual(snapshot.get().body, b"cost=0.5")
+        self.assertEqual(rendered, [b"cost=0", b"cost=0.5"])
+
+    def test_status_supports_conditional_get(self):
+        conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=5)
+        self.addCleanup(conn.close)
+        conn.request("GET", "/status")
+        response = conn.getresponse()
+        response.read()
+        etag = response.getheader("ETag")
+        self.assertTrue(etag)
+        conn.request("GET", "/status", headers={"If-None-Match": etag})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.read(), b"")
+        _post_json("/record", {"cost": 0.0001})
+        conn.request("GET", "/status", headers={"If-None-Match": etag})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.getheader("ETag"), etag)
+        json.loads(response.read())
+
+
+class TestLatency(unittest.TestCase):
+    def test_latency_reports_recorded_stages(self):
+        api_server._guard.check_budget(0.0001, "routine")
+        status, body, ct = _get("/latency")
+        self.assertEqual(status, 200)
+        self.assertIn("application/json", ct)
+        data = json.loads(body)
+        self.assertTrue(data["enabled"])
+        stage = data["stages"]["guard.check_budget"]
+        for key in ("count", "mean_us", "p50_us", "p90_us", "p99_us", "max_us"):
+            self.assertIn(key, stage)
+        self.assertGreaterEqual(stage["count"], 1)
+
+
 class TestDashboard(unittest.TestCase):
     def test_dashboard_200(self):
         status, body, ct = _get("/dashboard")
@@ -140,6 +254,84 @@ class TestDashboard(unittest.TestCase):
         self.assertGreater(len(body), 0)
 
 
+class TestDashboardCache(unittest.TestCase):
+    def _get_raw(self, headers):
+        req = urllib.request.Request(BASE + "/dashboard", headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=5) as r:
+                return r.status, r.read(), r.headers
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers
+
+    def test_dashboard_is_rendered_from_live_state(self):
+        _, body, _ = _get("/dashboard")
+        self.assertIn("Agent Budget Guard", body)
+        self.assertIn("Window Spend", body)
+
+    def test_dashboard_is_gzipped_when_accepted(self):
+        import gzip
+        status, plain, headers = self._get_raw({})
+        self.assertIsNone(headers.get("Content-Encoding"))
+        status, packed, headers = self._get_raw({"Accept-Encoding": "gzip"})
+        self.assertEqual(status, 200)
+        self.assertEqual(headers.get("Content-Encoding"), "gzip")
+        self.assertEqual(gzip.decompress(packed), plain)
+        status, body, _ = self._get_raw({"Accept-Encoding": "gzip", "If-None-Match": headers["ETag"]})
+        self.assertEqual((status, body), (304, b""))
+
+    def test_dashboard_file_follows_spend_without_requests(self):
+        import tempfile
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "dashboard.md")
+        api_server._start_dashboard_mirror(path)
+        self.addCleanup(api_server._stop_dashboard_mirror, 5)
+        self.assertTrue(api_server._dashboard_writer.flush(5))
+        with open(path) as f:
+            before = f.read()
+        with api_server._lock:
+            api_server._guard.breaker.track_usage(cost=0.0123)
+        deadline = time.time() + 5
+        after = before
+        while after == before and time.time() < deadline:
+            time.sleep(0.05)
+            with open(path) as f:
+                after = f.read()
+        self.assertNotEqual(after, before)
+        self.assertIn("Agent Budget Guard", after)
+
+
+@unittest.skipIf(api_server.USING_FLASK, "stdlib server only")
+class TestEvents(unittest.TestCase):
+    def _read_event(self, response):
+        fields = {}
+        while True:
+            line = response.fp.readline().decode().rstrip("\n")
+            if not line:
+                if fields:
+                    return fields["event"], json.loads(fields["data"])
+                continue
+            if not line.startswith(":"):
+                name, _, value = line.partition(": ")
+                fields[name] = value
+
+    def test_events_stream_spend_as_it_is_recorded(self):
+        conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=5)
+        self.addCleanup(conn.close)
+        conn.request("GET", "/events")
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Type"), "text/event-stream")
+        event, baseline = self._read_event(response)
+        self.assertEqual(event, "spend")
+        _post_json("/record", {"cost": 0.003, "input_tokens": 40})
+        event, data = self._read_event(response)
+        self.assertEqual(event, "spend")
+        self.assertAlmostEqual(data["spend_delta_usd"], 0.003)
+        self.assertEqual(data["tokens_delta"], 40)
+        self.assertAlmostEqual(data["window_cost"], baseline["window_cost"] + 0.003)
+
+
 class TestReset(unittest.TestCase):
     def test_reset_returns_state(self):
         status, body, ct = _post("/reset")
@@ -165,6 +357,156 @@ class TestNotFound(unittest.TestCase):
             self.assertEqual(e.code, 404)
 
 
+@unittest.skipIf(api_server.USING_FLASK, "stdlib server only")
+class TestConcurrentServer(unittest.TestCase):
+    def test_keep_alive_reuses_the_connection(self):
+        conn = http.client.HTTPConnection("127.0.0.1", PORT, timeout=5)
+        self.addCleanup(conn.close)
+        conn.request("GET", "/status")
+        first = conn.getresponse()
+        first.read()
+        self.assertEqual(first.version, 11)
+        sock = conn.sock
+        conn.request("POST", "/reset", body=b"{}")
+        second = conn.getresponse()
+        self.assertTrue(json.loads(second.read())["reset"])
+        conn.request("GET", "/health")
+        conn.getresponse().read()
+        self.assertIs(conn.sock, sock)
+
+    def test_slow_dashboard_does_not_stall_status(self):
+        original = api_server._dashboard_snapshot
+        started = threading.Event()
+
+        class SlowDashboard:
+            def get(self):
+                started.set()
+                time.sleep(0.5)
+                return original.get()
+
+        api_server._dashboard_snapshot = SlowDashboard()
+        self.addCleanup(setattr, api_server, "_dashboard_snapshot", original)
+        reader = threading.Thread(target=_get, args=("/dashboard",))
+        reader.start()
+        self.addCleanup(reader.join)
+        started.wait(5)
+        start = time.monotonic()
+        status, _, _ = _get("/status")
+        self.assertEqual(status, 200)
+        self.assertLess(time.monotonic() - start, 0.4)
+
+
+class TestAdmission(unittest.TestCase):
+    MODEL = "claude-sonnet-4-6"
+
+    def setUp(self):
+        from circuit_breaker import CircuitBreaker
+        saved = api_server._guard.breaker
+        self.breaker = api_server._guard.breaker = api_server._breaker = CircuitBreaker(cost_limit=1.0)
+
+        def restore():
+            api_server._guard.breaker = api_server._breaker = saved
+        self.addCleanup(restore)
+
+    def test_check_by_cost_and_by_tokens(self):
+        status, data = _post_json("/check", {"estimated_cost": 0.01, "reserve": False})
+        self.assertEqual(status, 200)
+        self.assertEqual(data["status"], "ok")
+        _, data = _post_json("/check", {"model": self.MODEL, "input_tokens": 1000, "output_tokens": 100,
+                                        "reserve": False})
+        self.assertAlmostEqual(data["estimated_cost"], api_server._guard.estimate_cost(self.MODEL, 1000, 100))
+        self.assertAlmostEqual(sum(c for _, c in self.breaker.cost_events), 0.01 + data["estimated_cost"])
+
+    def test_check_over_the_per_request_limit_is_blocked(self):
+        _, data = _post_json("/check", {"estimated_cost": 0.20, "context": "routine"})
+        self.assertEqual(data["status"], "blocked")
+        self.assertEqual(self.breaker.cost_failures, 1)
+
+    def test_check_then_record_counts_the_call_once(self):
+        _, data = _post_json("/check", {"estimated_cost": 0.05, "context": "high_roi"})
+        self.assertEqual(self.breaker.summary()["window_cost"], 0.0)
+        self.assertAlmostEqual(self.breaker.summary()["reserved_cost"], 0.05)
+        _post_json("/record", {"reservation_id": data["reservation_id"], "cost": 0.03})
+        summary = self.breaker.summary()
+        self.assertAlmostEqual(summary["window_cost"], 0.03)
+        self.assertEqual(summary["reserved_cost"], 0.0)
+
+    def test_reservation_is_settled_by_record(self):
+        _, data = _post_json("/check", {"model": self.MODEL, "input_tokens": 1000, "output_tokens": 500})
+        reservation_id = data["reservation_id"]
+        self.assertIn(reservation_id, self.breaker.reservations)
+        status, data = _post_json("/record", {"reservation_id": reservation_id, "model": self.MODEL,
+                                              "input_tokens": 1000, "output_tokens": 50})
+        self.assertEqual(status, 200)
+        self.assertTrue(data["within_limits"])
+        self.assertEqual(self.breaker.reservations, {})
+        self.assertAlmostEqual(sum(c for _, c in self.breaker.cost_events),
+                               api_server._guard.estimate_cost(self.MODEL, 1000, 50))
+
+    def test_failed_call_releases_its_reservation(self):
+        _, data = _post_json("/check", {"estimated_cost": 0.01})
+        _, released = _post_json("/record", {"reservation_id": data["reservation_id"], "release": True})
+        self.assertEqual(released, {"released": True})
+        self.assertEqual(self.breaker.reservations, {})
+        self.assertEqual(len(self.breaker.cost_events), 0)
+
+    def test_bad_requests_are_rejected(self):
+        self.assertEqual(_post_json("/check", b"{not json")[0], 400)
+        self.assertEqual(_post_json("/check", {"model": "no-such-model", "input_tokens": 10})[0], 400)
+        status, data = _post_json("/record", {"cost": -1})
+        self.assertEqual(status, 400)
+        self.assertIn("cost", data["error"])
+        for bad in (b'{"cost": NaN}', b'{"cost": Infinity}', b'{"input_tokens": -Infinity, "cost": 0.01}'):
+            self.assertEqual(_post_json("/record", bad)[0], 400, bad)
+        self.assertEqual(_post_json("/check", b'{"estimated_cost": 1e999}')[0], 400)
+        self.assertEqual(_post_json("/check", {"estimated_cost": 0.01, "context": ["routine"]})[0], 400)
+        self.assertEqual(_post_json("/check", {"model": ["x"], "input_tokens": 10})[0], 400)
+        self.assertEqual(_post_json("/record", {"cost": 0.01, "model": {"name": "x"}})[0], 400)
+        self.assertEqual(_post_json("/record", {"cost": 0.01, "reservation_id": "1"})[0], 400)
+        self.assertEqual(_post_json("/record", {"cost": 0.01, "reservation_id": True})[0], 400)
+        self.assertEqual(_post_json("/check", {"estimated_cost": 0.01, "reserve": "false"})[0], 400)
+        for messages in (["hi"], [{"role": "user"}], [{"role": "user", "content": ["hi"]}], "hi"):
+            self.assertEqual(_post_json("/check", {"model": self.MODEL, "messages": messages})[0], 400)
+        self.assertEqual(self.breaker.summary()["window_cost"], 0.0)
+        self.assertEqual(self.breaker.reservations, {})
+
+    def test_bulk_ingest_applies_every_line(self):
+        events = [{"model": self.MODEL, "input_tokens": 1000, "output_tokens": 100},
+                  {"cost": 0.02, "input_tokens": 10},
+                  {"model": self.MODEL, "input_tokens": 2000}]
+        body = "\n".join(json.dumps(e) for e in events[:2]) + "\n\n" + json.dumps(events[2]) + "\n"
+        status, data = _post_json("/record/bulk", body.encode())
+        self.assertEqual(status, 200)
+        self.assertEqual(data["recorded"], 3)
+        expected = (api_server._guard.estimate_cost(self.MODEL, 1000, 100) + 0.02
+                    + api_server._guard.estimate_cost(self.MODEL, 2000, 0))
+        self.assertAlmostEqual(data["cost"], expected)
+        self.assertAlmostEqual(sum(c for _, c in self.breaker.cost_events), expected)
+        self.assertEqual(sum(t for _, t in self.breaker.token_events), 3110)
+
+    def test_bulk_ingest_rejects_the_body_on_any_bad_line(self):
+        good = json.dumps({"cost": 0.02})
+        for bad in ("{oops", '"not an object"', '{"cost": 0.01, "reservation_id": [1]}',
+                    '{"reservation_id": "7", "release": true}', '{"cost": 0.01, "is_batch": "false"}'):
+            status, data = _post_json("/record/bulk", f"{good}\n{bad}\n{good}\n".encode())
+            self.assertEqual(status, 400, bad)
+            self.assertTrue(data["error"].startswith("line 2:"), data)
+        self.assertEqual(len(self.breaker.cost_events), 0)
+
+    def test_bulk_ingest_reports_a_window_overrun(self):
+        body = "\n".join(json.dumps({"cost": 0.4}) for _ in range(3)).encode()
+        _, data = _post_json("/record/bulk", body)
+        self.assertEqual(data["recorded"], 3)
+        self.assertFalse(data["within_limits"])
+
+    @unittest.skipUnless(_encoding_available(), "tiktoken encoding not available")
+    def test_check_runs_the_preflight_for_messages(self):
+        _, data = _post_json("/check", {"model": self.MODEL, "context": "high_roi",
+                                        "messages": [{"role": "user", "content": "Summarize the report."}]})
+        self.assertEqual(data["status"], "ok")
+        self.assertIn("optimized_messages", data)
+
+
 class TestBusinessLogic(unittest.TestCase):
     def test_get_status_data_structure(self):
         data = api_server._get_status_data()
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import tempfile
+import unittest
+from unittest import mock
+from fake_provider import FakeProviderServer
+from http_transport import HTTPTransport, TransportResponse
+from llm_client import LLMClient
+from cost_calculator import BudgetGuard
+from circuit_breaker import CircuitBreaker
+from batch_queue import BatchQueue
+
+MODEL = "gemini-2.5-flash"  # 50% batch discount
+
+
+class TestBatchQueue(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeProviderServer(batch_delay=0.1)
+        self.url = self.server.start()
+        self.addCleanup(self.server.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        config_path = os.path.join(self.tmp.name, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({"api_keys": {"FAKE": ["key-1"]}}, f)
+        self.guard = BudgetGuard()
+        self.guard.breaker = CircuitBreaker(cost_limit=1.0)
+        self.client = LLMClient("FAKE", config_path, guard=self.guard, transport=HTTPTransport(self.url),
+                                coalesce=False, max_tokens=100)
+        self.addCleanup(self.client.api_key_manager.flush_state, 5)
+
+    def queue(self, **kwargs):
+        kwargs.setdefault("poll_interval", 0.02)
+        queue = BatchQueue(self.client, **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+    def test_full_group_is_submitted_as_one_job(self):
+        queue = self.queue(max_batch_size=3, max_age_seconds=60)
+        futures = [queue.submit(f"Label sample {i}.", MODEL) for i in range(3)]
+        results = [f.result(timeout=5) for f in futures]
+        self.assertEqual({r["status"] for r in results}, {"success"})
+        self.assertEqual(len({r["batch_id"] for r in results}), 1)
+        self.assertEqual(len(self.server.batches), 1)
+        self.assertEqual(results[0]["response"], f"Fake reply from {MODEL}.")
+
+    def test_partial_group_is_flushed_by_age(self):
+        queue = self.queue(max_batch_size=50, max_age_seconds=0.1)
+        start = time.monotonic()
+        result = queue.submit("Label one sample.", MODEL).result(timeout=5)
+        self.assertEqual(result["status"], "success")
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(queue.stats()["jobs_submitted"], 1)
+
+    def test_cost_is_committed_at_the_batch_rate(self):
+        queue = self.queue(max_batch_size=2, max_age_seconds=60)
+        futures = [queue.submit("Summarize the experiment log.", MODEL) for _ in range(2)]
+        results = [f.result(timeout=5) for f in futures]
+        usage = results[0]["usage"]
+        full = self.guard.estimate_cost(MODEL, usage["input_tokens"], usage["output_tokens"])
+        self.assertAlmostEqual(results[0]["cost"], full / 2)
+        self.assertEqual(self.guard.breaker.reservations, {})
+        self.assertAlmostEqual(sum(c for _, c in self.guard.breaker.cost_events), full)
+        self.assertAlmostEqual(queue.stats()["saved_usd"], full)
+
+    def test_models_are_batched_separately(self):
+        queue = self.queue(max_batch_size=50, max_age_seconds=60)
+        futures = [queue.submit("Classify.", MODEL), queue.submit("Classify.", "deepseek-v3")]
+        queue.flush()
+        results = [f.result(timeout=5) for f in futures]
+        self.assertNotEqual(results[0]["batch_id"], results[1]["batch_id"])
+
+    def test_over_budget_submission_is_blocked_immediately(self):
+        self.guard.breaker.track_usage(cost=1.0)
+        queue = self.queue()
+        result = queue.submit("Label one sample.", MODEL).result(timeout=1)
+        self.assertEqual(result["status"], "blocked")
+        self.assertEqual(queue.stats()["queued"], 0)
+
+    def test_only_batchable_contexts_are_accepted(self):
+        queue = self.queue()
+        with self.assertRaises(ValueError):
+            queue.submit("Answer the customer.", MODEL, context="high_roi")
+
+    def test_malformed_submit_reply_fails_the_batch_not_the_worker(self):
+        queue = self.queue(max_batch_size=1)
+        for body in (b"<html>bad gateway</html>", b'{"type": "error"}'):
+            with mock.patch.object(self.client.transport, "post_json",
+                                   return_value=TransportResponse(200, {}, body)):
+                result = queue.submit("Label one sample.", MODEL).result(timeout=5)
+            self.assertEqual(result["status"], "error")
+            self.assertIn("Batch submission failed", result["message"])
+        self.assertEqual(self.guard.breaker.reservations, {})
+        self.assertEqual(queue.submit("Label one sample.", MODEL).result(timeout=5)["status"], "success")
+
+    def test_anthropic_client_uses_message_batches(self):
+        self.client.provider = "anthropic"
+        queue = self.queue(max_batch_size=2)
+        futures = [queue.submit("Label sample.", "claude-sonnet-4-6") for _ in range(2)]
+        results = [f.result(timeout=5) for f in futures]
+        self.assertEqual({r["status"] for r in results}, {"success"})
+        self.assertTrue(results[0]["batch_id"].startswith("msgbatch_"))
+        self.assertEqual(self.server.files, {})
+
+    def test_openai_client_uploads_a_jsonl_file(self):
+        queue = self.queue(max_batch_size=2)
+        futures = [queue.submit(f"Label sample {i}.", MODEL) for i in range(2)]
+        results = [f.result(timeout=5) for f in futures]
+        self.assertTrue(results[0]["batch_id"].startswith("batch_"))
+        [upload] = self.server.files.values()
+        lines = [json.loads(line) for line in upload.decode().splitlines()]
+        self.assertEqual([line["url"] for line in lines], ["/v1/chat/completions"] * 2)
+        self.assertEqual(lines[1]["body"]["messages"][-1]["content"], "Label sample 1.")
+
+    def test_malformed_result_lines_fail_only_their_requests(self):
+        self.client.provider = "anthropic"
+        queue = self.queue(max_batch_size=4)
+        results = "\n".join([
+            '{"custom_id": "req_1", "result": {"type": "succeeded"}}',
+            'not json',
+            '{"custom_id": "req_3", "result": {"type": "succeeded", "message": '
+            '{"content": [{"type": "text", "text": "ok"}], "usage": {"input_tokens": 5, "output_tokens": 2}}}}',
+            '{"custom_id": "req_4", "result": {"type": "succeeded", "message": "not a dict"}}',
+        ]).encode()
+        request = self.client.transport.request
+
+        def fetch(method, path, *args, **kwargs):
+            if path == "/results":
+                return TransportResponse(200, {}, results)
+            return request(method, path, *args, **kwargs)
+
+        with mock.patch.object(queue, "_result_paths", return_value=["/results"]), \
+                mock.patch.object(self.client.transport, "request", side_effect=fetch):
+            futures = [queue.submit(f"Label sample {i}.", "claude-sonnet-4-6") for i in range(4)]
+            outcomes = [f.result(timeout=5) for f in futures]
+        self.assertEqual([r["status"] for r in outcomes], ["error", "error", "success", "error"])
+        self.assertIn("Malformed batch result", outcomes[0]["message"])
+        self.assertIn("returned no result", outcomes[1]["message"])
+        self.assertEqual(self.guard.breaker.reservations, {})
+
+    def test_providers_without_a_batch_api_are_rejected(self):
+        self.client.provider = "cohere"
+        with self.assertRaises(ValueError):
+            BatchQueue(self.client)
+
+    def test_cooling_keys_do_not_stall_polling(self):
+        queue = self.queue(max_batch_size=1)
+        first = queue.submit("Label sample.", MODEL)
+        time.sleep(0.05)  # submitted; now polling
+        self.client.api_key_manager.mark_rate_limited("key-1", retry_after=0.6)
+        second = queue.submit("Label another sample.", MODEL)
+        start = time.monotonic()
+        self.assertEqual(first.result(timeout=5)["status"], "success")
+        self.assertLess(time.monotonic() - start, 0.5)  # polled while the key cooled
+        self.assertEqual(second.result(timeout=5)["status"], "success")
+        self.assertGreaterEqual(time.monotonic() - start, 0.5)
+
+    def test_close_flushes_and_waits_for_results(self):
+        queue = self.queue(max_batch_size=50, max_age_seconds=60)
+        future = queue.submit("Label one sample.", MODEL)
+        queue.close()
+        self.assertTrue(future.done())
+        self.assertEqual(future.result()["status"], "success")
+        with self.assertRaises(RuntimeError):
+            queue.submit("Too late.", MODEL)
+
+
+if __name__ == "__main__":
+    unittest.main()
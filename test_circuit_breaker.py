@@ -126,5 +126,87 @@ class TestCircuitBreaker(unittest.TestCase):
         self.assertFalse(cb.track_usage(tokens=101)) # Fail again in HALF_OPEN
         self.assertEqual(cb.state, "OPEN")
 
+    def test_would_exceed_is_read_only(self):
+        cb = CircuitBreaker(cost_limit=1.0, cost_window_seconds=10, token_velocity_limit=100)
+        cb.track_usage(tokens=60, cost=0.6)
+        self.assertFalse(cb.would_exceed(cost=0.4))
+        self.assertTrue(cb.would_exceed(cost=0.5))
+        self.assertTrue(cb.would_exceed(tokens=50))
+        self.assertEqual(len(cb.cost_events), 1)
+        self.assertEqual(cb.cost_failures, 0)
+        self.advance_time(11)
+        self.assertFalse(cb.would_exceed(cost=0.9))
+
+    def test_reservations_count_until_committed(self):
+        cb = CircuitBreaker(cost_limit=1.0, cost_window_seconds=10, cost_failure_threshold=3)
+        first = cb.reserve(cost=0.7)
+        self.assertIsNotNone(first)
+        # A concurrent caller sees the in-flight hold
+        self.assertTrue(cb.would_exceed(cost=0.4))
+        self.assertIsNone(cb.reserve(cost=0.4))
+        self.assertEqual(cb.cost_failures, 1)
+        # The call came in cheaper than estimated: only the actual cost stays
+        self.assertTrue(cb.commit(first, cost=0.2))
+        self.assertEqual(cb.reservations, {})
+        self.assertEqual([c for _, c in cb.cost_events], [0.2])
+        self.assertIsNotNone(cb.reserve(cost=0.7))
+
+    def test_release_and_timeout_free_reservations(self):
+        cb = CircuitBreaker(cost_limit=1.0, reservation_timeout=30)
+        held = cb.reserve(cost=0.9)
+        self.assertTrue(cb.release(held))
+        self.assertFalse(cb.release(held))
+        self.assertEqual(cb.reserved(), (0, 0))
+
+        cb.reserve(cost=0.9, tokens=10)
+        self.assertTrue(cb.would_exceed(cost=0.2))
+        self.advance_time(31)
+        self.assertFalse(cb.would_exceed(cost=0.2))
+        # would_exceed is read-only; reserved() drops the lapsed hold
+        self.assertEqual(cb.reserved(), (0, 0))
+        self.assertEqual(cb.reservations, {})
+        self.assertEqual(len(cb.cost_events), 0)
+
+    def test_extend_grows_a_hold_within_limits(self):
+        cb = CircuitBreaker(cost_limit=1.0, token_velocity_limit=1000)
+        cb.track_usage(cost=0.3)
+        held = cb.reserve(cost=0.1, tokens=100)
+        self.assertTrue(cb.extend(held, cost=0.6, tokens=500))
+        self.assertEqual(cb.reserved(), (0.6, 500))
+        # 0.3 spent + 0.8 held would cross the $1 window
+        self.assertFalse(cb.extend(held, cost=0.8, tokens=500))
+        self.assertFalse(cb.extend(held, cost=0.6, tokens=1200))
+        self.assertEqual(cb.reserved(), (0.6, 500))
+        self.assertEqual(cb.cost_failures, 0)
+        self.assertFalse(cb.extend(999, cost=0.1))
+
+    def test_summary_is_read_only_and_knows_when_it_goes_stale(self):
+        cb = CircuitBreaker(cost_limit=1.0, cost_window_seconds=10, token_window_seconds=60,
+                            reservation_timeout=30, cost_failure_threshold=1, recovery_timeout=100)
+        cb.track_usage(cost=0.2, tokens=100)
+        self.advance_time(5)
+        cb.track_usage(cost=0.3)
+        cb.reserve(cost=0.1, tokens=50)
+        summary = cb.summary()
+        self.assertAlmostEqual(summary["window_cost"], 0.5)
+        self.assertEqual(summary["reserved_tokens"], 50)
+        self.assertEqual(summary["stable_until"], 10)  # the first cost event ages out
+
+        self.advance_time(6)
+        version = cb.version
+        summary = cb.summary()
+        self.assertAlmostEqual(summary["window_cost"], 0.3)
+        self.assertEqual(summary["window_tokens"], 100)
+        self.assertEqual(summary["stable_until"], 15)
+        self.assertEqual(len(cb.cost_events), 2)  # nothing evicted
+        self.assertEqual(cb.version, version)
+
+        cb.track_usage(cost=0.9)  # trips the circuit
+        self.assertGreater(cb.version, version)
+        summary = cb.summary()
+        self.assertEqual(summary["state"], "OPEN")
+        self.assertEqual(cb.summary(now=self.initial_time + 101)["state"], "HALF_OPEN")
+        self.assertEqual(cb.state, "OPEN")
+
 if __name__ == '__main__':
     unittest.main()
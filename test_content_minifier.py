@@ -0,0 +1,60 @@
+import json
+import unittest
+from content_minifier import minify_code, minify_content, split_segments
+
+
+def _char_count(text):
+    return len(text)
+
+
+class TestSplitSegments(unittest.TestCase):
+    def test_plain_prose_matches_whitespace_collapse(self):
+        self.assertEqual(minify_content("  Hello   there,\n\n  agent. "), "Hello there, agent.")
+
+    def test_segment_types(self):
+        text = 'Result:\n{"a": 1}\n```py\nx = 1\n```\n| a | b |\n| 1 | 2 |\nDone.'
+        kinds = [kind for kind, _, _ in split_segments(text)]
+        self.assertEqual(kinds, ["prose", "json", "code", "table", "prose"])
+
+    def test_bracketed_prose_is_not_json(self):
+        kinds = [kind for kind, _, _ in split_segments("[1] see the appendix\n{not json}")]
+        self.assertEqual(kinds, ["prose"])
+
+
+class TestMinifyContent(unittest.TestCase):
+    def test_json_is_compacted_and_equivalent(self):
+        original = {"items": [{"id": 1, "name": "a b"}, {"id": 2, "name": "ü"}]}
+        text = "Tool output:\n" + json.dumps(original, indent=4)
+        minified = minify_content(text)
+        body = minified.split("\n", 1)[1]
+        self.assertEqual(json.loads(body), original)
+        self.assertNotIn(" ", body.replace("a b", ""))
+
+    def test_fenced_json(self):
+        minified = minify_content('```json\n{\n  "k": [1, 2]\n}\n```')
+        self.assertEqual(minified, '```json\n{"k":[1,2]}\n```')
+
+    def test_code_keeps_indentation_and_strings(self):
+        code = 'def f():\n\n    # helper\n    s = """\n    # kept\n\n    """\n    return s  # inline\n'
+        self.assertEqual(
+            minify_code(code, "python"),
+            'def f():\n    s = """\n    # kept\n\n    """\n    return s  # inline',
+        )
+
+    def test_unknown_language_keeps_lines(self):
+        self.assertEqual(minify_code("a:\n\n  # b   \n", "yaml"), "a:\n\n  # b")
+
+    def test_table_padding_removed(self):
+        text = "| name   | value |\n|--------|-------|\n| x      | 1     |"
+        self.assertEqual(minify_content(text), "|name|value|\n|---|---|\n|x|1|")
+
+    def test_savings_reported_per_type(self):
+        savings = {}
+        text = 'Look:   here\n{\n  "a": 1\n}\n```js\n// c\nlet a = 1;\n\n```'
+        minify_content(text, _char_count, savings)
+        self.assertEqual(set(savings), {"prose", "json", "code"})
+        self.assertTrue(all(v > 0 for v in savings.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -29,6 +29,8 @@ from dashboard_updater import (
     spend_velocity,
     estimated_daily_cost,
     write_log,
+    write_dashboard,
+    DashboardWriter,
 )
 
 
@@ -76,6 +78,12 @@ class TestDashboardMarkdown(unittest.TestCase):
         import re
         self.assertRegex(result, r'\d{4}-\d{2}-\d{2}')
 
+    def test_dashboard_shows_cache_savings(self):
+        self.guard.record_cache_hit("claude-sonnet-4-6", input_tokens=10_000, output_tokens=1_000)
+        result = generate_dashboard(self.guard)
+        self.assertIn("Response Cache", result)
+        self.assertIn("| **Saved Spend** | $0.0450 |", result)
+
     def test_dashboard_has_model_pricing(self):
         result = generate_dashboard(self.guard)
         self.assertIn("$/1M", result)
@@ -288,6 +296,39 @@ class TestGracefulHandling(unittest.TestCase):
             self.assertTrue(os.path.isfile(log_path))
 
 
+# ─── Writing ──────────────────────────────────────────────────────────────────
+
+class TestDashboardFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "dashboard.md")
+
+    def test_write_dashboard_replaces_the_file_atomically(self):
+        write_dashboard(self.path, "# old\n")
+        write_dashboard(self.path, "# new\n")
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "# new\n")
+        self.assertEqual(os.listdir(self.tmp), ["dashboard.md"])
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+    def test_writer_writes_the_latest_submission_in_the_background(self):
+        writer = DashboardWriter(self.path)
+        for i in range(20):
+            writer.submit(f"# version {i}\n".encode())
+        self.assertTrue(writer.flush(timeout=5))
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "# version 19\n")
+        self.assertLessEqual(writer.writes, 20)
+
+    def test_rendering_from_a_summary_leaves_the_breaker_untouched(self):
+        guard = make_guard()
+        guard.breaker.cost_events.append((time.time() - 7200, 0.5))  # outside the window
+        md = generate_dashboard(guard, guard.breaker.summary())
+        self.assertIn("$0.0000", md)
+        self.assertEqual(len(guard.breaker.cost_events), 1)
+
+
 # ─── Helper Tests ─────────────────────────────────────────────────────────────
 
 class TestHelpers(unittest.TestCase):
@@ -0,0 +1,96 @@
+import json
+import time
+import unittest
+from cost_calculator import BudgetGuard
+from circuit_breaker import CircuitBreaker
+from event_stream import EventHub, format_sse, stream_messages, KEEPALIVE
+
+
+def parse(message):
+    """[(event, data)] from one or more encoded SSE messages."""
+    events = []
+    for block in message.decode().strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class TestEventHub(unittest.TestCase):
+    def setUp(self):
+        self.guard = BudgetGuard()
+        self.guard.breaker = CircuitBreaker(cost_limit=1.0, cost_failure_threshold=1)
+        self.hub = EventHub(self.guard, max_rate=5.0, poll_interval=0.01)
+        self.addCleanup(self.hub.close)
+
+    def next_events(self, subscriber, timeout=2.0):
+        message = subscriber.get(timeout)
+        self.assertIsNotNone(message, "no event arrived")
+        return parse(message)
+
+    def test_format_sse(self):
+        self.assertEqual(format_sse("spend", {"a": 1}, 7), b'event: spend\nid: 7\ndata: {"a":1}\n\n')
+
+    def test_subscriber_starts_with_current_totals(self):
+        self.guard.breaker.track_usage(cost=0.25)
+        subscriber = self.hub.subscribe()
+        [(event, data)] = self.next_events(subscriber)
+        self.assertEqual(event, "spend")
+        self.assertEqual(data["window_cost"], 0.25)
+        self.assertEqual(data["spend_delta_usd"], 0.0)
+
+    def test_burst_is_coalesced_into_one_update(self):
+        subscriber = self.hub.subscribe()
+        self.next_events(subscriber)
+        time.sleep(0.05)
+        for _ in range(10):
+            self.guard.check_budget(0.01, "routine")
+        [(event, data)] = self.next_events(subscriber)
+        self.assertEqual(event, "spend")
+        self.assertAlmostEqual(data["spend_delta_usd"], 0.10)
+        self.assertAlmostEqual(data["window_cost"], 0.10)
+        self.assertIsNone(subscriber.get(0.3))  # nothing more happened
+
+    def test_blocks_and_breaker_transitions_are_reported(self):
+        subscriber = self.hub.subscribe()
+        self.next_events(subscriber)
+        self.guard.check_budget(0.04, "routine")
+        self.guard.check_budget(2.0, "high_roi")  # over the $1 window: blocked, circuit opens
+        events = []
+        while not any(event == "breaker" for event, _ in events):
+            events += self.next_events(subscriber)
+        kinds = dict(events)
+        self.assertEqual(kinds["block"]["count"], 1)
+        self.assertIn("Request blocked", kinds["block"]["message"])
+        self.assertEqual((kinds["breaker"]["from"], kinds["breaker"]["to"]), ("CLOSED", "OPEN"))
+        self.assertEqual(kinds["spend"]["state"], "OPEN")
+
+    def test_slow_consumer_is_dropped_without_blocking_others(self):
+        hub = EventHub(self.guard, max_rate=50.0, queue_size=2, poll_interval=0.01)
+        self.addCleanup(hub.close)
+        slow, fast = hub.subscribe(), hub.subscribe()
+        fast.get(1)
+        received = 0
+        for _ in range(4):
+            self.guard.breaker.track_usage(cost=0.01)
+            if fast.get(1) is not None:
+                received += 1
+        self.assertEqual(received, 4)
+        self.assertTrue(slow.dropped)
+        self.assertEqual(hub.stats(), {"subscribers": 1, "messages_sent": 4, "subscribers_dropped": 1})
+        self.assertEqual(list(stream_messages(hub, slow)), [])
+
+    def test_keepalive_and_subscriber_limit(self):
+        hub = EventHub(self.guard, max_subscribers=1, keepalive=0.05)
+        self.addCleanup(hub.close)
+        subscriber = hub.subscribe()
+        self.assertIsNone(hub.subscribe())
+        messages = stream_messages(hub, subscriber)
+        next(messages)  # current totals
+        self.assertEqual(next(messages), KEEPALIVE)
+        messages.close()
+        self.assertEqual(hub.stats()["subscribers"], 0)
+        self.assertIsNotNone(hub.subscribe())
+
+
+if __name__ == "__main__":
+    unittest.main()
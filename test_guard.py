@@ -1,6 +1,8 @@
 import unittest
 from unittest.mock import patch
 import time
+import asyncio
+import threading
 from cost_calculator import BudgetGuard
 from circuit_breaker import CircuitBreaker # Import the external CircuitBreaker
 
@@ -100,5 +102,87 @@ class TestBudgetGuard(unittest.TestCase):
         self.assertIn("Circuit is now OPEN", msg4)
         self.assertEqual(self.guard.breaker.check_state(), "OPEN") # Should go back to OPEN
 
+class TestReserveCommit(unittest.TestCase):
+    def setUp(self):
+        self.guard = BudgetGuard()
+        self.guard.breaker = CircuitBreaker(cost_limit=0.1, cost_window_seconds=300)
+
+    def test_commit_replaces_estimate_with_actual_cost(self):
+        ok, msg, reservation = self.guard.reserve_budget(0.04, "routine")
+        self.assertTrue(ok)
+        self.assertEqual(self.guard.breaker.reserved()[0], 0.04)
+        self.assertEqual(len(self.guard.breaker.cost_events), 0)
+        self.assertTrue(self.guard.commit_usage(reservation, 0.01, input_tokens=200, output_tokens=50))
+        self.assertEqual(self.guard.breaker.reserved(), (0, 0))
+        self.assertEqual([c for _, c in self.guard.breaker.cost_events], [0.01])
+        self.assertEqual([t for _, t in self.guard.breaker.token_events], [250])
+
+    def test_release_frees_window_capacity(self):
+        reservations = [self.guard.reserve_budget(0.04, "routine")[2] for _ in range(2)]
+        ok, _, reservation = self.guard.reserve_budget(0.04, "routine")
+        self.assertFalse(ok)
+        self.assertIsNone(reservation)
+        self.assertTrue(self.guard.release_reservation(reservations[0]))
+        self.assertTrue(self.guard.reserve_budget(0.04, "routine")[0])
+
+    def test_per_request_limit_does_not_hold_a_reservation(self):
+        ok, msg, reservation = self.guard.reserve_budget(0.06, "routine")
+        self.assertFalse(ok)
+        self.assertIsNone(reservation)
+        self.assertEqual(self.guard.breaker.reservations, {})
+
+    def test_cache_hit_is_free_and_counts_saved_spend(self):
+        saved = self.guard.record_cache_hit("claude-sonnet-4-6", input_tokens=1_000_000, output_tokens=0)
+        self.assertAlmostEqual(saved, 3.00)
+        self.assertEqual(len(self.guard.breaker.cost_events), 0)
+        self.assertEqual(self.guard.get_cache_savings(), {"hits": 1, "saved_usd": 3.00})
+
+
+class TestAsyncBudgetGuard(unittest.TestCase):
+    def setUp(self):
+        self.guard = BudgetGuard()
+        self.guard.breaker = CircuitBreaker()
+
+    def test_check_budget_async_matches_sync(self):
+        ok, msg = asyncio.run(self.guard.check_budget_async(0.04, "routine"))
+        self.assertTrue(ok)
+        self.assertEqual(msg, "Budget OK.")
+        ok, msg = asyncio.run(self.guard.check_budget_async(0.06, "routine"))
+        self.assertFalse(ok)
+        self.assertEqual(self.guard.breaker.cost_failures, 1)
+
+    def test_check_budget_async_waits_off_loop_when_lock_is_held(self):
+        held, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with self.guard.lock:
+                held.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        held.wait(5)
+
+        async def scenario():
+            check = asyncio.create_task(self.guard.check_budget_async(0.01, "routine"))
+            ticks = 0
+            while not check.done():
+                ticks += 1
+                if ticks == 3:
+                    release.set()
+                await asyncio.sleep(0.01)
+            return ticks, check.result()
+
+        ticks, (ok, _) = asyncio.run(scenario())
+        holder.join()
+        self.assertTrue(ok)
+        self.assertGreaterEqual(ticks, 3) # the loop kept running while the lock was held
+
+    def test_notifications_do_not_block(self):
+        with patch("cost_calculator._dispatch_notification") as dispatch:
+            ok, _ = self.guard.check_budget(0.06, "routine")
+        self.assertFalse(ok)
+        dispatch.assert_called_once()
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+import unittest
+from fake_provider import FakeProviderServer
+from http_transport import HTTPTransport, AsyncHTTPTransport
+from llm_client import LLMClient
+from cost_calculator import BudgetGuard
+from circuit_breaker import CircuitBreaker
+from hedging import HedgePolicy
+
+MODEL = "claude-sonnet-4-6"
+PROMPT = "Extract the invoice total."
+
+
+class TestHedgePolicy(unittest.TestCase):
+    def setUp(self):
+        self.guard = BudgetGuard()
+        self.guard.breaker = CircuitBreaker(cost_limit=1.0)
+
+    def test_delay_is_learned_per_model(self):
+        policy = HedgePolicy(min_samples=20)
+        for i in range(19):
+            policy.observe(MODEL, 0.1 + i / 1000)
+        self.assertIsNone(policy.delay(MODEL))
+        for _ in range(30):
+            policy.observe(MODEL, 0.1)
+        policy.observe(MODEL, 5.0)
+        self.assertLess(policy.delay(MODEL), 1.0)
+        self.assertIsNone(policy.delay("other-model"))
+
+    def test_hedge_spend_is_capped_and_held_in_the_breaker(self):
+        policy = HedgePolicy(budget_fraction=0.05)  # $0.05 of the $1 window
+        plan = policy.reserve(self.guard, MODEL, (), 10_000, 1_000)  # $0.045
+        self.assertIsNotNone(plan)
+        self.assertAlmostEqual(self.guard.breaker.reserved()[0], 0.045)
+        self.assertIsNone(policy.reserve(self.guard, MODEL, (), 10_000, 1_000))
+        self.assertEqual(policy.stats()["skipped_over_budget"], 1)
+
+        policy.settle(self.guard, plan, 0.01, 2_000, 200)
+        self.assertEqual(self.guard.breaker.reservations, {})
+        self.assertEqual([c for _, c in self.guard.breaker.cost_events], [0.01])
+        self.assertAlmostEqual(policy.hedge_spend(300), 0.01)
+        self.assertIsNotNone(policy.reserve(self.guard, MODEL, (), 5_000, 1_000))  # $0.03 more fits
+
+    def test_hedge_is_skipped_rather_than_tripping_the_breaker(self):
+        self.guard.breaker.track_usage(cost=0.99)
+        policy = HedgePolicy(budget_fraction=0.5)
+        self.assertIsNone(policy.reserve(self.guard, MODEL, (), 10_000, 1_000))
+        self.assertEqual(self.guard.breaker.cost_failures, 0)
+        self.assertEqual(policy.hedge_spend(300), 0.0)
+
+
+class TestHedgedCalls(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeProviderServer()
+        self.url = self.server.start()
+        self.addCleanup(self.server.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config_path = os.path.join(self.tmp.name, "config.json")
+        self.guard = BudgetGuard()
+        self.guard.breaker = CircuitBreaker(cost_limit=1.0)
+        self.policy = HedgePolicy(min_samples=5, budget_fraction=0.5)
+        for _ in range(5):
+            self.policy.observe(MODEL, 0.02)
+
+    def client(self, keys, **kwargs):
+        with open(self.config_path, "w") as f:
+            json.dump({"api_keys": {"FAKE": keys}}, f)
+        return LLMClient("FAKE", self.config_path, guard=self.guard, hedging=self.policy, coalesce=False,
+                         max_tokens=100, **kwargs)
+
+    def test_slow_key_is_hedged_on_another_key(self):
+        self.server.key_latency = {"key-1": 0.4}
+        client = self.client(["key-1", "key-2"], transport=HTTPTransport(self.url))
+        start = time.monotonic()
+        result = client.make_api_call(PROMPT, model=MODEL)
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertTrue(result["hedged"])
+        self.assertTrue(result["hedge_won"])
+        self.assertEqual(result["model"], MODEL)
+        client.close()  # the slow primary finishes in the background
+        self.assertEqual(self.guard.breaker.reservations, {})
+        loser_cost = self.guard.estimate_cost(MODEL, *result["usage"].values())
+        self.assertAlmostEqual(sum(c for _, c in self.guard.breaker.cost_events), loser_cost)
+        self.assertEqual(self.policy.stats()["hedge_wins"], 1)
+
+    def test_single_key_hedges_on_a_cheaper_model(self):
+        self.server.model_latency = {MODEL: 0.4}
+        client = self.client(["key-1"], transport=HTTPTransport(self.url))
+        result = client.make_api_call(PROMPT, model=MODEL)
+        self.assertTrue(result["hedge_won"])
+        cheapest, _, _ = self.guard.recommend_model(len(PROMPT) // 4, 500, max_budget=1.0)
+        self.assertEqual(result["model"], cheapest)
+        self.assertEqual(result["response"], f"Fake reply from {cheapest}.")
+        client.close()
+
+    def test_loser_that_raises_releases_the_hedge_hold(self):
+        self.server.key_latency = {"key-1": 0.3}
+        client = self.client(["key-1", "key-2"], transport=HTTPTransport(self.url))
+        upstream = client._call_upstream
+
+        def call(prompt, model, max_retries, timeout, exclude=(), keys_used=None):
+            if not exclude:  # the primary, on the slow key-1
+                upstream(prompt, model, max_retries, timeout, exclude, keys_used)
+                raise RuntimeError("attempt crashed")
+            return upstream(prompt, model, max_retries, timeout, exclude, keys_used)
+
+        client._call_upstream = call
+        result = client.make_api_call(PROMPT, model=MODEL)
+        self.assertTrue(result["hedge_won"])
+        client.close()
+        self.assertIsNone(client._hedge_executor)
+        self.assertEqual(self.guard.breaker.reservations, {})
+        self.assertEqual(self.policy.hedge_spend(300), 0.0)
+
+    def test_fast_call_is_not_hedged(self):
+        client = self.client(["key-1", "key-2"], transport=HTTPTransport(self.url))
+        self.policy.observe(MODEL, 5.0)
+        for _ in range(20):
+            self.policy.observe(MODEL, 1.0)
+        result = client.make_api_call(PROMPT, model=MODEL)
+        self.assertNotIn("hedged", result)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.policy.stats()["hedges"], 0)
+
+    def test_no_hedge_once_the_cap_is_spent(self):
+        self.policy.budget_fraction = 1e-9
+        self.server.key_latency = {"key-1": 0.1}
+        client = self.client(["key-1", "key-2"], transport=HTTPTransport(self.url))
+        result = client.make_api_call(PROMPT, model=MODEL)
+        self.assertNotIn("hedged", result)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.policy.stats()["skipped_over_budget"], 1)
+
+    def test_async_loser_is_cancelled_and_charged_its_input(self):
+        self.server.key_latency = {"key-1": 0.5}
+
+        async def run():
+            transport = AsyncHTTPTransport(self.url)
+            client = self.client(["key-1", "key-2"], async_transport=transport)
+            try:
+                return await client.make_api_call_async(PROMPT, model=MODEL)
+            finally:
+                await transport.close()
+
+        start = time.monotonic()
+        result = asyncio.run(run())
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertTrue(result["hedge_won"])
+        self.assertEqual(self.guard.breaker.reservations, {})
+        input_cost = self.guard.estimate_cost(MODEL, len(PROMPT) // 4, 0)
+        self.assertAlmostEqual(sum(c for _, c in self.guard.breaker.cost_events), input_cost)
+
+    def test_async_loser_that_raises_releases_the_hedge_hold(self):
+        async def run():
+            transport = AsyncHTTPTransport(self.url)
+            client = self.client(["key-1", "key-2"], async_transport=transport)
+            upstream = client._call_upstream_async
+
+            async def call(prompt, model, max_retries, timeout, exclude=(), keys_used=None):
+                if keys_used is not None:  # the primary crashes after the hedge has fired
+                    await asyncio.sleep(0.1)
+                    raise RuntimeError("attempt crashed")
+                await asyncio.sleep(0.2)
+                return await upstream(prompt, model, max_retries, timeout, exclude, keys_used)
+
+            client._call_upstream_async = call
+            try:
+                return await client.make_api_call_async(PROMPT, model=MODEL)
+            finally:
+                await transport.close()
+
+        result = asyncio.run(run())
+        self.assertEqual(result["status"], "success")
+        self.assertTrue(result["hedge_won"])
+        self.assertEqual(self.guard.breaker.reservations, {})
+        self.assertEqual(self.policy.hedge_spend(300), 0.0)
+
+    def test_hedging_requires_a_guard(self):
+        with open(self.config_path, "w") as f:
+            json.dump({"api_keys": {"FAKE": ["key-1"]}}, f)
+        with self.assertRaises(ValueError):
+            LLMClient("FAKE", self.config_path, hedging=self.policy)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,357 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from fake_provider import FakeProviderServer
+from http_transport import HTTPTransport, AsyncHTTPTransport, TransportTimeout, TransportResponse
+from llm_client import LLMClient
+from cost_calculator import BudgetGuard
+from circuit_breaker import CircuitBreaker
+
+CHAT = {"model": "fake", "messages": [{"role": "user", "content": "Summarize the release notes."}]}
+AUTH = {"Authorization": "Bearer test-key"}
+
+
+class TransportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeProviderServer()
+        self.url = self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+
+class TestHTTPTransport(TransportTestCase):
+    def test_keep_alive_reuses_one_connection(self):
+        transport = HTTPTransport(self.url)
+        for _ in range(5):
+            response = transport.post_json("/v1/chat/completions", CHAT, AUTH)
+            self.assertEqual(response.status, 200)
+        self.assertEqual(response.json()["usage"]["prompt_tokens"], 7)
+        self.assertEqual(transport.connections_opened, 1)
+        self.assertEqual(self.server.connections, 1)
+        transport.close()
+
+    def test_pools_are_separate_per_key(self):
+        transport = HTTPTransport(self.url)
+        transport.post_json("/v1/chat/completions", CHAT, AUTH, pool_key="key-a")
+        transport.post_json("/v1/chat/completions", CHAT, AUTH, pool_key="key-b")
+        transport.post_json("/v1/chat/completions", CHAT, AUTH, pool_key="key-a")
+        self.assertEqual(transport.connections_opened, 2)
+        transport.close()
+
+    def test_timeout_and_deadline(self):
+        self.server.latency = 0.5
+        transport = HTTPTransport(self.url)
+        with self.assertRaises(TransportTimeout):
+            transport.post_json("/v1/messages", CHAT, {"x-api-key": "k"}, timeout=0.05)
+        with self.assertRaises(TransportTimeout):
+            transport.post_json("/v1/messages", CHAT, {"x-api-key": "k"}, deadline=time.monotonic() - 1)
+        transport.close()
+
+    def test_pool_timeout_does_not_reveal_the_key(self):
+        self.server.latency = 0.3
+        transport = HTTPTransport(self.url, max_connections=1)
+        holder = threading.Thread(target=transport.post_json,
+                                  args=("/v1/messages", CHAT, {"x-api-key": "k"}), kwargs={"pool_key": "sk-secret-123"})
+        holder.start()
+        time.sleep(0.05)
+        with self.assertRaises(TransportTimeout) as caught:
+            transport.post_json("/v1/messages", CHAT, {"x-api-key": "k"}, pool_key="sk-secret-123", timeout=0.05)
+        holder.join()
+        self.assertNotIn("sk-secret", str(caught.exception))
+        self.assertIn("...-123", str(caught.exception))
+        transport.close()
+
+    def test_injected_rate_limit_carries_retry_after(self):
+        self.server.rate_limit_ratio = 1.0
+        self.server.retry_after = 7
+        response = HTTPTransport(self.url).post_json("/v1/chat/completions", CHAT, AUTH)
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.headers["retry-after"], "7")
+
+    def test_stream_reuses_connection_only_when_read_to_the_end(self):
+        transport = HTTPTransport(self.url)
+        request = dict(CHAT, stream=True, max_tokens=5)
+        with transport.stream("POST", "/v1/chat/completions", request, AUTH) as stream:
+            self.assertEqual(stream.headers["content-type"], "text/event-stream")
+            lines = [line for line in stream if line.startswith(b"data:")]
+        self.assertEqual(lines[-1], b"data: [DONE]\n")
+        self.assertEqual(len(lines), 5 + 3)  # deltas, finish, usage, [DONE]
+        with transport.stream("POST", "/v1/chat/completions", request, AUTH) as stream:
+            next(iter(stream))  # closed early
+        transport.post_json("/v1/chat/completions", CHAT, AUTH)
+        self.assertEqual(transport.connections_opened, 2)
+        transport.close()
+
+
+class TestAsyncHTTPTransport(TransportTestCase):
+    def test_concurrency_is_capped_per_pool(self):
+        self.server.latency = 0.02
+
+        async def run():
+            transport = AsyncHTTPTransport(self.url, max_connections=3)
+            responses = await asyncio.gather(*[transport.post_json("/v1/messages", CHAT, {"x-api-key": "k"})
+                                               for _ in range(12)])
+            await transport.close()
+            return transport, responses
+
+        transport, responses = asyncio.run(run())
+        self.assertEqual([r.status for r in responses], [200] * 12)
+        self.assertEqual(responses[0].json()["usage"]["input_tokens"], 7)
+        self.assertEqual(transport.connections_opened, 3)
+
+    def test_timeout(self):
+        self.server.latency = 0.5
+
+        async def run():
+            transport = AsyncHTTPTransport(self.url)
+            try:
+                await transport.post_json("/v1/messages", CHAT, {"x-api-key": "k"}, timeout=0.05)
+            finally:
+                await transport.close()
+
+        with self.assertRaises(TransportTimeout):
+            asyncio.run(run())
+
+    def test_stream_lines(self):
+        async def run():
+            transport = AsyncHTTPTransport(self.url)
+            stream = await transport.stream("POST", "/v1/messages", dict(CHAT, stream=True, max_tokens=3),
+                                            {"x-api-key": "k"})
+            async with stream:
+                lines = [line async for line in stream]
+            response = await transport.post_json("/v1/messages", CHAT, {"x-api-key": "k"})
+            await transport.close()
+            return transport, lines, response
+
+        transport, lines, response = asyncio.run(run())
+        events = [json.loads(line[5:]) for line in lines if line.startswith(b"data:")]
+        self.assertEqual([e["type"] for e in events],
+                         ["message_start"] + ["content_block_delta"] * 3 + ["message_delta", "message_stop"])
+        self.assertEqual(response.status, 200)
+        self.assertEqual(transport.connections_opened, 1)
+
+
+class TestLLMClientTransport(TransportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config_path = os.path.join(self.tmp.name, "config.json")
+        with open(self.config_path, "w") as f:
+            json.dump({"api_keys": {"FAKE": ["key-1"]}}, f)
+
+    def test_usage_is_returned_for_both_wire_formats(self):
+        for provider in ("openai", "anthropic"):
+            client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url), provider=provider)
+            result = client.make_api_call("Summarize the release notes.", model="fake")
+            self.assertEqual(result["status"], "success")
+            self.assertEqual(result["response"], "Fake reply from fake.")
+            self.assertEqual(result["usage"], {"input_tokens": 7, "output_tokens": 5})
+
+    def test_rate_limited_key_cools_and_next_key_is_used(self):
+        with open(self.config_path, "w") as f:
+            json.dump({"api_keys": {"FAKE": ["key-1", "key-2"]}}, f)
+        self.server.rate_limit_ratio = 1.0
+        self.server.retry_after = 30
+        client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url))
+        start = time.monotonic()
+        result = client.make_api_call("hi", model="fake", max_retries=2, timeout=1.0)
+        self.assertEqual(result["status"], "error")
+        self.assertLess(time.monotonic() - start, 0.5)
+        manager = client.api_key_manager
+        self.assertGreater(manager.cooldown_remaining("key-1"), 25)
+        self.assertGreater(manager.cooldown_remaining("key-2"), 25)
+        self.assertTrue(manager.flush_state(timeout=5))
+
+    def test_async_call(self):
+        async def run():
+            transport = AsyncHTTPTransport(self.url)
+            client = LLMClient("FAKE", self.config_path, async_transport=transport, provider="anthropic")
+            try:
+                return await client.make_api_call_async("Summarize the release notes.", model="fake")
+            finally:
+                await transport.close()
+
+        self.assertEqual(asyncio.run(run())["usage"]["output_tokens"], 5)
+
+    def test_async_call_errors_reach_every_caller_as_a_result(self):
+        async def run(client):
+            return await asyncio.gather(*[client.make_api_call_async("Summarize.", model="fake", max_retries=1)
+                                          for _ in range(3)])
+
+        async def non_json_reply():
+            transport = AsyncHTTPTransport(self.url)
+            transport.post_json = mock.AsyncMock(return_value=TransportResponse(200, {}, b"<html>oops</html>"))
+            try:
+                return await run(LLMClient("FAKE", self.config_path, async_transport=transport))
+            finally:
+                await transport.close()
+
+        # A leader that fails this way must not take its followers down with it
+        for results in (asyncio.run(non_json_reply()), asyncio.run(run(LLMClient("FAKE", self.config_path)))):
+            self.assertEqual([r["status"] for r in results], ["error"] * 3)
+
+    def test_identical_concurrent_calls_go_upstream_once(self):
+        self.server.latency = 0.1
+        client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.make_api_call(" Summarize. ", model="fake")))
+                   for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual([r["status"] for r in results], ["success"] * 5)
+        charged = [r["usage"]["input_tokens"] + r["usage"]["output_tokens"] for r in results]
+        self.assertEqual(sorted(charged), [0, 0, 0, 0, 8])  # followers carry zero usage
+        self.assertEqual(client.coalescing_stats()["coalesced"], 4)
+
+    def test_cached_response_survives_restart_and_is_credited(self):
+        cache_path = os.path.join(self.tmp.name, "responses.bin")
+        client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url), response_cache=cache_path)
+        first = client.make_api_call("Classify: great product", model="claude-sonnet-4-6")
+        client.response_cache.close()
+
+        guard = BudgetGuard()
+        client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url),
+                           response_cache=cache_path, guard=guard)
+        hit = client.make_api_call("Classify: great product", model="claude-sonnet-4-6")
+        self.assertEqual(self.server.requests, 1)
+        self.assertTrue(hit["cached"])
+        self.assertEqual(hit["response"], first["response"])
+        self.assertEqual(hit["usage"], {"input_tokens": 0, "output_tokens": 0})
+        self.assertEqual(hit["cached_usage"], first["usage"])
+        self.assertEqual(guard.get_cache_savings()["hits"], 1)
+        self.assertAlmostEqual(guard.get_cache_savings()["saved_usd"], hit["saved_cost"])
+        self.assertGreater(hit["saved_cost"], 0)
+
+        client.make_api_call("Classify: great product", model="claude-sonnet-4-6", use_cache=False)
+        self.assertEqual(self.server.requests, 2)
+        client.response_cache.close()
+
+
+class TestLLMClientStreaming(TransportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.config_path = os.path.join(self.tmp.name, "config.json")
+        with open(self.config_path, "w") as f:
+            json.dump({"api_keys": {"FAKE": ["key-1"]}}, f)
+        self.server.stream_tokens = 5000
+        self.guard = BudgetGuard()
+        self.guard.breaker = CircuitBreaker(cost_limit=5.0)
+        self.guard.thresholds = {"routine": 0.05, "experiment": 0.50}
+
+    def test_stream_is_metered_and_settled(self):
+        for provider in ("openai", "anthropic"):
+            client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url), provider=provider,
+                               guard=self.guard, max_tokens=200)
+            chunks = []
+            result = client.stream_api_call("Summarize the release notes.", model="claude-sonnet-4-6",
+                                            on_text=chunks.append)
+            self.assertEqual(result["status"], "success")
+            self.assertEqual(len(chunks), 200)
+            self.assertEqual(result["response"], "".join(chunks))
+            self.assertEqual(result["usage"], {"input_tokens": 7, "output_tokens": 200})
+            self.assertAlmostEqual(result["cost"], (7 * 3 + 200 * 15) / 1e6)
+        self.assertEqual(self.guard.breaker.reservations, {})
+
+    def test_runaway_stream_is_cut_off_at_the_request_limit(self):
+        client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url), guard=self.guard,
+                           max_tokens=5000)
+        result = client.stream_api_call("Write forever.", model="claude-sonnet-4-6")
+        self.assertEqual(result["status"], "cut_off")
+        self.assertEqual(result["cut_off_reason"], "request_limit")
+        self.assertLess(result["usage"]["output_tokens"], 5000)
+        self.assertAlmostEqual(result["cost"], 0.05, places=4)
+        self.assertEqual(self.guard.breaker.reservations, {})
+        self.assertAlmostEqual(sum(c for _, c in self.guard.breaker.cost_events), result["cost"])
+
+    def test_async_stream_cut_off(self):
+        async def run():
+            transport = AsyncHTTPTransport(self.url)
+            client = LLMClient("FAKE", self.config_path, async_transport=transport, provider="anthropic",
+                               guard=self.guard, max_tokens=5000)
+            try:
+                return await client.stream_api_call_async("Write forever.", model="claude-sonnet-4-6")
+            finally:
+                await transport.close()
+
+        result = asyncio.run(run())
+        self.assertEqual(result["status"], "cut_off")
+        self.assertEqual(result["usage"]["input_tokens"], 3)  # reported before the cut
+
+    def test_malformed_event_settles_the_stream_as_an_error(self):
+        self.server.corrupt_stream_after = 10
+        for provider in ("openai", "anthropic"):
+            client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url), provider=provider,
+                               guard=self.guard, max_tokens=200)
+            result = client.stream_api_call("Summarize the release notes.", model="claude-sonnet-4-6")
+            self.assertEqual(result["status"], "error")
+            self.assertIn("Malformed stream event", result["message"])
+            self.assertEqual(result["usage"]["output_tokens"], 10)
+            self.assertGreater(result["cost"], 0)
+        self.assertEqual(self.guard.breaker.reservations, {})
+
+    async def _stream_async(self, provider):
+        transport = AsyncHTTPTransport(self.url)
+        client = LLMClient("FAKE", self.config_path, async_transport=transport, provider=provider,
+                           guard=self.guard, max_tokens=200)
+        try:
+            return await client.stream_api_call_async("Summarize the release notes.", model="claude-sonnet-4-6")
+        finally:
+            await transport.close()
+
+    def test_async_malformed_event_settles_the_stream_as_an_error(self):
+        self.server.corrupt_stream_after = 3
+        result = asyncio.run(self._stream_async("openai"))
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(result["usage"]["output_tokens"], 3)
+        self.assertEqual(self.guard.breaker.reservations, {})
+
+    def test_on_text_exception_settles_the_meter(self):
+        client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url), guard=self.guard,
+                           max_tokens=200)
+        chunks = []
+
+        def on_text(text):
+            chunks.append(text)
+            if len(chunks) == 20:
+                raise RuntimeError("consumer went away")
+
+        with self.assertRaises(RuntimeError):
+            client.stream_api_call("Summarize the release notes.", model="claude-sonnet-4-6", on_text=on_text)
+        self.assertEqual(self.guard.breaker.reservations, {})
+        self.assertAlmostEqual(sum(c for _, c in self.guard.breaker.cost_events), (7 * 3 + 20 * 15) / 1e6)
+
+        async def run():
+            transport = AsyncHTTPTransport(self.url)
+            client = LLMClient("FAKE", self.config_path, async_transport=transport, guard=self.guard,
+                               max_tokens=200)
+            try:
+                await client.stream_api_call_async("Summarize.", model="claude-sonnet-4-6", on_text=on_text)
+            finally:
+                await transport.close()
+
+        chunks.clear()
+        with self.assertRaises(RuntimeError):
+            asyncio.run(run())
+        self.assertEqual(self.guard.breaker.reservations, {})
+
+    def test_blocked_before_sending_when_input_is_over_limit(self):
+        client = LLMClient("FAKE", self.config_path, transport=HTTPTransport(self.url), guard=self.guard)
+        result = client.stream_api_call("x" * 80_000, model="claude-sonnet-4-6")
+        self.assertEqual(result["status"], "blocked")
+        self.assertEqual(self.server.requests, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
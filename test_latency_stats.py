@@ -0,0 +1,45 @@
+import unittest
+from unittest.mock import patch
+from latency_stats import LatencyHistogram, LatencyRecorder, _bucket_index, _bucket_bounds
+
+
+class TestBuckets(unittest.TestCase):
+    def test_every_value_falls_inside_its_bucket(self):
+        for value in list(range(200)) + [10**k + 7 for k in range(3, 13)]:
+            lowest, highest = _bucket_bounds(_bucket_index(value))
+            self.assertLessEqual(lowest, value)
+            self.assertLessEqual(value, highest)
+            # Relative bucket width stays within one sub-bucket (1/8)
+            self.assertLessEqual(highest - lowest, max(0, value // 8))
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles_within_bucket_error(self):
+        histogram = LatencyHistogram()
+        for ns in range(1000, 101000, 100):  # 1,000 evenly spaced samples, 1-101 µs
+            histogram.add(ns)
+        summary = histogram.summary()
+        self.assertEqual(summary["count"], 1000)
+        self.assertAlmostEqual(summary["p50_us"], 50.9, delta=50.9 * 0.125)
+        self.assertAlmostEqual(summary["p99_us"], 99.9, delta=99.9 * 0.125)
+        self.assertAlmostEqual(summary["max_us"], 100.9, delta=100.9 * 0.125)
+
+    def test_empty_histogram(self):
+        self.assertEqual(LatencyHistogram().summary()["p99_us"], 0)
+
+
+class TestLatencyRecorder(unittest.TestCase):
+    def test_lap_records_and_chains(self):
+        recorder = LatencyRecorder()
+        with patch("latency_stats._now", side_effect=[1500, 4000]):
+            t = recorder.lap("a", 1000)
+            recorder.lap("b", t)
+        self.assertEqual(recorder.histogram("a").total_ns, 500)
+        self.assertEqual(recorder.histogram("b").total_ns, 2500)
+        self.assertEqual(list(recorder.stats()), ["a", "b"])
+        recorder.reset()
+        self.assertEqual(recorder.stats(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
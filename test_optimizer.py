@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from optimizer import TokenOptimizer, load_lexicon
+
+
+class TestCleanText(unittest.TestCase):
+    def test_default_fillers_and_whitespace(self):
+        optimizer = TokenOptimizer()
+        sample = "   Hello!    I understand that you want to save   tokens. I'm happy to help.   "
+        self.assertEqual(optimizer.clean_text(sample), "Hello! you want to save tokens. .")
+
+    def test_longest_phrase_wins(self):
+        optimizer = TokenOptimizer(fillers=["I understand", "I understand that"])
+        self.assertEqual(optimizer.clean_text("a I understand that b I understand c"), "a b c")
+
+    def test_phrase_matches_across_line_breaks(self):
+        optimizer = TokenOptimizer(fillers=["Sure thing"])
+        self.assertEqual(optimizer.clean_text("ok\nSure\n\tthing, done"), "ok , done")
+
+    def test_partial_phrase_is_kept(self):
+        optimizer = TokenOptimizer(fillers=["I understand that"])
+        self.assertEqual(optimizer.clean_text("I understand  this"), "I understand this")
+
+    def test_special_characters_are_literal(self):
+        optimizer = TokenOptimizer(fillers=["(see above)", "a.b"])
+        self.assertEqual(optimizer.clean_text("x (see above) axb a.b y"), "x axb y")
+
+    def test_ignore_case(self):
+        optimizer = TokenOptimizer(fillers=["as an ai language model"], ignore_case=True)
+        self.assertEqual(optimizer.clean_text("As an AI language model, hi"), ", hi")
+
+    def test_empty_lexicon_only_normalizes_whitespace(self):
+        optimizer = TokenOptimizer(fillers=[])
+        self.assertEqual(optimizer.clean_text(" a \n\n b "), "a b")
+
+    def test_lexicon_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("# boilerplate\nPlease note that\n\nHope this helps\n")
+        try:
+            self.assertEqual(load_lexicon(f.name), ["Please note that", "Hope this helps"])
+            optimizer = TokenOptimizer(fillers=[], lexicon_path=f.name)
+            self.assertEqual(optimizer.clean_text("Please note that x. Hope this helps"), "x.")
+        finally:
+            os.remove(f.name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import json
+import random
+import tempfile
+import threading
+import unittest
+from output_predictor import P2Quantile, OutputTokenPredictor
+from cost_calculator import BudgetGuard
+
+
+class TestP2Quantile(unittest.TestCase):
+    def test_tracks_percentile_of_stream(self):
+        rng = random.Random(7)
+        values = [rng.uniform(0, 1000) for _ in range(5000)]
+        sketch = P2Quantile(0.9)
+        for v in values:
+            sketch.add(v)
+        exact = sorted(values)[int(0.9 * len(values))]
+        self.assertAlmostEqual(sketch.value(), exact, delta=25)
+
+    def test_few_samples_use_exact_order_statistic(self):
+        sketch = P2Quantile(0.5)
+        self.assertIsNone(sketch.value())
+        for v in (30, 10, 20):
+            sketch.add(v)
+        self.assertEqual(sketch.value(), 20)
+
+
+class TestOutputTokenPredictor(unittest.TestCase):
+    def test_falls_back_to_model_then_default(self):
+        predictor = OutputTokenPredictor(min_samples=3)
+        self.assertEqual(predictor.predict("gpt-4o", "routine"), 500)
+        for tokens in (100, 120, 140):
+            predictor.observe("gpt-4o", "critical", tokens)
+        # Unseen context borrows the model-wide estimate
+        self.assertEqual(predictor.predict("gpt-4o", "routine"), predictor.predict("gpt-4o", "critical"))
+        self.assertLessEqual(predictor.predict("gpt-4o", "routine"), 140)
+        self.assertEqual(predictor.predict("gpt-4o-mini", "routine"), 500)
+
+    def test_save_and_load_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "state", "predictor.json")
+            predictor = OutputTokenPredictor(min_samples=1, state_path=path, save_every=0)
+            for tokens in range(50, 250, 10):
+                predictor.observe("gpt-4o", "routine", tokens)
+            predictor.save()
+
+            restored = OutputTokenPredictor(min_samples=1, state_path=path)
+            self.assertEqual(restored.predict("gpt-4o", "routine"), predictor.predict("gpt-4o", "routine"))
+            # State saved for another percentile is not reused
+            other = OutputTokenPredictor(percentile=0.5, state_path=path)
+            self.assertEqual(other.predict("gpt-4o", "routine"), 500)
+
+    def test_bootstrap_from_usage_log(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "usage_log.jsonl")
+            with open(path, "w") as f:
+                for out in (400, 800, 600):
+                    f.write(json.dumps({"model": "gpt-4o", "in": 1000, "out": out, "task": "heartbeat"}) + "\n")
+                f.write("not json\n")
+            predictor = OutputTokenPredictor(min_samples=3)
+            self.assertEqual(predictor.bootstrap_from_usage_log(path), 3)
+            self.assertEqual(predictor.predict("gpt-4o", "heartbeat"), 800)
+
+    def test_bootstrap_from_checked_in_log_matches_pricing_names(self):
+        log = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "usage_log.jsonl")
+        predictor = OutputTokenPredictor(min_samples=2)
+        self.assertEqual(predictor.bootstrap_from_usage_log(log, contexts=("routine", "high_roi")), 2)
+        # "anthropic/claude-sonnet-4-6" is known as claude-sonnet-4-6; "heartbeat" is
+        # no budget context, so it feeds the model-wide estimate every context falls back to
+        self.assertEqual(predictor.predict("claude-sonnet-4-6", "routine"), 800)
+        self.assertNotIn(("claude-sonnet-4-6", "heartbeat"), predictor._sketches)
+
+    def test_guard_bootstrap_writes_no_state(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "usage_log.jsonl"), "w") as f:
+                for out in range(100, 3100, 100):
+                    f.write(json.dumps({"model": "openai/gpt-4o", "out": out, "task": "routine"}) + "\n")
+            config = os.path.join(tmp, "config.json")
+            with open(config, "w") as f:
+                json.dump({"output_prediction": {"usage_log": "usage_log.jsonl", "state_path": "state.json"}}, f)
+            guard = BudgetGuard(config)
+            self.assertGreater(guard.predict_output_tokens("gpt-4o", "routine"), 2000)
+            self.assertFalse(os.path.exists(os.path.join(tmp, "state.json")))
+
+    def test_concurrent_observers_save_safely(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "predictor.json")
+            predictor = OutputTokenPredictor(state_path=path, save_every=1)
+            errors = []
+
+            def observe():
+                try:
+                    for tokens in range(200):
+                        predictor.observe("gpt-4o", "routine", tokens)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=observe) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(os.listdir(tmp), ["predictor.json"])
+            predictor.save()
+            self.assertEqual(OutputTokenPredictor(min_samples=1, state_path=path)._sketches[("gpt-4o", "routine")].count,
+                             1600)
+
+    def test_failed_save_does_not_fail_observe(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            blocker = os.path.join(tmp, "not-a-dir")
+            open(blocker, "w").close()
+            predictor = OutputTokenPredictor(state_path=os.path.join(blocker, "predictor.json"), save_every=1)
+            predictor.observe("gpt-4o", "routine", 100)
+            with self.assertRaises(OSError):
+                predictor.save()
+
+
+if __name__ == "__main__":
+    unittest.main()
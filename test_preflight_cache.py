@@ -0,0 +1,62 @@
+import unittest
+from preflight_cache import PreflightCache, payload_fingerprint
+
+
+def _payload(text):
+    return {"messages": [{"role": "user", "content": text}], "token_counts": [1],
+            "input_tokens": 1, "report": {}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPayloadFingerprint(unittest.TestCase):
+    def test_depends_on_model_context_and_messages(self):
+        messages = [{"role": "user", "content": "hi"}]
+        key = payload_fingerprint("gpt-4o", messages, "routine")
+        self.assertEqual(key, payload_fingerprint("gpt-4o", [{"content": "hi", "role": "user"}], "routine"))
+        self.assertNotEqual(key, payload_fingerprint("gpt-4o-mini", messages, "routine"))
+        self.assertNotEqual(key, payload_fingerprint("gpt-4o", messages, "critical"))
+        self.assertNotEqual(key, payload_fingerprint("gpt-4o", [{"role": "user", "content": "hi!"}], "routine"))
+
+
+class TestPreflightCache(unittest.TestCase):
+    def test_hit_returns_independent_copy(self):
+        cache = PreflightCache()
+        cache.put("k", _payload("hello"), compute_seconds=0.25)
+        first = cache.get("k")
+        first["messages"][0]["content"] = "edited"
+        self.assertEqual(cache.get("k")["messages"][0]["content"], "hello")
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 0))
+        self.assertAlmostEqual(stats["saved_seconds"], 0.5)
+
+    def test_entries_expire_after_ttl(self):
+        clock = FakeClock()
+        cache = PreflightCache(ttl_seconds=10, clock=clock)
+        cache.put("k", _payload("hello"))
+        clock.now = 9.9
+        self.assertIsNotNone(cache.get("k"))
+        clock.now = 10.0
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()["size"], 0)
+        self.assertEqual(cache.stats()["hit_ratio"], 0.5)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = PreflightCache(max_entries=2)
+        cache.put("a", _payload("a"))
+        cache.put("b", _payload("b"))
+        cache.get("a")
+        cache.put("c", _payload("c"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+from response_cache import ResponseCache, _HEADER
+from singleflight import request_key
+
+RESPONSE = {"status": "success", "response": "positive", "usage": {"input_tokens": 40, "output_tokens": 1}}
+
+
+def key(n):
+    return request_key("m", [{"role": "user", "content": f"classify #{n}"}])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "data", "responses.bin")
+        self.clock = FakeClock()
+
+    def open(self, **kwargs):
+        cache = ResponseCache(self.path, clock=self.clock, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_round_trip_and_stats(self):
+        cache = self.open()
+        self.assertIsNone(cache.get(key(1)))
+        cache.put(key(1), RESPONSE)
+        self.assertEqual(cache.get(key(1)), RESPONSE)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_entries_expire(self):
+        cache = self.open(ttl_seconds=60)
+        cache.put(key(1), RESPONSE)
+        cache.put(key(2), RESPONSE, ttl_seconds=600)
+        self.clock.now += 61
+        self.assertIsNone(cache.get(key(1)))
+        self.assertEqual(cache.get(key(2)), RESPONSE)
+
+    def test_lru_eviction_by_bytes(self):
+        record = _HEADER.size + len('{"status":"success","response":"positive","usage":{"input_tokens":40,"output_tokens":1}}')
+        cache = self.open(max_bytes=3 * record)
+        for n in range(3):
+            cache.put(key(n), RESPONSE)
+        cache.get(key(0))  # 1 is now least recently used
+        cache.put(key(3), RESPONSE)
+        self.assertIsNone(cache.get(key(1)))
+        for n in (0, 2, 3):
+            self.assertIsNotNone(cache.get(key(n)))
+
+    def test_warm_restart_keeps_live_entries_only(self):
+        cache = self.open(max_bytes=2 * (_HEADER.size + 100), ttl_seconds=60)
+        cache.put(key(1), RESPONSE)
+        cache.put(key(2), RESPONSE, ttl_seconds=5)
+        cache.put(key(3), RESPONSE)  # evicts 1, leaving a tombstone
+        cache.close()
+        self.clock.now += 10  # 2 has expired
+        reopened = self.open(max_bytes=2 * (_HEADER.size + 100))
+        self.assertIsNone(reopened.get(key(1)))
+        self.assertIsNone(reopened.get(key(2)))
+        self.assertEqual(reopened.get(key(3)), RESPONSE)
+
+    def test_torn_tail_is_truncated(self):
+        cache = self.open()
+        cache.put(key(1), RESPONSE)
+        cache.close()
+        intact = os.path.getsize(self.path)
+        with open(self.path, "ab") as f:
+            f.write(b"\x00" * 10)  # half a header from an interrupted write
+        reopened = self.open()
+        self.assertEqual(reopened.get(key(1)), RESPONSE)
+        self.assertEqual(os.path.getsize(self.path), intact)
+        reopened.put(key(2), RESPONSE)
+        self.assertEqual(reopened.get(key(2)), RESPONSE)
+
+    def test_rewrites_compact_the_file(self):
+        cache = self.open()
+        for _ in range(2000):
+            cache.put(key(1), RESPONSE)
+        self.assertLess(cache.stats()["file_bytes"], 2 * 64 * 1024)
+        self.assertEqual(cache.get(key(1)), RESPONSE)
+        cache.close()
+        self.assertEqual(self.open().get(key(1)), RESPONSE)
+
+    def test_rejects_foreign_file(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "wb") as f:
+            f.write(b"not a cache file")
+        with self.assertRaises(ValueError):
+            ResponseCache(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import time
+import asyncio
+import threading
+import unittest
+from singleflight import SingleFlight, request_key
+
+MESSAGES = [{"role": "user", "content": "Summarize the release notes."}]
+RESPONSE = {"status": "success", "response": "ok", "usage": {"input_tokens": 7, "output_tokens": 5}}
+
+
+class TestRequestKey(unittest.TestCase):
+    def test_normalizes_whitespace_and_role_case(self):
+        padded = [{"role": "User", "content": "  Summarize the release notes.\n"}]
+        self.assertEqual(request_key("m", MESSAGES), request_key("m", padded))
+
+    def test_model_and_params_are_part_of_the_key(self):
+        base = request_key("m", MESSAGES, {"max_tokens": 100})
+        self.assertNotEqual(base, request_key("other", MESSAGES, {"max_tokens": 100}))
+        self.assertNotEqual(base, request_key("m", MESSAGES, {"max_tokens": 200}))
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_threads_share_one_call(self):
+        flight = SingleFlight()
+        upstream = []
+        started = threading.Event()
+
+        def call():
+            upstream.append(1)
+            started.set()
+            time.sleep(0.1)
+            return dict(RESPONSE)
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do("k", call)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=lambda: results.append(flight.do("k", call))) for _ in range(4)]
+        for t in followers:
+            t.start()
+        for t in [leader] + followers:
+            t.join()
+
+        self.assertEqual(len(upstream), 1)
+        self.assertEqual(len(results), 5)
+        shared = [r for r in results if r.get("coalesced")]
+        self.assertEqual(len(shared), 4)
+        self.assertEqual(shared[0]["usage"], {"input_tokens": 0, "output_tokens": 0})
+        self.assertEqual(shared[0]["coalesced_usage"], RESPONSE["usage"])
+        self.assertEqual(flight.stats(), {"calls": 5, "coalesced": 4, "upstream_calls": 1,
+                                          "dedup_ratio": 0.8, "saved_tokens": 48})
+
+    def test_sequential_calls_are_not_merged(self):
+        flight = SingleFlight()
+        flight.do("k", lambda: dict(RESPONSE))
+        self.assertNotIn("coalesced", flight.do("k", lambda: dict(RESPONSE)))
+        self.assertEqual(flight.stats()["upstream_calls"], 2)
+
+    def test_leader_exception_reaches_followers(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        errors = []
+
+        def failing():
+            started.set()
+            time.sleep(0.05)
+            raise RuntimeError("upstream down")
+
+        def run():
+            try:
+                flight.do("k", failing)
+            except RuntimeError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=run)
+        leader.start()
+        started.wait()
+        follower = threading.Thread(target=run)
+        follower.start()
+        leader.join()
+        follower.join()
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(flight._calls, {})
+
+    def test_follower_timeout(self):
+        flight = SingleFlight()
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.2)
+            return dict(RESPONSE)
+
+        leader = threading.Thread(target=flight.do, args=("k", slow))
+        leader.start()
+        started.wait()
+        self.assertEqual(flight.do("k", slow, timeout=0.01)["message"], "Deadline exceeded")
+        leader.join()
+
+    def test_async_tasks_share_one_call(self):
+        flight = SingleFlight()
+        upstream = []
+
+        async def call():
+            upstream.append(1)
+            await asyncio.sleep(0.05)
+            return dict(RESPONSE)
+
+        async def run():
+            return await asyncio.gather(*[flight.do_async("k", call) for _ in range(6)])
+
+        results = asyncio.run(run())
+        self.assertEqual(len(upstream), 1)
+        self.assertEqual(sum(1 for r in results if r.get("coalesced")), 5)
+        self.assertEqual(flight.stats()["saved_tokens"], 60)
+        self.assertEqual(flight._async_calls, {})
+
+    def test_cancelled_leader_does_not_cancel_followers(self):
+        flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(1)
+            return dict(RESPONSE)
+
+        async def run():
+            leader = asyncio.ensure_future(flight.do_async("k", call))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.do_async("k", call))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return leader, await follower
+
+        leader, result = asyncio.run(run())
+        self.assertTrue(leader.cancelled())
+        self.assertEqual(result, {"status": "error", "message": "Request cancelled"})
+        self.assertEqual(flight._async_calls, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
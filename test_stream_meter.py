@@ -0,0 +1,94 @@
+import time
+import unittest
+from cost_calculator import BudgetGuard
+from circuit_breaker import CircuitBreaker
+
+MODEL = "claude-sonnet-4-6"  # $3 / $15 per 1M tokens
+
+
+class TestStreamMeter(unittest.TestCase):
+    def setUp(self):
+        self.guard = BudgetGuard()
+        self.guard.breaker = CircuitBreaker(cost_limit=1.0, cost_window_seconds=300)
+        self.guard.thresholds = {"routine": 0.05, "experiment": 0.50}
+
+    def meter(self, context="routine", input_tokens=1000, sync_tokens=32):
+        meter = self.guard.meter_stream(MODEL, input_tokens, context, sync_tokens=sync_tokens)
+        ok, msg = meter.start()
+        self.assertTrue(ok, msg)
+        return meter
+
+    def test_cuts_off_at_the_per_request_limit(self):
+        meter = self.meter()  # $0.003 input leaves room for 3133 output tokens
+        self.assertEqual(meter.request_cap, 3133)
+        fed = 0
+        while meter.feed("tok "):
+            fed += 1
+        self.assertEqual(fed, 3133)
+        self.assertEqual(meter.cut_off_reason, "request_limit")
+        self.assertGreater(meter.cost, 0.05)
+
+    def test_reservation_grows_as_tokens_arrive(self):
+        meter = self.meter(sync_tokens=10)
+        for _ in range(25):
+            meter.feed("tok ")
+        # synced at 10 and 20 tokens
+        self.assertEqual(self.guard.breaker.reserved()[1], 1020)
+        self.assertAlmostEqual(self.guard.breaker.reserved()[0], 0.003 + 20 * 15 / 1e6)
+
+    def test_cuts_off_when_the_window_fills(self):
+        meter = self.meter(context="experiment", sync_tokens=100)
+        self.guard.breaker.track_usage(cost=0.99)  # another caller spends most of the window
+        stopped_at = None
+        for n in range(1, 20000):
+            if not meter.feed("tok "):
+                stopped_at = n
+                break
+        self.assertEqual(meter.cut_off_reason, "window_limit")
+        self.assertLessEqual(stopped_at, 600)  # $0.01 left: ~466 tokens, checked every 100
+
+    def test_progress_renews_the_hold_and_a_lapse_has_its_own_reason(self):
+        self.guard.breaker = CircuitBreaker(cost_limit=1.0, reservation_timeout=0.2)
+        meter = self.meter(sync_tokens=10)
+        for _ in range(3):  # each sync renews the hold past its original lapse time
+            for _ in range(10):
+                self.assertTrue(meter.feed("tok "))
+            time.sleep(0.12)
+        self.assertIsNone(meter.cut_off_reason)
+        time.sleep(0.15)  # stalled past reservation_timeout
+        while meter.feed("tok "):
+            pass
+        self.assertEqual(meter.cut_off_reason, "reservation_lapsed")
+
+    def test_finish_commits_reported_usage(self):
+        meter = self.meter()
+        for _ in range(10):
+            meter.feed("tok ")
+        cost = meter.finish({"input_tokens": 900, "output_tokens": 12})
+        self.assertAlmostEqual(cost, (900 * 3 + 12 * 15) / 1e6)
+        self.assertEqual(self.guard.breaker.reservations, {})
+        self.assertEqual([t for _, t in self.guard.breaker.token_events], [912])
+
+    def test_estimate_uses_chunks_or_characters(self):
+        meter = self.meter()
+        meter.feed("a")
+        meter.feed("b")
+        self.assertEqual(meter.output_tokens, 2)
+        meter.feed("x" * 40)
+        self.assertEqual(meter.output_tokens, 10)
+
+    def test_cancel_releases_the_hold(self):
+        meter = self.meter()
+        meter.cancel()
+        self.assertEqual(self.guard.breaker.reserved(), (0, 0))
+        self.assertEqual(len(self.guard.breaker.cost_events), 0)
+
+    def test_start_is_blocked_when_input_alone_is_over_limit(self):
+        meter = self.guard.meter_stream(MODEL, 20_000, "routine")
+        ok, msg = meter.start()
+        self.assertFalse(ok)
+        self.assertIsNone(meter.reservation_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,231 @@
+import re
+import unittest
+from token_optimizer import TokenOptimizer, allocate_budget, dedupe_messages
+
+
+def _word_count(text):
+    return len(text.split())
+
+
+def _encoding_available():
+    try:
+        TokenOptimizer()
+        return True
+    except Exception:
+        return False
+
+
+TOOL_OUTPUT = "file listing: " + " ".join(f"src/module_{i}.py" for i in range(40))
+
+
+class TestDedupeMessages(unittest.TestCase):
+    def test_exact_duplicates_keep_latest_copy(self):
+        messages = [
+            {"role": "tool", "content": TOOL_OUTPUT},
+            {"role": "user", "content": "Run it again."},
+            {"role": "tool", "content": TOOL_OUTPUT},
+        ]
+        result, report = dedupe_messages(messages, _word_count)
+        self.assertEqual(result[0]["content"], "[duplicate of message 2 omitted]")
+        self.assertEqual(result[0]["role"], "tool")
+        self.assertEqual(result[2]["content"], TOOL_OUTPUT)
+        self.assertEqual(report["exact_duplicates"], 1)
+        self.assertGreater(report["tokens_saved"], 0)
+        # Input list is left untouched
+        self.assertEqual(messages[0]["content"], TOOL_OUTPUT)
+
+    def test_whitespace_variants_are_exact_duplicates(self):
+        messages = [
+            {"role": "user", "content": TOOL_OUTPUT.replace(" ", "   ")},
+            {"role": "user", "content": TOOL_OUTPUT},
+        ]
+        _, report = dedupe_messages(messages, _word_count)
+        self.assertEqual(report["exact_duplicates"], 1)
+
+    def test_system_and_short_messages_are_never_stubbed(self):
+        messages = [
+            {"role": "system", "content": TOOL_OUTPUT},
+            {"role": "user", "content": "ok"},
+            {"role": "user", "content": "ok"},
+            {"role": "user", "content": TOOL_OUTPUT},
+        ]
+        result, report = dedupe_messages(messages, _word_count)
+        self.assertEqual(result, messages)
+        self.assertEqual(report["exact_duplicates"], 0)
+
+    def test_near_duplicates_only_when_threshold_set(self):
+        edited = TOOL_OUTPUT.replace("module_39", "module_40")
+        messages = [
+            {"role": "tool", "content": TOOL_OUTPUT},
+            {"role": "tool", "content": edited},
+        ]
+        _, report = dedupe_messages(messages, _word_count)
+        self.assertEqual(report["near_duplicates"], 0)
+
+        result, report = dedupe_messages(messages, _word_count, near_duplicate_threshold=0.7)
+        self.assertEqual(report["near_duplicates"], 1)
+        self.assertEqual(result[0]["content"], "[near-duplicate of message 1 omitted]")
+        self.assertEqual(result[1]["content"], edited)
+
+    def test_unrelated_messages_survive_near_duplicate_pass(self):
+        messages = [
+            {"role": "tool", "content": TOOL_OUTPUT},
+            {"role": "tool", "content": " ".join(f"row {i}: value {i * i}" for i in range(40))},
+        ]
+        result, report = dedupe_messages(messages, _word_count, near_duplicate_threshold=0.7)
+        self.assertEqual(result, messages)
+        self.assertEqual(report["near_duplicates"], 0)
+
+    def test_whitespace_only_content_skips_minhash(self):
+        messages = [
+            {"role": "tool", "content": " " * 80},
+            {"role": "tool", "content": "\n\t" * 40},
+            {"role": "tool", "content": TOOL_OUTPUT},
+        ]
+        result, report = dedupe_messages(messages, _word_count, near_duplicate_threshold=0.7)
+        self.assertEqual(report["near_duplicates"], 0)
+        self.assertEqual(report["exact_duplicates"], 1)  # both normalize to ""
+        self.assertEqual(result[2], messages[2])
+
+
+class TestAllocateBudget(unittest.TestCase):
+    def test_everything_fits(self):
+        self.assertEqual(allocate_budget([10, 20, 30], [1, 1, 1], 100), [10, 20, 30])
+
+    def test_surplus_flows_to_larger_items(self):
+        # Equal weights: the 10-token item is satisfied, the rest split 90
+        self.assertEqual(allocate_budget([10, 200, 200], [1, 1, 1], 100), [10, 45, 45])
+
+    def test_weights_scale_shares(self):
+        alloc = allocate_budget([300, 300], [1, 2], 90)
+        self.assertEqual(alloc, [30, 60])
+
+    def test_zero_budget_and_zero_weight(self):
+        self.assertEqual(allocate_budget([5, 5], [1, 1], 0), [0, 0])
+        self.assertEqual(allocate_budget([50, 50], [0, 1], 60), [0, 50])
+
+
+@unittest.skipUnless(_encoding_available(), "tiktoken encoding not available")
+class TestSummarizeContext(unittest.TestCase):
+    def setUp(self):
+        self.optimizer = TokenOptimizer(max_tokens=200, min_message_tokens=8)
+
+    def test_fits_unchanged_apart_from_whitespace(self):
+        messages = [{"role": "user", "content": "  hello   there "}]
+        self.assertEqual(self.optimizer.summarize_context(messages),
+                         [{"role": "user", "content": "hello there"}])
+
+    def test_pinned_messages_survive_and_flag_is_stripped(self):
+        long_text = " ".join(f"word{i}" for i in range(2000))
+        messages = [
+            {"role": "system", "content": "You are a careful agent."},
+            {"role": "user", "content": "Remember the ticket id ABC-123.", "pinned": True},
+        ] + [{"role": "user", "content": long_text} for _ in range(5)]
+        packed = self.optimizer.summarize_context(messages)
+        self.assertEqual(packed[0]["content"], "You are a careful agent.")
+        self.assertEqual(packed[1], {"role": "user", "content": "Remember the ticket id ABC-123."})
+        total = sum(self.optimizer.estimate_tokens(m["content"]) for m in packed)
+        # Re-encoding at the truncation seams may shift a token or two per message
+        self.assertLessEqual(total, 200 + 2 * len(packed))
+
+    def test_pinned_overflow_keeps_pinned_content_whole(self):
+        rules = "Rule: " + " ".join(f"clause{i}" for i in range(300))
+        messages = [
+            {"role": "system", "content": rules},
+            {"role": "user", "content": "Keep ticket ABC-123 open.", "pinned": True},
+            {"role": "user", "content": "What changed since yesterday?"},
+        ]
+        self.assertGreater(self.optimizer.estimate_tokens(rules), self.optimizer.max_tokens)
+        packed = self.optimizer.summarize_context(messages)
+        self.assertEqual(packed, [{"role": "system", "content": rules},
+                                  {"role": "user", "content": "Keep ticket ABC-123 open."}])
+
+    def test_long_messages_are_truncated_middle_out(self):
+        text = "START " + " ".join(f"filler{i}" for i in range(2000)) + " END"
+        packed = self.optimizer.summarize_context([{"role": "user", "content": text}])
+        content = packed[0]["content"]
+        self.assertTrue(content.startswith("START"))
+        self.assertTrue(content.endswith("END"))
+        self.assertIn(TokenOptimizer.TRUNCATION_MARKER, content)
+
+    def test_order_is_preserved(self):
+        messages = [{"role": "user", "content": f"message number {i}"} for i in range(5)]
+        packed = self.optimizer.summarize_context(messages)
+        self.assertEqual([m["content"] for m in packed], [m["content"] for m in messages])
+
+
+@unittest.skipUnless(_encoding_available(), "tiktoken encoding not available")
+class TestOptimizePayloadDedup(unittest.TestCase):
+    def test_report_records_tokens_saved(self):
+        optimizer = TokenOptimizer(max_tokens=100_000)
+        messages = [{"role": "tool", "content": TOOL_OUTPUT}] * 3
+        optimized = optimizer.optimize_payload(messages)
+        self.assertEqual(len(optimized), 3)
+        self.assertEqual(optimizer.last_report["dedup"]["exact_duplicates"], 2)
+        self.assertGreater(optimizer.last_report["dedup"]["tokens_saved"], 0)
+
+    def test_counts_match_returned_messages(self):
+        optimizer = TokenOptimizer(max_tokens=60, min_message_tokens=4)
+        messages = [{"role": "user", "content": " ".join(f"w{i}" for i in range(200))},
+                    {"role": "assistant", "content": "Short reply."}]
+        payload = optimizer.optimize_payload_with_counts(messages)
+        self.assertEqual(len(payload["token_counts"]), len(payload["messages"]))
+        for msg, count in zip(payload["messages"], payload["token_counts"]):
+            self.assertEqual(count, optimizer.estimate_tokens(msg["content"]))
+        self.assertEqual(payload["input_tokens"], sum(payload["token_counts"]))
+
+    def test_batch_matches_individual_results(self):
+        optimizer = TokenOptimizer(max_tokens=80, min_message_tokens=4)
+        shared = {"role": "system", "content": "Shared   instructions for every sub-agent."}
+        payloads = [[shared, {"role": "user", "content": f"task {i} " + "detail " * 60}] for i in range(4)]
+        payloads.append([])
+        batch = optimizer.optimize_payloads_with_counts(payloads, report_savings=True)
+        self.assertEqual(len(batch), len(payloads))
+        for messages, result in zip(payloads, batch):
+            single = optimizer.optimize_payload_with_counts(messages, report_savings=True)
+            self.assertEqual(result["messages"], single["messages"])
+            self.assertEqual(result["token_counts"], single["token_counts"])
+            self.assertEqual(result["report"], single["report"])
+
+    def test_report_records_minify_savings_per_type(self):
+        optimizer = TokenOptimizer(max_tokens=100_000)
+        messages = [{"role": "tool", "content": '{\n    "status":   "ok",\n    "rows": [1, 2, 3]\n}'}]
+        optimized = optimizer.optimize_payload(messages)
+        self.assertEqual(optimized[0]["content"], '{"status":"ok","rows":[1,2,3]}')
+        self.assertGreater(optimizer.last_report["minify"]["json"], 0)
+
+    def test_stubs_point_into_the_packed_output(self):
+        optimizer = TokenOptimizer(max_tokens=300, min_message_tokens=8)
+        notes = [{"role": "user", "content": f"note {i}: " + " ".join(f"w{i}_{j}" for j in range(60))}
+                 for i in range(30)]
+        tool = {"role": "tool", "content": TOOL_OUTPUT}
+
+        packed = optimizer.optimize_payload_with_counts([tool] + notes + [tool, {"role": "user", "content": "Next?"}])
+        contents = [m["content"] for m in packed["messages"]]
+        stubs = [re.fullmatch(r"\[duplicate of message (\d+) omitted\]", c) for c in contents]
+        self.assertEqual(sum(1 for s in stubs if s), 1)
+        self.assertTrue(stubs[0])  # kept whole, though far older than the notes that were cut
+        self.assertTrue(contents[int(stubs[0].group(1))].startswith("file listing"))
+        self.assertLess(len(contents), 33)  # older notes were dropped, so the index moved
+
+        # The kept copy is too old to fit: its stub goes with it
+        packed = optimizer.optimize_payload_with_counts([tool, tool] + notes)
+        self.assertFalse(any("file listing" in m["content"] or "duplicate" in m["content"]
+                             for m in packed["messages"]))
+
+    def test_minify_savings_are_only_counted_on_request(self):
+        optimizer = TokenOptimizer(max_tokens=100_000)
+        messages = [{"role": "tool", "content": '{\n    "status":   "ok"\n}'}]
+        counted = []
+        count = optimizer.estimate_tokens
+        optimizer.estimate_tokens = lambda text: counted.append(text) or count(text)
+        payload = optimizer.optimize_payload_with_counts(messages)
+        self.assertEqual(payload["report"]["minify"], {})
+        self.assertEqual(counted, [])
+        payload = optimizer.optimize_payload_with_counts(messages, report_savings=True)
+        self.assertGreater(payload["report"]["minify"]["json"], 0)
+        self.assertEqual(len(counted), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,181 @@
 import re
+import random
+import zlib
+import time
+import hashlib
 import tiktoken
+from content_minifier import minify_content
+from latency_stats import LATENCY
+
+# Rolling-hash parameters for word shingles (Mersenne prime modulus).
+_HASH_MOD = (1 << 61) - 1
+_HASH_BASE = 1_000_003
+
+DUPLICATE_STUB = "[duplicate of message {index} omitted]"
+NEAR_DUPLICATE_STUB = "[near-duplicate of message {index} omitted]"
+
+
+def _shingle_hashes(text, shingle_size=5):
+    """
+    Returns the set of rolling polynomial hashes of every window of
+    `shingle_size` consecutive words in text, in one pass over the words.
+    """
+    words = [zlib.crc32(w.encode("utf-8")) for w in text.split()]
+    if not words:
+        return set()
+    k = min(shingle_size, len(words))
+    drop = pow(_HASH_BASE, k - 1, _HASH_MOD)
+    h = 0
+    for w in words[:k]:
+        h = (h * _HASH_BASE + w) % _HASH_MOD
+    hashes = {h}
+    for i in range(k, len(words)):
+        h = ((h - words[i - k] * drop) * _HASH_BASE + words[i]) % _HASH_MOD
+        hashes.add(h)
+    return hashes
+
+
+def _minhash_permutations(num_perm, seed=1):
+    rng = random.Random(seed)
+    return [(rng.randrange(1, _HASH_MOD), rng.randrange(0, _HASH_MOD)) for _ in range(num_perm)]
+
+
+def _minhash_signature(shingles, permutations):
+    return tuple(min((a * h + b) % _HASH_MOD for h in shingles) for a, b in permutations)
+
+
+def allocate_budget(demands, weights, budget):
+    """
+    Splits budget across items in proportion to weights without giving any item
+    more than its demand (weighted water-filling). Items are visited in order of
+    demand/weight and a single pass over the running demand prefix sum finds the
+    fill level; surplus from small items flows to the larger ones.
+    Returns a list of integer allocations aligned with demands.
+    """
+    budget = max(0, int(budget))
+    if sum(demands) <= budget:
+        return list(demands)
+
+    order = sorted((i for i in range(len(demands)) if weights[i] > 0),
+                   key=lambda i: demands[i] / weights[i])
+    satisfied = 0           # prefix sum of demands that fit completely
+    open_weight = sum(weights[i] for i in order)
+    level = None
+    for i in order:
+        ratio = demands[i] / weights[i]
+        if satisfied + ratio * open_weight >= budget:
+            level = (budget - satisfied) / open_weight
+            break
+        satisfied += demands[i]
+        open_weight -= weights[i]
+
+    allocation = [0] * len(demands)
+    for i in order:
+        allocation[i] = demands[i] if level is None else min(demands[i], int(level * weights[i]))
+    return allocation
+
+
+def dedupe_messages(messages, count_tokens, near_duplicate_threshold=None,
+                    num_perm=32, band_rows=4, shingle_size=5, min_chars=64):
+    """
+    Collapses repeated message contents into short reference stubs.
+
+    The most recent copy of a content is kept verbatim (it is the one that
+    recency-based truncation preserves); earlier copies are replaced by a stub
+    naming the index of the kept message. Exact duplicates are matched by a
+    content digest of the whitespace-normalized text. When
+    near_duplicate_threshold is set, MinHash signatures over rolling word
+    shingle hashes are bucketed with LSH banding, so near-duplicates whose
+    estimated Jaccard similarity reaches the threshold are collapsed too.
+    System or pinned messages and contents shorter than min_chars are never
+    stubbed. TokenOptimizer renumbers the stubs against its packed output,
+    and drops those whose message did not fit.
+
+    Runs in a single pass over the payload and returns (messages, report).
+    """
+    return _dedupe_messages(messages, count_tokens, near_duplicate_threshold,
+                            num_perm, band_rows, shingle_size, min_chars)[:2]
+
+
+def _dedupe_messages(messages, count_tokens, near_duplicate_threshold=None,
+                     num_perm=32, band_rows=4, shingle_size=5, min_chars=64):
+    """dedupe_messages that also returns {stub index: (stub template, kept index)}."""
+    stubs = {}
+    report = {"exact_duplicates": 0, "near_duplicates": 0, "tokens_saved": 0}
+    result = list(messages)
+    seen = {}
+    permutations = _minhash_permutations(num_perm) if near_duplicate_threshold else None
+    bands = num_perm // band_rows
+    buckets = {}
+    signatures = {}
+
+    for i in range(len(messages) - 1, -1, -1):
+        msg = messages[i]
+        content = msg.get("content", "")
+        if not isinstance(content, str) or len(content) < min_chars:
+            continue
+        normalized = " ".join(content.split())
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+        kept_index, kind, signature = seen.get(digest), "exact", None
+        shingles = _shingle_hashes(normalized, shingle_size) if kept_index is None and permutations else None
+        if shingles:  # whitespace-only content has none: exact matching only
+            signature = _minhash_signature(shingles, permutations)
+            kind = "near"
+            checked = set()
+            for band in range(bands):
+                key = (band, signature[band * band_rows:(band + 1) * band_rows])
+                for candidate in buckets.get(key, ()):
+                    if candidate in checked:
+                        continue
+                    checked.add(candidate)
+                    other = signatures[candidate]
+                    agreement = sum(1 for x, y in zip(signature, other) if x == y) / num_perm
+                    if agreement >= near_duplicate_threshold:
+                        kept_index = candidate
+                        break
+                if kept_index is not None:
+                    break
+
+        if kept_index is None or msg.get("role") == "system" or msg.get("pinned"):
+            seen.setdefault(digest, i)
+            if signature is not None:
+                signatures[i] = signature
+                for band in range(bands):
+                    key = (band, signature[band * band_rows:(band + 1) * band_rows])
+                    buckets.setdefault(key, []).append(i)
+            continue
+
+        template = DUPLICATE_STUB if kind == "exact" else NEAR_DUPLICATE_STUB
+        stub = template.format(index=kept_index)
+        result[i] = {**msg, "content": stub}
+        stubs[i] = (template, kept_index)
+        report[f"{kind}_duplicates"] += 1
+        report["tokens_saved"] += max(0, count_tokens(content) - count_tokens(stub))
+
+    return result, report, stubs
+
 
 class TokenOptimizer:
     """
     Module to reduce token usage by stripping redundant information
     and compressing context before sending to LLM.
     """
-    def __init__(self, max_history=10, max_tokens=4000, encoding_name="cl100k_base"):
+    TRUNCATION_MARKER = " [...] "
+
+    def __init__(self, max_history=10, max_tokens=4000, encoding_name="cl100k_base",
+                 dedupe=True, near_duplicate_threshold=None,
+                 role_weights=None, recency_decay=0.85, min_message_tokens=16,
+                 structure_aware=True):
         self.max_history = max_history
         self.max_tokens = max_tokens
+        self.role_weights = role_weights if role_weights is not None else {"tool": 0.5}
+        self.recency_decay = recency_decay
+        self.min_message_tokens = min_message_tokens
+        self.structure_aware = structure_aware
+        self.dedupe = dedupe
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.last_report = {}
         try:
             self.encoding = tiktoken.get_encoding(encoding_name)
         except ValueError:
@@ -21,37 +188,133 @@ class TokenOptimizer:
     def strip_redundant_whitespace(self, text):
         return re.sub(r'\s+', ' ', text).strip()
 
-    def summarize_context(self, history_messages):
+    def minify_content(self, text, savings=None):
         """
-        Optimizes a list of message dictionaries (e.g., from a conversation history)
-        to fit within max_tokens, prioritizing recent messages.
+        Minifies text by structure (see content_minifier): JSON is compacted,
+        code keeps its indentation, prose gets strip_redundant_whitespace.
+        Tokens saved per content type are accumulated into savings if given.
         """
+        if not self.structure_aware:
+            return self.strip_redundant_whitespace(text)
+        return minify_content(text, self.estimate_tokens if savings is not None else None, savings)
+
+    def is_pinned(self, msg):
+        """System messages and messages flagged with "pinned": True are always kept."""
+        return msg.get("role") == "system" or bool(msg.get("pinned"))
+
+    def message_weight(self, msg, age):
+        """
+        Share of the token budget a message may claim, relative to the others.
+        age is 0 for the newest message and grows towards the start of the history.
+        """
+        return self.role_weights.get(msg.get("role"), 1.0) * (self.recency_decay ** age)
+
+    def summarize_context(self, history_messages, savings=None):
+        """
+        Packs a list of message dictionaries (e.g., from a conversation history)
+        into max_tokens.
+
+        Pinned messages are kept whole, even if together they overflow max_tokens
+        (the other messages then get nothing). The remaining budget is split across the
+        other messages in proportion to message_weight (recency and role), with
+        messages that need less than their share giving the surplus back to the
+        rest. Messages that do not fit are truncated middle-out (head and tail
+        kept); messages whose share falls below min_message_tokens are dropped.
+        Minification savings per content type are accumulated into savings.
+        """
+        return self._pack(history_messages, savings)[0]
+
+    def _pack(self, history_messages, savings=None, stubs=None):
+        """summarize_context that also returns the token count of each kept message."""
         if not history_messages: # Handle empty history
-            return []
+            return [], []
+        contents = self._prepare_contents(history_messages, savings)
+        tokens = [self.encoding.encode(c) if isinstance(c, str) else [] for c in contents]
+        return self._pack_tokens(history_messages, contents, tokens, stubs)
 
-        current_token_count = 0
-        optimized_messages = []
+    def _prepare_contents(self, history_messages, savings=None):
+        return [self.minify_content(msg.get("content", ""), savings)
+                if isinstance(msg.get("content", ""), str) else msg.get("content")
+                for msg in history_messages]
 
-        # Process messages in reverse to prioritize most recent
-        for msg in reversed(history_messages):
-            content = msg.get("content", "")
-            clean_content = self.strip_redundant_whitespace(content)
-            msg_tokens = self.estimate_tokens(clean_content)
+    def _pack_tokens(self, history_messages, contents, tokens, stubs=None):
+        """
+        stubs maps dedupe stub indices to (template, kept index). Stubs are
+        never truncated: each is kept whole while the message it points at
+        is, and renumbered to that message's position in the packed output.
+        """
+        if not history_messages:
+            return [], []
+        stubs = stubs or {}
+        pinned = [i for i, msg in enumerate(history_messages) if self.is_pinned(msg)]
+        others = [i for i, msg in enumerate(history_messages) if not self.is_pinned(msg) and i not in stubs]
+        last = len(history_messages) - 1
+
+        # Pinned content is never cut, so it is not offered to allocate_budget
+        budgets = {i: len(tokens[i]) for i in pinned}
+        remaining = max(0, self.max_tokens - sum(budgets.values()))
+        stub_tokens = sum(len(tokens[i]) for i in stubs)
+        if stub_tokens > remaining:
+            stubs = {}  # no room for the markers either: drop them all
+        else:
+            remaining -= stub_tokens
+        other_alloc = allocate_budget(
+            [len(tokens[i]) for i in others],
+            [self.message_weight(history_messages[i], last - i) for i in others],
+            remaining,
+        )
+        budgets.update(zip(others, other_alloc))
+
+        kept = {}  # index -> (content, token count)
+        for i in budgets:
+            budget = budgets[i]
+            if budget >= len(tokens[i]):
+                kept[i] = (contents[i], len(tokens[i]))
+            elif budget >= self.min_message_tokens:
+                text = self._middle_out(tokens[i], budget)
+                kept[i] = (text, self.estimate_tokens(text))
+        for i, (_, target) in stubs.items():
+            if target in kept:
+                kept[i] = None
 
-            if current_token_count + msg_tokens <= self.max_tokens:
-                optimized_messages.insert(0, {**msg, "content": clean_content})
-                current_token_count += msg_tokens
+        order = sorted(kept)
+        position = {i: n for n, i in enumerate(order)}
+        optimized_messages = []
+        token_counts = []
+        for i in order:
+            out = {k: v for k, v in history_messages[i].items() if k != "pinned"}
+            if kept[i] is None:
+                template, target = stubs[i]
+                content = template.format(index=position[target])
+                count = len(tokens[i]) if content == contents[i] else self.estimate_tokens(content)
             else:
-                # If adding the whole message exceeds limit, try truncating
-                remaining_tokens = self.max_tokens - current_token_count
-                if remaining_tokens > 0:
-                    truncated_content = self.truncate_text_by_tokens(clean_content, remaining_tokens)
-                    if truncated_content:
-                        optimized_messages.insert(0, {**msg, "content": truncated_content})
-                        current_token_count += self.estimate_tokens(truncated_content)
-                break # Stop adding messages once limit is hit
-        
-        return optimized_messages
+                content, count = kept[i]
+            out["content"] = content
+            optimized_messages.append(out)
+            token_counts.append(count)
+
+        return optimized_messages, token_counts
+
+    def truncate_middle_out(self, text, max_tokens):
+        """
+        Truncates text to fit within max_tokens, keeping its head and tail and
+        replacing the middle with TRUNCATION_MARKER.
+        """
+        return self._middle_out(self.encoding.encode(text), max_tokens)
+
+    def _middle_out(self, tokens, max_tokens):
+        if len(tokens) <= max_tokens:
+            return self.encoding.decode(tokens)
+        marker_tokens = len(self.encoding.encode(self.TRUNCATION_MARKER))
+        keep = max_tokens - marker_tokens
+        if keep <= 0:
+            return self.encoding.decode(tokens[:max(0, max_tokens)])
+        head = (keep + 1) // 2
+        tail = keep - head
+        text = self.encoding.decode(tokens[:head]) + self.TRUNCATION_MARKER
+        if tail:
+            text += self.encoding.decode(tokens[-tail:])
+        return text
 
     def truncate_text_by_tokens(self, text, max_tokens):
         """
@@ -63,12 +326,111 @@ class TokenOptimizer:
         
         return self.encoding.decode(tokens[:max_tokens])
 
+    def dedupe_messages(self, messages):
+        """
+        Collapses duplicate (and, if configured, near-duplicate) message
+        contents into reference stubs. Returns (messages, report).
+        """
+        return self._dedupe(messages)[:2]
+
+    def _dedupe(self, messages):
+        """dedupe_messages that also returns the stub map _pack_tokens renumbers."""
+        return _dedupe_messages(messages, self.estimate_tokens,
+                                near_duplicate_threshold=self.near_duplicate_threshold)
+
     def optimize_payload(self, messages):
         """
         Main entry point for optimizing the entire payload (list of messages).
-        This will use summarize_context to manage overall token count.
+        Duplicates are collapsed first, then summarize_context manages the
+        overall token count. Per-request savings (dedup and minification per
+        content type) are left in self.last_report.
         """
-        return self.summarize_context(messages)
+        return self.optimize_payload_with_counts(messages, report_savings=True)["messages"]
+
+    def optimize_payload_with_counts(self, messages, report_savings=False):
+        """
+        Same as optimize_payload, but returns the exact tiktoken counts computed
+        along the way so callers never need to re-join or re-estimate:
+            {"messages": [...], "token_counts": [...], "input_tokens": int,
+             "report": {"dedup": {...}, "minify": {...}}}
+        token_counts is aligned with messages and counts message content only.
+        Minification savings cost two extra tokenizations per changed segment,
+        so "minify" stays empty unless report_savings is set.
+        Step timings go to latency_stats.LATENCY ("optimizer.*") when enabled.
+        """
+        t0 = time.perf_counter_ns() if LATENCY.enabled else 0
+        report = {"exact_duplicates": 0, "near_duplicates": 0, "tokens_saved": 0}
+        stubs = None
+        if self.dedupe and messages:
+            messages, report, stubs = self._dedupe(messages)
+        if t0:
+            t0 = LATENCY.lap("optimizer.dedupe", t0)
+        savings = {} if report_savings else None
+        if not t0:
+            optimized, token_counts = self._pack(messages, savings, stubs)
+        elif not messages:
+            optimized, token_counts = [], []
+        else:
+            # _pack split up so each step is timed on its own
+            contents = self._prepare_contents(messages, savings)
+            t0 = LATENCY.lap("optimizer.minify", t0)
+            tokens = [self.encoding.encode(c) if isinstance(c, str) else [] for c in contents]
+            t0 = LATENCY.lap("optimizer.tokenize", t0)
+            optimized, token_counts = self._pack_tokens(messages, contents, tokens, stubs)
+            LATENCY.lap("optimizer.pack", t0)
+        self.last_report = {"dedup": report, "minify": savings or {}}
+        return {
+            "messages": optimized,
+            "token_counts": token_counts,
+            "input_tokens": sum(token_counts),
+            "report": self.last_report,
+        }
+
+    def optimize_payloads_with_counts(self, payloads, report_savings=False):
+        """
+        optimize_payload_with_counts for many payloads at once. Contents shared
+        between payloads (system prompts, common context) are minified and
+        tokenized once, and all distinct contents are tokenized in a single
+        encode_batch call, which tiktoken spreads across threads. Each payload
+        is then packed on its own. Returns one result dict per payload, in order;
+        report_savings as for optimize_payload_with_counts.
+        """
+        minified = {}   # original content -> (minified content, savings per type)
+        prepared = []
+        for messages in payloads:
+            report = {"exact_duplicates": 0, "near_duplicates": 0, "tokens_saved": 0}
+            stubs = None
+            if self.dedupe and messages:
+                messages, report, stubs = self._dedupe(messages)
+            savings = {}
+            contents = []
+            for msg in messages:
+                content = msg.get("content", "")
+                if isinstance(content, str):
+                    if content not in minified:
+                        delta = {}
+                        minified[content] = (self.minify_content(content, delta if report_savings else None), delta)
+                    content, delta = minified[content]
+                    for kind, saved in delta.items():
+                        savings[kind] = savings.get(kind, 0) + saved
+                contents.append(content)
+            prepared.append((messages, contents, stubs, {"dedup": report, "minify": savings}))
+
+        distinct = list({c: None for _, contents, _, _ in prepared for c in contents if isinstance(c, str)})
+        encoded = dict(zip(distinct, self.encoding.encode_batch(distinct))) if distinct else {}
+
+        results = []
+        for messages, contents, stubs, report in prepared:
+            tokens = [encoded[c] if isinstance(c, str) else [] for c in contents]
+            optimized, token_counts = self._pack_tokens(messages, contents, tokens, stubs)
+            results.append({
+                "messages": optimized,
+                "token_counts": token_counts,
+                "input_tokens": sum(token_counts),
+                "report": report,
+            })
+            self.last_report = report
+        return results
 
 if __name__ == "__main__":
     optimizer = TokenOptimizer(max_tokens=50)
@@ -93,12 +455,12 @@ if __name__ == "__main__":
 
     print("\n--- Original History ---")
     for i, msg in enumerate(history):
-        print(f"Msg {i+1} ({optimizer.estimate_tokens(msg["content"])} tokens): {msg["content"][:50]}...")
+        print(f"Msg {i+1} ({optimizer.estimate_tokens(msg['content'])} tokens): {msg['content'][:50]}...")
 
     optimized_history = optimizer.optimize_payload(history)
     print("\n--- Optimized History (Max 50 tokens) ---")
     for i, msg in enumerate(optimized_history):
-        print(f"Msg {i+1} ({optimizer.estimate_tokens(msg["content"])} tokens): {msg["content"][:50]}...")
+        print(f"Msg {i+1} ({optimizer.estimate_tokens(msg['content'])} tokens): {msg['content'][:50]}...")
 
     # Test with a very long single message to see truncation
     print("\n--- Very Long Single Message Test ---")
@@ -108,4 +470,4 @@ if __name__ == "__main__":
     optimized_long_message = optimizer.optimize_payload(long_message_history)
     print("Optimized single message:")
     for msg in optimized_long_message:
-        print(f"({optimizer.estimate_tokens(msg["content"])} tokens): {msg["content"][:100]}...")
+        print(f"({optimizer.estimate_tokens(msg['content'])} tokens): {msg['content'][:100]}...")